@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""Compare k nearest lookups per second of storjnode.network.routing_index
+with pushing every contact onto a heap by Node.distanceTo."""
+import os
+import sys
+import time
+import heapq
+import argparse
+from kademlia.node import Node as KademliaNode
+from storjnode.network.routing_index import RoutingIndex
+
+
+def _parse_args(args):
+    parser = argparse.ArgumentParser(description="Routing lookup benchmark.")
+    default = 10000
+    msg = "Number of contacts. Default: {0}"
+    parser.add_argument("--contacts", default=default, type=int,
+                        help=msg.format(default))
+    default = 20
+    msg = "Nodes per lookup. Default: {0}"
+    parser.add_argument("--k", default=default, type=int,
+                        help=msg.format(default))
+    default = 3.0
+    msg = "Seconds to run each benchmark. Default: {0}"
+    parser.add_argument("--seconds", default=default, type=float,
+                        help=msg.format(default))
+    return vars(parser.parse_args(args=args))
+
+
+def heap_nearest(contacts, target, k):
+    nodes = []
+    for neighbor in contacts:
+        heapq.heappush(nodes, (target.distanceTo(neighbor), neighbor))
+    return [node for distance, node in heapq.nsmallest(k, nodes)]
+
+
+def lookups_per_second(func, seconds):
+    count = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        func(KademliaNode(os.urandom(20)))
+        count += 1
+    return count / (time.time() - start)
+
+
+if __name__ == "__main__":
+    arguments = _parse_args(sys.argv[1:])
+    k = arguments["k"]
+    seconds = arguments["seconds"]
+
+    contacts = [KademliaNode(os.urandom(20), "127.0.0.1", 1234)
+                for i in range(arguments["contacts"])]
+    index = RoutingIndex()
+    start = time.time()
+    for contact in contacts:
+        index.add(contact)
+    print("index {0} contacts: {1:.3f}s".format(len(contacts),
+                                                time.time() - start))
+
+    target = KademliaNode(os.urandom(20))
+    expected = [n.id for n in heap_nearest(contacts, target, k)]
+    assert([n.id for n in index.nearest(target.long_id, k)] == expected)
+
+    results = [
+        ("heap", lambda t: heap_nearest(contacts, t, k)),
+        ("index", lambda t: index.nearest(t.long_id, k)),
+    ]
+    for name, func in results:
+        print("{0}: {1:.1f} lookups/s".format(
+            name, lookups_per_second(func, seconds)
+        ))
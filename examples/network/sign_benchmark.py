@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Compare sign/verify ops per second of storjnode.network.message with
+creating a BtcTxStore and parsing the key for every call."""
+import sys
+import time
+import argparse
+import binascii
+from collections import OrderedDict
+from btctxstore import BtcTxStore
+from storjnode.util import address_to_node_id, node_id_to_address
+from storjnode.network.message import sign, verify_signature
+
+
+def _parse_args(args):
+    parser = argparse.ArgumentParser(description="Sign/verify benchmark.")
+    default = 3.0
+    msg = "Seconds to run each benchmark. Default: {0}"
+    parser.add_argument("--seconds", default=default, type=float,
+                        help=msg.format(default))
+    return vars(parser.parse_args(args=args))
+
+
+def uncached_sign(dict_obj, wif):
+    api = BtcTxStore(testnet=False, dryrun=True)
+    msg = binascii.hexlify(str(dict_obj).encode("ascii")).decode("utf-8")
+    dict_obj[u"signature"] = api.sign_data(wif, msg).decode("utf-8")
+    return dict_obj
+
+
+def uncached_verify(msg, node_id):
+    msg = msg.copy()
+    sig = msg.pop("signature")
+    api = BtcTxStore(testnet=False, dryrun=True)
+    address = node_id_to_address(node_id)
+    return api.verify_signature_unicode(address, sig, str(msg))
+
+
+def ops_per_second(func, seconds):
+    count = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        func()
+        count += 1
+    return count / (time.time() - start)
+
+
+if __name__ == "__main__":
+    arguments = _parse_args(sys.argv[1:])
+    seconds = arguments["seconds"]
+
+    api = BtcTxStore(testnet=False, dryrun=True)
+    wif = api.create_key()
+    node_id = address_to_node_id(api.get_address(wif))
+
+    def contract():
+        return OrderedDict([(u"status", u"SYN"), (u"data_id", u"00" * 32)])
+
+    signed = sign(contract(), wif)
+    assert(uncached_verify(signed, node_id))
+
+    results = [
+        ("sign uncached", lambda: uncached_sign(contract(), wif)),
+        ("sign cached", lambda: sign(contract(), wif)),
+        ("verify uncached", lambda: uncached_verify(signed, node_id)),
+        ("verify cached", lambda: verify_signature(signed, wif, node_id)),
+    ]
+    for name, func in results:
+        print("{0}: {1:.1f} ops/s".format(name, ops_per_second(func, seconds)))
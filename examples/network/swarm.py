@@ -28,6 +28,10 @@ def _parse_args(args):
     parser.add_argument('--isolate', action='store_true',
                         help="Isolate swarm form main network.")
 
+    # threadless
+    parser.add_argument('--threadless', action='store_true',
+                        help="Drive nodes from the reactor, no poll threads.")
+
     # ports
     default = 5000
     msg = "Where swarm ports start from. Default: {0}"
@@ -57,8 +61,10 @@ if __name__ == "__main__":
         for i in range(arguments["size"]):
             port = arguments["ports"] + i
             node_key = btctxstore.create_key()
-            peer = storjnode.network.Node(node_key, port=port,
-                                          bootstrap_nodes=bootstrap_nodes)
+            peer = storjnode.network.Node(
+                node_key, port=port, bootstrap_nodes=bootstrap_nodes,
+                threadless=arguments["threadless"]
+            )
             swarm.append(peer)
             print("Started peer {0} on port {1}.".format(i, port))
             time.sleep(0.1)
@@ -9,6 +9,21 @@ from . import messages  # NOQA
 from . import map  # NOQA
 from . import monitor  # NOQA
 from . import repeat_relay  # NOQA
+from . import shard_io  # NOQA
+from . import transfer_engine  # NOQA
+from . import multiplex  # NOQA
+from . import message_router  # NOQA
+from . import wakeup  # NOQA
+from . import handler_pool  # NOQA
+from . import contract_codec  # NOQA
+from . import dedup  # NOQA
+from . import relay_cache  # NOQA
+from . import unl_cache  # NOQA
+from . import correlation  # NOQA
+from . import routing_index  # NOQA
+from . import dht_storage  # NOQA
+from . import dht_cache  # NOQA
+from . import dht_batch  # NOQA
 from . node import Node  # NOQA
 from . node import DEFAULT_BOOTSTRAP_NODES  # NOQA
 from . protocol import Protocol  # NOQA
@@ -10,6 +10,7 @@ import copy
 from storjnode.network.bandwidth.constants import ONE_MB
 import storjnode.storage.manager
 from storjnode.network.message import verify_signature
+from storjnode.network.repeat_relay import cancel_relay
 from storjnode.util import parse_node_id_from_unl
 from storjnode.util import list_to_ordered_dict
 
@@ -219,6 +220,10 @@ def handle_responses_builder(self):
             _log.debug("res: their sig did not match")
             return -5
 
+        # Got an answer, stop asking.
+        cancel_relay(self.api, self.request_relay_id)
+        self.request_relay_id = None
+
         # Set active node ID.
         self.test_node_unl = msg[u"requestee"]
 
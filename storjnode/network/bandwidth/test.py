@@ -10,6 +10,7 @@ import time
 import tempfile
 import copy
 import pyp2p
+import pyp2p.dht_msg
 import storjnode.storage.manager
 from storjnode.network.bandwidth.constants import ONE_MB
 from storjnode.network.bandwidth.do_requests \
@@ -20,6 +21,7 @@ from storjnode.storage.shard import get_hash
 from storjnode.network.process_transfers import process_transfers
 from storjnode.network.file_transfer import FileTransfer
 from storjnode.network.message import sign
+from storjnode.network.repeat_relay import cancel_relay
 from storjnode.util import address_to_node_id, parse_node_id_from_unl
 from storjnode.util import generate_random_file, ordered_dict_to_list
 from twisted.internet import defer
@@ -56,6 +58,9 @@ class BandwidthTest():
         # The data_id / hash of the current random file being transferred.
         self.data_id = None
 
+        # Rebroadcast of the test request, cancelled by the response.
+        self.request_relay_id = None
+
         # Size in MB of current test - will increase if increasing_tests
         # is enabled.
         self.test_size = 1  # MB
@@ -106,8 +111,16 @@ class BandwidthTest():
 
     # Allow this node to respond to bandwidth tests.
     def enable(self):
-        self.api.add_message_handler(self.handle_requests)
-        self.api.add_message_handler(self.handle_responses)
+        # pyp2p's DHT has no typed message handlers.
+        if isinstance(self.api, pyp2p.dht_msg.DHT):
+            self.api.add_message_handler(self.handle_requests)
+            self.api.add_message_handler(self.handle_responses)
+            return self
+
+        self.api.add_message_handler(self.handle_requests,
+                                     types=["test_bandwidth_request"])
+        self.api.add_message_handler(self.handle_responses,
+                                     types=["test_bandwidth_response"])
 
         return self
 
@@ -165,6 +178,8 @@ class BandwidthTest():
         self.results = self.setup_results()
         self.test_node_unl = None
         self.start_time = time.time()
+        cancel_relay(self.api, self.request_relay_id)
+        self.request_relay_id = None
         self.handlers = {
             "accept": set(),
             "complete": set(),
@@ -303,7 +318,7 @@ class BandwidthTest():
         # Send request.
         node_id = parse_node_id_from_unl(node_unl)
         req = ordered_dict_to_list(req)
-        self.api.repeat_relay_message(node_id, req)
+        self.request_relay_id = self.api.repeat_relay_message(node_id, req)
 
         # Set start time.
         self.start_time = time.time()
@@ -0,0 +1,233 @@
+"""
+Compact binary encoding of file transfer handshake messages.
+
+SYN, SYN-ACK, ACK and RST messages were sent as zlib compressed python
+literals and parsed with literal_eval. With this encoding they are sent as
+
+    MAGIC + msgpack([version, unls, fields])
+
+* fields is a flat [key, value, key, value, ...] list. Known keys are
+  replaced by small integers, positive if their value is a unicode string
+  and negative if it is a byte string, so the decoded message is identical
+  to the encoded one (signatures and contract IDs are computed over its
+  python representation.)
+* Statuses are integers, data IDs and contract IDs are 32 raw bytes,
+  signatures are 65 raw bytes.
+* UNLs are stored once (raw bytes) in the unls table and referenced by
+  index, a SYN-ACK or ACK otherwise repeats them for every nested message.
+* Nested messages (the SYN of a SYN-ACK) are field lists themselves.
+* Unknown keys and values that can't be packed losslessly are sent as is.
+
+The encoding is deterministic, equal messages always give the same bytes.
+
+decode() returns the message as a list of (key, value) pairs, the same as
+the old format, so it can be passed to file_handshake.protocol.
+"""
+
+import six
+import base64
+import binascii
+import umsgpack
+from collections import OrderedDict
+
+
+CONTRACT_FORMAT_VERSION = 1
+MAGIC = b"\xc1"  # unused by msgpack, not the start of zlib data
+
+
+STATUSES = [u"SYN", u"SYN-ACK", u"ACK", u"RST"]
+
+
+# Field kinds.
+_STATUS = 0
+_HEX = 1
+_B64 = 2
+_UNL = 3
+_INT = 4
+_MESSAGE = 5
+
+
+# {key: (code, kind)}
+FIELDS = OrderedDict([
+    (u"status", (1, _STATUS)),
+    (u"contract_id", (2, _HEX)),
+    (u"data_id", (3, _HEX)),
+    (u"file_size", (4, _INT)),
+    (u"host_unl", (5, _UNL)),
+    (u"dest_unl", (6, _UNL)),
+    (u"src_unl", (7, _UNL)),
+    (u"offset", (8, _INT)),
+    (u"mux", (9, _INT)),
+    (u"signature", (10, _B64)),
+    (u"syn", (11, _MESSAGE)),
+    (u"syn_ack", (12, _MESSAGE)),
+])
+CODES = dict((code, (key, kind)) for key, (code, kind) in FIELDS.items())
+
+
+class ContractFormatError(ValueError):
+    pass
+
+
+def is_compact(data):
+    return isinstance(data, bytes) and data[:1] == MAGIC
+
+
+def _to_text(value):
+    if isinstance(value, six.text_type):
+        return value
+    return value.decode("ascii")
+
+
+def _from_text(value, text):
+    if text:
+        return value
+    return value.encode("ascii")
+
+
+def _pack_string(kind, value, unls, unl_index):
+    # Returns: Packed value or None if it can't be restored exactly.
+    try:
+        text = _to_text(value)
+    except UnicodeDecodeError:
+        return None
+
+    if kind == _STATUS:
+        if text in STATUSES:
+            return STATUSES.index(text)
+        return None
+
+    if kind == _HEX:
+        if len(text) % 2 or text != text.lower():
+            return None
+        try:
+            return binascii.unhexlify(text.encode("ascii"))
+        except (TypeError, ValueError, binascii.Error):
+            return None
+
+    # _B64 and _UNL
+    try:
+        raw = base64.b64decode(text.encode("ascii"))
+    except (TypeError, ValueError, binascii.Error):
+        return None
+    if base64.b64encode(raw).decode("ascii") != text:
+        return None
+    if kind == _B64:
+        return raw
+    if raw not in unl_index:
+        unl_index[raw] = len(unls)
+        unls.append(raw)
+    return unl_index[raw]
+
+
+def _is_plain(value):
+    if value is None or isinstance(value, bool):
+        return True
+    if isinstance(value, six.integer_types):
+        return type(value) == int  # python 2 longs are unpacked as int
+    return isinstance(value, (float, six.text_type, bytes))
+
+
+def _encode_fields(msg, unls, unl_index):
+    fields = []
+    for key, value in msg.items():
+        field = FIELDS.get(key) if isinstance(key, six.text_type) else None
+        packed = None
+        if field is not None:
+            code, kind = field
+            if kind == _MESSAGE:
+                if type(value) == OrderedDict:
+                    packed = _encode_fields(value, unls, unl_index)
+            elif kind == _INT:
+                if type(value) == int:
+                    packed = value
+            elif isinstance(value, (six.text_type, bytes)):
+                packed = _pack_string(kind, value, unls, unl_index)
+                if not isinstance(value, six.text_type):
+                    code = -code
+
+        if packed is not None:
+            fields.extend([code, packed])
+        elif isinstance(key, (six.text_type, bytes)) and _is_plain(value):
+            fields.extend([key, value])
+        else:
+            raise ContractFormatError("Can't encode {0}.".format(repr(key)))
+
+    return fields
+
+
+def encode(msg):
+    """Encode a handshake message (OrderedDict).
+
+    Raises:
+        ContractFormatError if it contains values that can't be encoded.
+    """
+    assert(type(msg) == OrderedDict)
+    unls = []
+    fields = _encode_fields(msg, unls, {})
+    return MAGIC + umsgpack.packb([CONTRACT_FORMAT_VERSION, unls, fields])
+
+
+def _unpack_value(kind, value, text, unls):
+    if kind in (_HEX, _B64):
+        if not isinstance(value, bytes):
+            raise ContractFormatError("Expected bytes.")
+    elif not isinstance(value, six.integer_types) or \
+            isinstance(value, bool):
+        raise ContractFormatError("Expected integer.")
+
+    if kind == _STATUS:
+        if not 0 <= value < len(STATUSES):
+            raise ContractFormatError("Unknown status.")
+        return _from_text(STATUSES[value], text)
+    if kind == _HEX:
+        return _from_text(binascii.hexlify(value).decode("ascii"), text)
+    if kind == _B64:
+        return _from_text(base64.b64encode(value).decode("ascii"), text)
+    if kind == _UNL:
+        if not 0 <= value < len(unls):
+            raise ContractFormatError("Unknown UNL.")
+        return _from_text(base64.b64encode(unls[value]).decode("ascii"), text)
+    return value  # _INT
+
+
+def _decode_fields(fields, unls):
+    if not isinstance(fields, list) or len(fields) % 2:
+        raise ContractFormatError("Invalid fields.")
+
+    pairs = []
+    for i in range(0, len(fields), 2):
+        key, value = fields[i], fields[i + 1]
+        if isinstance(key, six.integer_types) and \
+                not isinstance(key, bool):
+            if abs(key) not in CODES:
+                raise ContractFormatError("Unknown field {0}.".format(key))
+            key, kind = CODES[abs(key)]
+            if kind == _MESSAGE:
+                value = _decode_fields(value, unls)
+            else:
+                value = _unpack_value(kind, value, fields[i] > 0, unls)
+        pairs.append((key, value))
+
+    return pairs
+
+
+def decode(data):
+    """Decode a compact handshake message.
+
+    Returns: List of (key, value) pairs, nested messages as lists too.
+
+    Raises:
+        ContractFormatError if data isn't a valid compact message.
+    """
+    if not is_compact(data):
+        raise ContractFormatError("Not a compact contract.")
+    try:
+        version, unls, fields = umsgpack.unpackb(data[1:])
+        if version != CONTRACT_FORMAT_VERSION:
+            raise ContractFormatError("Unsupported version.")
+        return _decode_fields(fields, unls)
+    except ContractFormatError:
+        raise
+    except Exception as e:
+        raise ContractFormatError(repr(e))
@@ -0,0 +1,157 @@
+"""
+Match responses to the requests they answer.
+
+Requests carry a random request_id that responses echo. Pending requests
+are kept in a table keyed by it, so a response is routed to its request in
+one lookup instead of every request registering its own message handler,
+and requests that get no response errback with RequestTimeout instead of
+waiting (and keeping their handler) forever.
+
+Nodes that don't know request ids answer without one. Such responses go to
+the oldest pending request registered for the peer get_peer reads from the
+response, read_response still has to verify the response came from it.
+"""
+
+import os
+import six
+import binascii
+import traceback
+import storjnode
+from threading import Lock
+from twisted.internet import defer
+from storjnode.network.repeat_relay import RELAY_EXPIRY
+
+
+_log = storjnode.log.getLogger(__name__)
+
+
+REQUEST_TIMEOUT = RELAY_EXPIRY  # seconds, requests aren't rebroadcast longer
+
+
+class RequestTimeout(Exception):
+    pass
+
+
+def new_request_id():
+    return binascii.hexlify(os.urandom(16)).decode("ascii")
+
+
+def get_request_id(message):
+    """Returns: The request_id of a message (list of pairs) or None."""
+    if not isinstance(message, list):
+        return None
+    for item in message:
+        if isinstance(item, (list, tuple)) and len(item) == 2 and \
+                item[0] == u"request_id":
+            if isinstance(item[1], six.string_types):
+                return item[1]
+            return None
+    return None
+
+
+class Correlator(object):
+
+    def __init__(self, reactor=None, get_peer=None):
+        """
+        Args:
+            get_peer: Optional callable returning the peer a response without
+                      request id claims to be from.
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.get_peer = get_peer
+        self.pending = {}  # {request_id: (deferred, read_response, peer)}
+        self.peers = {}  # {peer: [request_id, ...]} oldest first
+        self.timeouts = 0
+        self.mutex = Lock()
+
+    def register(self, read_response, timeout=REQUEST_TIMEOUT, peer=None):
+        """Add a pending request.
+
+        Args:
+            read_response: Called with each response carrying the request id,
+                           returns the result or None to ignore the response.
+            timeout: Seconds until the request errbacks with RequestTimeout.
+            peer: Optional peer the request is sent to, it may answer
+                  without the request id.
+
+        Returns:
+            (request_id, deferred) the request must carry the request_id,
+            the deferred resolves to the result of read_response.
+        """
+        request_id = new_request_id()
+        d = defer.Deferred()
+        with self.mutex:
+            self.pending[request_id] = (d, read_response, peer)
+            if peer is not None:
+                self.peers.setdefault(peer, []).append(request_id)
+        self.reactor.callFromThread(self.reactor.callLater, timeout,
+                                    self._expire, request_id)
+        return request_id, d
+
+    def _pop(self, request_id):
+        with self.mutex:
+            entry = self.pending.pop(request_id, None)
+            if entry is not None and entry[2] is not None:
+                request_ids = self.peers[entry[2]]
+                request_ids.remove(request_id)
+                if len(request_ids) == 0:
+                    del self.peers[entry[2]]
+            return entry
+
+    def _get_peer_request_id(self, message):
+        # Oldest request pending for the peer of a response without id.
+        if self.get_peer is None:
+            return None
+        try:
+            peer = self.get_peer(message)
+        except Exception:
+            return None  # not a response we can match
+        with self.mutex:
+            request_ids = self.peers.get(peer)
+            return request_ids[0] if request_ids else None
+
+    def handle(self, node, message):
+        """Message handler for responses."""
+        request_id = get_request_id(message)
+        if request_id is None:
+            request_id = self._get_peer_request_id(message)
+        if request_id is None:
+            return
+        with self.mutex:
+            entry = self.pending.get(request_id)
+        if entry is None:
+            return  # not ours, answered or expired
+
+        d, read_response, peer = entry
+        try:
+            result = read_response(message)
+        except Exception as e:
+            txt = "Reading response raised exception: {0}\n\n{1}"
+            _log.error(txt.format(repr(e), traceback.format_exc()))
+            return
+        if result is None:
+            return  # invalid response
+
+        if self._pop(request_id) is not None:  # only the first response
+            d.callback(result)
+
+    def _expire(self, request_id):
+        entry = self._pop(request_id)
+        if entry is not None:
+            self.timeouts += 1
+            entry[0].errback(RequestTimeout(
+                "No response for request {0}.".format(request_id)
+            ))
+
+    def cancel(self, request_id):
+        """Forget a pending request without firing its deferred.
+
+        Returns: True if the request was pending.
+        """
+        return self._pop(request_id) is not None
+
+    def __len__(self):
+        with self.mutex:
+            return len(self.pending)
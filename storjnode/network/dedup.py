@@ -0,0 +1,100 @@
+"""
+Suppress duplicate messages before they are dispatched.
+
+Relay messages are rebroadcast until the reply arrives (see
+storjnode.network.repeat_relay) and may reach a node over more than one
+path, so the same message is often received several times. Every copy
+would run the message handlers again, e.g. answer an info request or start
+a bandwidth test twice.
+
+Received messages are remembered by digest for a time window after they
+were first seen, copies received within that window are dropped. Signed
+messages are deterministic, so a request deliberately sent again with the
+same content (e.g. a repeated info request) is dropped too if it arrives
+within the window.
+"""
+
+import time
+import hashlib
+import umsgpack
+from threading import Lock
+from collections import OrderedDict
+from storjnode.network.server import WALK_TIMEOUT
+
+
+# Always shorter than WALK_TIMEOUT, after which the monitor deliberately
+# repeats its requests. WALK_TIMEOUT follows STORJNODE_QUERY_TIMEOUT, with
+# the default of 5 seconds the window is 90 seconds and covers the last
+# rebroadcast of a relay message (63 seconds). With a query timeout below
+# 3.5 seconds the window is shorter and late rebroadcasts are dispatched
+# again.
+DEDUP_WINDOW = min(90, WALK_TIMEOUT * 0.75)  # seconds
+assert(DEDUP_WINDOW < WALK_TIMEOUT)
+DEDUP_MAX_ENTRIES = 16384  # digests remembered, oldest forgotten first
+
+
+def get_digest(message):
+    """Returns: Digest of a received message or None if not packable."""
+    try:
+        return hashlib.sha256(umsgpack.packb(message)).digest()
+    except Exception:
+        return None
+
+
+class DuplicateFilter(object):
+
+    def __init__(self, window=DEDUP_WINDOW, max_entries=DEDUP_MAX_ENTRIES):
+        """
+        Args:
+            window (float): Seconds a message is remembered after it was
+                            first received.
+            max_entries (int): Max messages remembered at once.
+        """
+        assert(window > 0)
+        assert(max_entries > 0)
+        self.window = window
+        self.max_entries = max_entries
+        self.seen = OrderedDict()  # {digest: first seen} oldest first
+        self.suppressed = 0
+        self.mutex = Lock()
+
+    def _expire(self, now):
+        # Called with mutex held.
+        while self.seen:
+            digest, seen = next(iter(self.seen.items()))
+            if seen + self.window > now:
+                return
+            del self.seen[digest]
+
+    def is_duplicate(self, message, now=None):
+        """Check if a message was already received within the window.
+
+        Messages that aren't duplicates are remembered.
+        """
+        digest = get_digest(message)
+        if digest is None:
+            return False
+        if now is None:
+            now = time.time()
+        with self.mutex:
+            self._expire(now)
+            if digest in self.seen:
+                self.suppressed += 1
+                return True
+            self.seen[digest] = now
+            while len(self.seen) > self.max_entries:
+                self.seen.popitem(last=False)
+            return False
+
+    def clear(self):
+        with self.mutex:
+            self.seen.clear()
+            self.suppressed = 0
+
+    def info(self):
+        return {
+            "suppressed": self.suppressed,
+            "size": len(self.seen),
+            "max_entries": self.max_entries,
+            "window": self.window
+        }
@@ -0,0 +1,179 @@
+"""
+Get and set many DHT keys at once.
+
+kademlia walks the network from the routing table towards every key on its
+own, and callers waiting on one key before asking for the next pay for
+each walk in turn. The BatchWalk runs the walks of many keys concurrently,
+at most parallelism at once. Keys whose digests share the first
+WALK_PREFIX_BITS bits usually have the same nodes nearest to them, so a
+group of such keys walks towards its first key once and every key of the
+group starts its own, much shorter walk from the nodes found.
+"""
+
+import heapq
+import storjnode
+from collections import OrderedDict
+from twisted.internet import defer
+from kademlia.node import Node as KademliaNode
+from kademlia.utils import digest
+from kademlia.crawling import NodeSpiderCrawl, ValueSpiderCrawl
+from storjnode.network.routing_index import ID_BITS
+
+
+DHT_PARALLELISM = 8  # walks in flight at once
+WALK_PREFIX_BITS = 8  # keys sharing this many digest bits share a walk
+
+
+_log = storjnode.log.getLogger(__name__)
+
+
+class WalkFailed(Exception):
+
+    def __init__(self, keys, results):
+        """
+        Args:
+            keys: Keys whose walk failed.
+            results: Dict of key to value for the other keys.
+        """
+        Exception.__init__(self, "DHT walk failed for {0} keys".format(
+            len(keys)
+        ))
+        self.keys = keys
+        self.results = results
+
+
+def group_keys(keys, prefix_bits=WALK_PREFIX_BITS):
+    """Group keys by the first prefix_bits of their digest.
+
+    Returns:
+        List of groups, each a list of (kademlia node, key) tuples.
+    """
+    groups = OrderedDict()
+    for key in keys:
+        target = KademliaNode(digest(key))
+        prefix = target.long_id >> (ID_BITS - prefix_bits)
+        groups.setdefault(prefix, []).append((target, key))
+    return list(groups.values())
+
+
+def get_nearest(target, nodes, ksize):
+    """Returns: The ksize distinct nodes nearest to target."""
+    unique = dict((node.id, node) for node in nodes)
+    return heapq.nsmallest(ksize, unique.values(),
+                           key=lambda node: node.long_id ^ target.long_id)
+
+
+class BatchWalk(object):
+
+    def __init__(self, server, parallelism=DHT_PARALLELISM,
+                 prefix_bits=WALK_PREFIX_BITS):
+        self.server = server
+        self.protocol = server.protocol
+        self.prefix_bits = prefix_bits
+        self.semaphore = defer.DeferredSemaphore(parallelism)
+
+    def _peers(self, target, found):
+        # Nodes found by the group walk and routing table nodes near target.
+        nodes = list(found) + self.protocol.router.findNeighbors(target)
+        return get_nearest(target, nodes, self.server.ksize)
+
+    def _find_nodes(self, target, found=()):
+        peers = self._peers(target, found)
+        if len(peers) == 0:
+            return defer.succeed([])
+        spider = NodeSpiderCrawl(self.protocol, target, peers,
+                                 self.server.ksize, self.server.alpha)
+        return spider.find()
+
+    def _find_value(self, target, found):
+        peers = self._peers(target, found)
+        if len(peers) == 0:
+            return defer.succeed(None)
+        spider = ValueSpiderCrawl(self.protocol, target, peers,
+                                  self.server.ksize, self.server.alpha)
+        return spider.find()
+
+    def _store(self, target, found, value):
+        # Walk from the nodes found towards the key itself, the nodes
+        # nearest to the group's first key may not be nearest to it.
+        def store(peers):
+            if len(peers) == 0:
+                return False
+            ds = [self.protocol.callStore(p, target.id, value) for p in peers]
+            d = defer.DeferredList(ds)
+            return d.addCallback(self.server._anyRespondSuccess)
+        d = self.semaphore.run(self._find_nodes, target, found)
+        return d.addCallback(store)
+
+    def _walk_group(self, group):
+        # Returns: Deferred of the nodes nearest to the first key.
+        target, key = group[0]
+        if len(group) == 1:
+            return defer.succeed([])  # nothing to share
+
+        def errback(failure):
+            self._log_failure(key, failure)
+            return []  # keys walk from the routing table instead
+        d = self.semaphore.run(self._find_nodes, target)
+        return d.addErrback(errback)
+
+    def _log_failure(self, key, failure):
+        _log.warning("DHT walk for {0} failed: {1}".format(
+            repr(key), failure.getErrorMessage()
+        ))
+
+    def _result(self, d, key):
+        def errback(failure):
+            self._log_failure(key, failure)
+            return None
+        return d.addCallbacks(lambda result: (key, result), errback)
+
+    def _gather(self, groups, handle_group):
+        def merge(results):
+            merged = {}
+            for result in results:
+                merged.update(r for r in result if r is not None)
+            return merged
+        ds = [handle_group(group) for group in groups]
+        return defer.gatherResults(ds).addCallback(merge)
+
+    def get(self, keys):
+        """Get many keys from the network.
+
+        Returns:
+            A twisted.internet.defer.Deferred that resolves to a dict of
+            key to value, None if not found. Keys whose walk failed are
+            left out.
+        """
+        def lookup(found, group):
+            return defer.gatherResults([
+                self._result(self.semaphore.run(self._find_value, target,
+                                                found), key)
+                for target, key in group
+            ])
+
+        def handle_group(group):
+            return self._walk_group(group).addCallback(lookup, group)
+        return self._gather(group_keys(keys, self.prefix_bits), handle_group)
+
+    def set(self, items):
+        """Set many keys in the network.
+
+        Args:
+            items: Dict of key to value.
+
+        Returns:
+            A twisted.internet.defer.Deferred that resolves to a dict of
+            key to True if any node stored it. Keys whose store failed are
+            left out.
+        """
+        def store(found, group):
+            return defer.gatherResults([
+                self._result(self._store(target, found, items[key]), key)
+                for target, key in group
+            ])
+
+        def handle_group(group):
+            return self._walk_group(group).addCallback(store, group)
+        return self._gather(group_keys(items.keys(), self.prefix_bits),
+                            handle_group)
@@ -0,0 +1,84 @@
+"""
+Cache values read from the DHT.
+
+Every get walks the network even if the same key was just read. Values
+found are kept for DHT_CACHE_TTL seconds and keys not found for
+DHT_NEGATIVE_TTL seconds, shorter as a missing key is often set soon.
+Setting a key through the node replaces its cached value.
+
+Cached values may be stale, a value set by another node is only seen once
+the cached entry expires. Nodes therefore don't cache unless created with
+dht_cache_ttl and dht_negative_ttl.
+"""
+
+import time
+from threading import Lock
+from collections import OrderedDict
+from kademlia.utils import digest
+
+
+DHT_CACHE_TTL = 60  # seconds a found value is reused
+DHT_NEGATIVE_TTL = 10  # seconds a missing key is reused
+DHT_CACHE_SIZE = 4096  # keys remembered, lru first
+
+
+class DhtCache(object):
+
+    def __init__(self, ttl=DHT_CACHE_TTL, negative_ttl=DHT_NEGATIVE_TTL,
+                 max_size=DHT_CACHE_SIZE):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()  # {digest: (value, expires)} lru first
+        self.hits = 0
+        self.misses = 0
+        self.mutex = Lock()
+
+    def get(self, key, now=None):
+        """Get a cached value.
+
+        Returns:
+            (True, value) if cached, value is None for missing keys,
+            (False, None) otherwise.
+        """
+        if now is None:
+            now = time.time()
+        dkey = digest(key)
+        with self.mutex:
+            cached = self.entries.pop(dkey, None)
+            if cached is not None and cached[1] > now:
+                self.entries[dkey] = cached  # most recently used
+                self.hits += 1
+                return True, cached[0]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value, now=None):
+        """Cache a value read or written, None if the key is missing."""
+        if now is None:
+            now = time.time()
+        ttl = self.negative_ttl if value is None else self.ttl
+        dkey = digest(key)
+        with self.mutex:
+            self.entries.pop(dkey, None)
+            if ttl <= 0:
+                return
+            self.entries[dkey] = (value, now + ttl)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.mutex:
+            self.entries.pop(digest(key), None)
+
+    def clear(self):
+        with self.mutex:
+            self.entries.clear()
+
+    def info(self):
+        with self.mutex:
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses
+            }
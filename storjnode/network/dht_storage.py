@@ -0,0 +1,230 @@
+"""
+Keep DHT values in a local sqlite file.
+
+kademlia's ForgetfulStorage keeps values in memory only, a restarted node
+loses every value it held and memory grows with the values stored. The
+SqliteStorage keeps them on disk and reads nothing but their total size
+when opened. Values expire ttl seconds after they were stored and the least
+recently used values are evicted once more than max_bytes are stored.
+
+Use it with Node(dht_storage=SqliteStorage(path)).
+"""
+
+import time
+import sqlite3
+import umsgpack
+from threading import RLock
+from zope.interface import implementer
+from kademlia.storage import IStorage
+
+
+DHT_STORAGE_TTL = 604800  # seconds, a week like ForgetfulStorage
+DHT_STORAGE_MAX_BYTES = 64 * 1024 * 1024
+CULL_INTERVAL = 1.0  # seconds between removing expired values
+PAGE_SIZE = 256  # rows read at once when iterating
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    key BLOB PRIMARY KEY,
+    value BLOB NOT NULL,
+    birthday REAL NOT NULL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_birthday ON items (birthday, key);
+CREATE INDEX IF NOT EXISTS items_accessed ON items (accessed);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta VALUES ('size', 0);
+"""
+
+
+@implementer(IStorage)
+class SqliteStorage(object):
+
+    def __init__(self, path, ttl=DHT_STORAGE_TTL,
+                 max_bytes=DHT_STORAGE_MAX_BYTES):
+        """
+        Args:
+            path: Database file, created if it doesn't exist.
+            ttl: Seconds after which stored values expire.
+            max_bytes: Max size of stored keys and values.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.evicted = 0
+        self.touched = {}  # {key: time} reads not yet written
+        self.last_cull = 0
+        self.mutex = RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        with self.mutex, self.db:
+            self.db.executescript(SCHEMA)
+        self.cull()
+
+    def get_size(self):
+        """Returns: Bytes of keys and values stored."""
+        with self.mutex:
+            return self.db.execute(
+                "SELECT value FROM meta WHERE name = 'size'"
+            ).fetchone()[0]
+
+    def _add_size(self, delta):
+        # Called with mutex held in a transaction.
+        if delta:
+            self.db.execute(
+                "UPDATE meta SET value = value + ? WHERE name = 'size'",
+                (delta,)
+            )
+
+    def _flush_touched(self):
+        # Called with mutex held in a transaction.
+        if self.touched:
+            self.db.executemany(
+                "UPDATE items SET accessed = ? WHERE key = ?",
+                [(t, sqlite3.Binary(k)) for k, t in self.touched.items()]
+            )
+            self.touched = {}
+
+    def close(self):
+        with self.mutex:
+            with self.db:
+                self._flush_touched()
+            self.db.close()
+
+    def cull(self, force=True):
+        """Remove expired values."""
+        now = time.time()
+        with self.mutex:
+            if not force and now < self.last_cull + CULL_INTERVAL:
+                return
+            self.last_cull = now
+            with self.db:
+                expired = now - self.ttl
+                size = self.db.execute(
+                    "SELECT SUM(size) FROM items WHERE birthday <= ?",
+                    (expired,)
+                ).fetchone()[0]
+                if size is not None:
+                    self.db.execute("DELETE FROM items WHERE birthday <= ?",
+                                    (expired,))
+                    self._add_size(-size)
+
+    def _evict(self):
+        # Called with mutex held in a transaction.
+        size = self.get_size()
+        while size > self.max_bytes:
+            rows = self.db.execute(
+                "SELECT key, size FROM items ORDER BY accessed LIMIT ?",
+                (PAGE_SIZE,)
+            ).fetchall()
+            if not rows:
+                break
+            evicted = []
+            for key, item_size in rows:
+                if size <= self.max_bytes:
+                    break
+                evicted.append((key,))
+                size -= item_size
+                self._add_size(-item_size)
+            self.db.executemany("DELETE FROM items WHERE key = ?", evicted)
+            self.evicted += len(evicted)
+
+    def __setitem__(self, key, value):
+        key = sqlite3.Binary(key)
+        packed = sqlite3.Binary(umsgpack.packb(value))
+        size = len(key) + len(packed)
+        now = time.time()
+        self.cull(force=False)
+        with self.mutex, self.db:
+            self._flush_touched()
+            row = self.db.execute("SELECT size FROM items WHERE key = ?",
+                                  (key,)).fetchone()
+            if row is not None:
+                self._add_size(-row[0])
+            self.db.execute(
+                "INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?)",
+                (key, packed, now, now, size)
+            )
+            self._add_size(size)
+            self._evict()
+
+    def __getitem__(self, key):
+        self.cull(force=False)
+        with self.mutex:
+            row = self.db.execute(
+                "SELECT value FROM items WHERE key = ? AND birthday > ?",
+                (sqlite3.Binary(key), time.time() - self.ttl)
+            ).fetchone()
+            if row is None:
+                raise KeyError(key)
+            self.touched[bytes(key)] = time.time()
+        return umsgpack.unpackb(bytes(row[0]))
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        with self.mutex:
+            row = self.db.execute(
+                "SELECT 1 FROM items WHERE key = ? AND birthday > ?",
+                (sqlite3.Binary(key), time.time() - self.ttl)
+            ).fetchone()
+        return row is not None
+
+    def __len__(self):
+        with self.mutex:
+            return self.db.execute(
+                "SELECT COUNT(*) FROM items WHERE birthday > ?",
+                (time.time() - self.ttl,)
+            ).fetchone()[0]
+
+    def _pages(self, lower, upper):
+        # Yield (key, value) with lower < birthday <= upper, oldest first.
+        # Read a page at a time so not every value is loaded at once and
+        # the lock isn't held while the caller iterates.
+        query = ("SELECT key, value, birthday FROM items "
+                 "WHERE birthday <= ? AND (birthday > ? OR "
+                 "(birthday = ? AND key > ?)) "
+                 "ORDER BY birthday, key LIMIT ?")
+        last_birthday, last_key = lower, sqlite3.Binary(b"")
+        while True:
+            with self.mutex:
+                rows = self.db.execute(query, (
+                    upper, last_birthday, last_birthday, last_key,
+                    PAGE_SIZE
+                )).fetchall()
+            for key, value, birthday in rows:
+                yield bytes(key), umsgpack.unpackb(bytes(value))
+            if len(rows) < PAGE_SIZE:
+                return
+            last_key, _, last_birthday = rows[-1]
+
+    def iteritemsOlderThan(self, secondsOld):
+        now = time.time()
+        return self._pages(now - self.ttl, now - secondsOld)
+
+    def iteritems(self):
+        now = time.time()
+        return self._pages(now - self.ttl, now)
+
+    def __iter__(self):
+        return (key for key, value in self.iteritems())
+
+    def __repr__(self):
+        return "SqliteStorage({0})".format(repr(self.path))
+
+    def info(self):
+        return {
+            "size": self.get_size(),
+            "max_bytes": self.max_bytes,
+            "evicted": self.evicted
+        }
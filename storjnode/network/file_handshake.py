@@ -1,10 +1,10 @@
+import os
 import storjnode
 from collections import OrderedDict
 import time
 import pyp2p.unl
 import pyp2p.net
 import pyp2p.dht_msg
-import tempfile
 import sys
 import storjnode
 import logging
@@ -12,6 +12,7 @@ import json
 import storjnode.storage as storage
 from storjnode.util import parse_node_id_from_unl
 from storjnode.util import ordered_dict_to_list, list_to_ordered_dict
+from storjnode.network.multiplex import MuxConnection
 from ast import literal_eval
 
 _log = storjnode.log.getLogger(__name__)
@@ -25,6 +26,20 @@ ENABLE_ACCEPT_HANDLERS = 1
 # It would be ideal if this works.
 ENABLE_QUEUED_TRANSFERS = 1
 
+# Run parallel transfers between the same nodes as interleaved streams
+# over one connection (see multiplex.py) when both nodes support it.
+# Off by default as deployed nodes reject SYNs with the mux offer.
+ENABLE_MUX_TRANSFERS = 0
+
+# Ask hosts to resume partial downloads from where they stopped.
+# Off by default as deployed nodes reject SYNs with an offset.
+ENABLE_RESUME_TRANSFERS = 0
+
+# Send handshake messages in the compact binary format (contract_codec.py.)
+# Both formats are always understood when receiving, but nodes older than
+# the format can't parse it so it isn't sent until every node can.
+ENABLE_COMPACT_CONTRACTS = 0
+
 
 class RequestDenied(Exception):
     pass
@@ -48,11 +63,17 @@ def is_valid_syn(client, msg):
         _log.debug("Missing required key.")
         return -1
 
-    # Check there aren't extra fields.
-    if len(msg) != len(syn_schema):
+    # Check there aren't extra fields (offset and mux are optional.)
+    optional = int(u"offset" in msg) + int(u"mux" in msg)
+    if len(msg) != len(syn_schema) + optional:
         _log.debug("Invalid dictionary length.")
         return -2
 
+    # Check multiplexing offer.
+    if u"mux" in msg and msg[u"mux"] != 1:
+        _log.debug("Invalid mux offer.")
+        return -11
+
     # Check data ID is valid.
     if not storjnode.storage.shard.valid_id(msg[u"data_id"]):
         _log.debug("Invalid data id.")
@@ -82,6 +103,16 @@ def is_valid_syn(client, msg):
         _log.debug(type(msg[u"file_size"]))
         return -7
 
+    # Check offset to resume from.
+    offset = msg.get(u"offset", 0)
+    if sys.version_info >= (3, 0, 0):
+        expr = type(offset) != int
+    else:
+        expr = type(offset) != int and type(offset) != long
+    if expr or offset < 0:
+        _log.debug("Invalid offset.")
+        return -12
+
     # Are we the host?
     if client.get_direction(None, msg) == u"send":
         # Then check we have this file.
@@ -90,6 +121,11 @@ def is_valid_syn(client, msg):
         if path is None:
             _log.debug("Failed to find file we're uploading")
             return -8
+
+        # Can't resume past the end.
+        if offset > os.path.getsize(path):
+            _log.debug("Offset is past the end of the file.")
+            return -13
     else:
         # Do we already have this file?
         path = storjnode.storage.manager.find(client.store_config,
@@ -122,24 +158,32 @@ def success_wrapper(client, contract_id, host_unl):
             contract = client.contracts[contract_id]
             file_size = contract["file_size"]
 
-            # Store con association.
-            if con not in client.con_info:
-                client.con_info[con] = {}
+            # Open the partial download to resume. If it lost data since our
+            # SYN asked to resume it fail, so a retry starts over.
+            data_id = contract["data_id"]
+            is_download = client.net.unl != pyp2p.unl.UNL(value=host_unl)
+            if is_download:
+                offset = contract.get(u"offset", 0)
+                path = client.open_partial(data_id, offset)
+                if path is None:
+                    if contract_id in client.defers:
+                        e = Exception("Partial download is missing data.")
+                        client.defers[contract_id].errback(e)
+                    client.cleanup_transfers(None, contract_id)
+                    return
+
+            # First contract on a con decides if it's multiplexed.
+            is_new_con = con not in client.con_info
+            if is_new_con and contract_id in client.mux_contracts:
+                client.con_mux[con] = MuxConnection()
 
             # Associate contract with con.
-            if contract_id not in client.con_info[con]:
-                client.con_info[con][contract_id] = {
-                    "contract_id": contract_id,
-                    "remaining": 350,  # Tree fiddy.
-                    "file_size": 0,  # Sent as part of protocol.
-                    "file_size_buf": b""
-                }
+            client.associate_con(con, contract_id)
 
             # Record download state.
-            data_id = contract["data_id"]
-            if client.net.unl != pyp2p.unl.UNL(value=host_unl):
+            if is_download:
                 _log.debug("Success: download")
-                fp, client.downloading[data_id] = tempfile.mkstemp()
+                client.downloading[data_id] = path
             else:
                 # Set initial upload for this con.
                 _log.debug("Success: upload")
@@ -148,6 +192,13 @@ def success_wrapper(client, contract_id, host_unl):
             if contract_id not in client.bandwidth.transfers:
                 client.bandwidth.register_transfer(contract_id)
 
+            # Open a stream on multiplexed cons (no queuing needed.)
+            if con in client.con_mux:
+                client.con_mux[con].get_stream(contract_id)
+                if con not in client.cons:
+                    client.cons.append(con)
+                return
+
             # Queue first transfer.
             their_unl = client.get_their_unl(contract)
             is_master = client.net.unl.is_master(their_unl)
@@ -245,10 +296,7 @@ def process_syn(client, msg, enable_accept_handlers=ENABLE_ACCEPT_HANDLERS):
 
     # Save contract.
     client.save_contract(msg)
-    client.handshake[contract_id] = {
-        u"state": u"SYN-ACK",
-        u"timestamp": time.time()
-    }
+    client.set_handshake(contract_id, u"SYN-ACK")
 
     # Create reply.
     reply = OrderedDict([
@@ -256,6 +304,11 @@ def process_syn(client, msg, enable_accept_handlers=ENABLE_ACCEPT_HANDLERS):
         (u"syn", msg),
     ])
 
+    # Accept offer to multiplex transfers.
+    if msg.get(u"mux") == 1 and ENABLE_MUX_TRANSFERS:
+        reply[u"mux"] = 1
+        client.mux_contracts.add(contract_id)
+
     # Sign reply.
     reply = client.sign_contract(reply)
 
@@ -273,8 +326,8 @@ def process_syn_ack(client, msg):
         _log.debug("SYN-ACK: syn not in msg.")
         return -1
 
-    # Check length is correct.
-    if len(msg) != 3:
+    # Check length is correct (mux is optional.)
+    if len(msg) != 3 + int(u"mux" in msg):
         _log.debug("incorrect length")
         return -2
 
@@ -318,11 +371,13 @@ def process_syn_ack(client, msg):
         _log.debug("handshake state invalid")
         return -8
 
-    # Update handshake.
-    client.handshake[contract_id] = {
-        u"state": u"ACK",
-        u"timestamp": time.time()
-    }
+    # Update handshake, our SYN arrived.
+    client.set_handshake(contract_id, u"ACK")
+    client.cancel_relays(contract_id)
+
+    # Did they agree to multiplex?
+    if msg.get(u"mux") == 1 and contract.get(u"mux") == 1:
+        client.mux_contracts.add(contract_id)
 
     # Create reply contract.
     reply = OrderedDict([
@@ -416,12 +471,10 @@ def process_ack(client, msg):
         _log.debug("Invalid state for handshake.")
         return -6
 
-    # Update handshake.
+    # Update handshake, our SYN-ACK arrived.
     contract = client.contracts[contract_id]
-    client.handshake[contract_id] = {
-        u"state": u"ACK",
-        u"timestamp": time.time()
-    }
+    client.set_handshake(contract_id, u"ACK")
+    client.cancel_relays(contract_id)
 
     # Are we already connected?
     is_reliable_con = 0
@@ -7,8 +7,10 @@ import zlib
 from collections import OrderedDict
 from btctxstore import BtcTxStore
 import time
+import heapq
 import hashlib
 import sys
+import os
 from threading import Lock
 from twisted.internet import defer
 from storjnode.util import address_to_node_id
@@ -17,11 +19,22 @@ from storjnode.util import list_to_ordered_dict
 from storjnode.network.message import verify_signature
 from storjnode.network.message import sign
 from storjnode.network.file_handshake import is_valid_syn
+from storjnode.network import contract_codec
+from storjnode.network.repeat_relay import cancel_relay
+from storjnode.network.shard_io import DownloadSink, UploadSourceCache
 
 
 _log = storjnode.log.getLogger(__name__)
 
 
+HANDSHAKE_TIMEOUT = 350  # Tree fiddy. 'bout 6 mins.
+
+# Partial downloads are kept here (in the first store path) by data_id so
+# a failed download can be resumed, see ENABLE_RESUME_TRANSFERS. If it is
+# disabled they are removed when a download is abandoned.
+PARTIAL_DIR = ".partial"
+
+
 def process_unl_requests(node, msg):
     _log.debug("In process unl requests: ")
     _log.debug(msg)
@@ -43,13 +56,18 @@ def process_unl_requests(node, msg):
             return
 
         # Response.
-        response = sign(OrderedDict(
+        response = OrderedDict(
             {
                 u"type": u"unl_response",
                 u"requestee": node.get_address(),
                 u"unl": unl
             }
-        ), node.get_key())
+        )
+
+        # Echo the request id so the requester can match the response.
+        if u"request_id" in msg:
+            response[u"request_id"] = msg[u"request_id"]
+        response = sign(response, node.get_key())
 
         # Send response.
         response = ordered_dict_to_list(response)
@@ -60,10 +78,17 @@ def process_unl_requests(node, msg):
         pass  # not a unl request
 
 
+def get_unl_requestee(msg):
+    """Returns: Node id a unl response claims to be from."""
+    msg = list_to_ordered_dict(msg)
+    return address_to_node_id(msg[u"requestee"])
+
+
 def enable_unl_requests(node):
     print(node)
     print("Enable unl requests")
-    node.add_message_handler(process_unl_requests)
+    node.add_message_handler(process_unl_requests,
+                             types=["unl_request"])
 
 
 def disable_unl_requests(node):
@@ -90,6 +115,12 @@ class FileTransfer:
         self.store_config = store_config
         assert(len(list(store_config)))
 
+        # Partial downloads are kept in the first store path.
+        store_path = storjnode.util.full_path(list(self.store_config)[0])
+        self.partial_dir = os.path.join(store_path, PARTIAL_DIR)
+        if not os.path.isdir(self.partial_dir):
+            os.makedirs(self.partial_dir)
+
         # Handlers for certain events.
         self.handlers = handlers
         if self.handlers is None:
@@ -105,6 +136,10 @@ class FileTransfer:
         if not self.net.is_net_started:
             self.net.start()
 
+        # Receive handshake messages in the compact format.
+        if self.net.dht_node is not None:
+            self.net.dht_node.add_message_handler(self.compact_msg_handler)
+
         # Dict of data requests: [contract_id] > contract
         self.contracts = {}
 
@@ -125,10 +160,37 @@ class FileTransfer:
         # [con] > contract_id
         self.con_transfer = {}
 
+        # Connection associated with a contract: [contract_id] > con
+        self.contract_cons = {}
+
+        # Rebroadcasts of handshake messages: [contract_id] > [relay_id]
+        self.contract_relays = {}
+
+        # Unfinished contracts of connections in the order they were queued.
+        # Only connections with pending transfers are present.
+        # [con] > OrderedDict([contract_id] > None)
+        self.con_queues = {}
+
+        # Framing state of multiplexed connections: [con] > MuxConnection
+        self.con_mux = {}
+
+        # Contracts where both nodes agreed to multiplex transfers.
+        self.mux_contracts = set()
+
+        # Heap of (deadline, contract_id) for handshake expiry. Entries
+        # superseded by a later handshake state are skipped when popped.
+        self.handshake_deadlines = []
+
         # List of active downloads.
         # (Never try to download multiple copies of the same thing at once.)
         self.downloading = {}
 
+        # Open temp files of active downloads: [data_id] > DownloadSink
+        self.download_sinks = {}
+
+        # Open shards of active uploads: [contract_id] > UploadSource
+        self.upload_sources = UploadSourceCache()
+
         # Lock threads.
         self.mutex = Lock()
 
@@ -152,22 +214,72 @@ class FileTransfer:
         return their_unl
 
     def is_queued(self, con=None):
-        if con is not None:
-            if con not in self.con_info:
-                return 0
-
         if con is None:
-            con_list = list(self.con_info)
-        else:
-            con_list = [con]
+            return int(bool(self.con_queues))
+
+        return int(con in self.con_queues)
+
+    def associate_con(self, con, contract_id):
+        """Associate a contract with a connection and queue its transfer.
+
+        Returns: The con_info of the contract.
+        """
+        if con not in self.con_info:
+            self.con_info[con] = {}
+
+        if contract_id not in self.con_info[con]:
+            self.cancel_relays(contract_id)  # handshake is done
+            self.con_info[con][contract_id] = {
+                "contract_id": contract_id,
+                "remaining": 350,  # Tree fiddy.
+                "file_size": 0,  # Sent as part of protocol.
+                "file_size_buf": b""
+            }
+            self.contract_cons[contract_id] = con
+            if con not in self.con_queues:
+                self.con_queues[con] = OrderedDict()
+            self.con_queues[con][contract_id] = None
+
+        return self.con_info[con][contract_id]
+
+    def dequeue_contract(self, con, contract_id):
+        """Remove a finished transfer from the queue of its connection."""
+        queue = self.con_queues.get(con)
+        if queue is None:
+            return
+
+        queue.pop(contract_id, None)
+        if not queue:
+            del self.con_queues[con]
+
+    def set_handshake(self, contract_id, state, timestamp=None):
+        timestamp = timestamp or time.time()
+        self.handshake[contract_id] = {
+            u"state": state,
+            u"timestamp": timestamp
+        }
+
+        deadline = timestamp + HANDSHAKE_TIMEOUT
+        heapq.heappush(self.handshake_deadlines, (deadline, contract_id))
+
+    def pop_expired_handshakes(self, now=None):
+        """Returns: Contract IDs whose handshake got no response in time."""
+        now = now or time.time()
+        expired = []
+        deadlines = self.handshake_deadlines
+        while deadlines and deadlines[0][0] <= now:
+            deadline, contract_id = heapq.heappop(deadlines)
+            handshake = self.handshake.get(contract_id)
+            if handshake is None:
+                continue
+
+            # Superseded by a newer state.
+            if handshake[u"timestamp"] + HANDSHAKE_TIMEOUT > now:
+                continue
 
-        for con in con_list:
-            for contract_id in list(self.con_info[con]):
-                con_info = self.con_info[con][contract_id]
-                if con_info["remaining"]:
-                    return 1
+            expired.append(contract_id)
 
-        return 0
+        return expired
 
     def cleanup_transfers(self, con, contract_id):
         # Cleanup downloading.
@@ -176,11 +288,19 @@ class FileTransfer:
             if contract["data_id"] in self.downloading:
                 if self.get_direction(contract_id) == u"receive":
                     del self.downloading[contract["data_id"]]
+                    self.close_download_sink(contract["data_id"])
+                    self.discard_partial(contract["data_id"])
+
+        # Cleanup uploads.
+        self.upload_sources.remove(contract_id)
 
         # Cleanup handshakes.
         if contract_id in self.handshake:
             del self.handshake[contract_id]
 
+        # Cleanup rebroadcasts.
+        self.cancel_relays(contract_id)
+
         # Cleanup defers.
         if contract_id in self.defers:
             del self.defers[contract_id]
@@ -191,15 +311,31 @@ class FileTransfer:
 
         # Cleanup con_info.
         if con in self.con_info:
+            for old_contract_id in self.con_info[con]:
+                if self.contract_cons.get(old_contract_id) is con:
+                    del self.contract_cons[old_contract_id]
             del self.con_info[con]
 
+        # Cleanup con queues.
+        if con in self.con_queues:
+            del self.con_queues[con]
+
+        # Cleanup multiplexing.
+        if con in self.con_mux:
+            del self.con_mux[con]
+        self.mux_contracts.discard(contract_id)
+
+        # Cleanup contract con.
+        if contract_id in self.contract_cons:
+            del self.contract_cons[contract_id]
+
         # Cleanup contracts.
         if contract_id in self.contracts:
             del self.contracts[contract_id]
 
     def queue_next_transfer(self, con):
         _log.debug("Queing next transfer")
-        for contract_id in list(self.con_info[con]):
+        for contract_id in list(self.con_queues.get(con, ())):
             con_info = self.con_info[con][contract_id]
             if con_info["remaining"]:
                 self.con_transfer[con] = contract_id
@@ -219,9 +355,51 @@ class FileTransfer:
     def send_msg(self, msg, unl):
         assert(type(msg) == OrderedDict)
         node_id = self.net.unl.deconstruct(unl)["node_id"]
-        msg = ordered_dict_to_list(msg)
-        msg = zlib.compress(str(msg))
-        self.net.dht_node.repeat_relay_message(node_id, msg)
+
+        # Find the contract so the rebroadcast can be cancelled.
+        if msg[u"status"] == u"SYN":
+            contract_id = self.contract_id(msg)
+        elif msg[u"status"] == u"SYN-ACK":
+            contract_id = self.contract_id(msg[u"syn"])
+        elif msg[u"status"] == u"ACK":
+            contract_id = self.contract_id(msg[u"syn_ack"][u"syn"])
+        else:
+            contract_id = None
+
+        if storjnode.network.file_handshake.ENABLE_COMPACT_CONTRACTS:
+            try:
+                msg = contract_codec.encode(msg)
+            except contract_codec.ContractFormatError as e:
+                _log.debug("Can't encode compact contract: %s" % repr(e))
+
+        if type(msg) == OrderedDict:
+            msg = ordered_dict_to_list(msg)
+            msg = zlib.compress(str(msg))
+
+        relay_id = self.net.dht_node.repeat_relay_message(node_id, msg)
+        if relay_id is not None and contract_id is not None:
+            self.contract_relays.setdefault(contract_id, []).append(relay_id)
+
+    def cancel_relays(self, contract_id):
+        """Stop rebroadcasting handshake messages of a contract."""
+        for relay_id in self.contract_relays.pop(contract_id, []):
+            cancel_relay(self.net.dht_node, relay_id)
+
+    def compact_msg_handler(self, node, msg):
+        # Queue compact handshake messages like pyp2p does for the old format.
+        if not contract_codec.is_compact(msg):
+            return
+
+        try:
+            msg = contract_codec.decode(msg)
+        except contract_codec.ContractFormatError as e:
+            _log.debug("Invalid compact contract: %s" % repr(e))
+            return
+
+        self.net.dht_messages.append({
+            u"message": msg,
+            u"source": None
+        })
 
     def contract_id(self, contract):
         if sys.version_info >= (3, 0, 0):
@@ -302,6 +480,17 @@ class FileTransfer:
             (u"src_unl", self.net.unl.value)
         ])
 
+        # Resume a partial download.
+        resume = storjnode.network.file_handshake.ENABLE_RESUME_TRANSFERS
+        if action == u"upload" and resume:
+            offset = self.get_partial_size(data_id)
+            if offset:
+                contract[u"offset"] = offset
+
+        # Offer to multiplex transfers.
+        if storjnode.network.file_handshake.ENABLE_MUX_TRANSFERS:
+            contract[u"mux"] = 1
+
         # Sign contract.
         contract = self.sign_contract(contract)
 
@@ -318,10 +507,7 @@ class FileTransfer:
         _log.debug("Sending data request")
 
         # Update handshake.
-        self.handshake[contract_id] = {
-            u"state": u"SYN",
-            u"timestamp": time.time()
-        }
+        self.set_handshake(contract_id, u"SYN")
 
         # For async code.
         self.defers[contract_id] = d
@@ -330,38 +516,97 @@ class FileTransfer:
         return contract_id
 
     def get_con_by_contract_id(self, needle):
-        for con in list(self.con_info):
-            for contract_id in list(self.con_info[con]):
-                if contract_id == needle:
-                    return con
-
-        return None
+        return self.contract_cons.get(needle)
 
     def remove_file_from_storage(self, data_id):
         storjnode.storage.manager.remove(self.store_config, data_id)
 
     def move_file_to_storage(self, path):
         with open(path, "rb") as shard:
-            storjnode.storage.manager.add(self.store_config, shard)
+            data_id = storjnode.storage.shard.get_id(shard)
+            storjnode.storage.manager.add(self.store_config, shard,
+                                          shard_id=data_id)
             return {
                 "file_size": storjnode.storage.shard.get_size(shard),
-                "data_id": storjnode.storage.shard.get_id(shard)
+                "data_id": data_id
             }
 
-    def get_data_chunk(self, data_id, position, chunk_size=1048576):
-        path = storjnode.storage.manager.find(self.store_config, data_id)
-        buf = b""
-        with open(path, "rb") as fp:
-            fp.seek(position, 0)
-            buf = fp.read(chunk_size)
+    def get_upload_source(self, contract_id, data_id):
+        """Resolve the shard of an upload once and keep it open.
 
-            return buf
+        Returns: A storjnode.network.shard_io.UploadSource or None if the
+                 shard is not in storage.
+        """
+        source = self.upload_sources.get(contract_id)
+        if source is None:
+            cfg = self.store_config
+            path = storjnode.storage.manager.find(cfg, data_id)
+            if path is None:
+                return None
+            source = self.upload_sources.add(contract_id, path)
 
-    def save_data_chunk(self, data_id, chunk):
+        return source
+
+    def get_data_chunk(self, data_id, position, chunk_size=1048576,
+                       contract_id=None):
+        key = contract_id or data_id
+        if self.get_upload_source(key, data_id) is None:
+            return b""
+
+        return self.upload_sources.read(key, position, chunk_size)
+
+    def get_partial_path(self, data_id):
+        return os.path.join(self.partial_dir, data_id + ".part")
+
+    def get_partial_size(self, data_id):
+        """Returns: Bytes already downloaded for a shard."""
+        path = self.get_partial_path(data_id)
+        if not os.path.isfile(path):
+            return 0
+
+        return os.path.getsize(path)
+
+    def open_partial(self, data_id, offset=0):
+        """Prepare the partial download of a shard to resume at offset.
+
+        Returns: Path of the partial download, None if it is shorter than
+                 offset (it is removed so the next download starts over.)
+        """
+        path = self.get_partial_path(data_id)
+        if self.get_partial_size(data_id) < offset:
+            _log.debug("Partial download is missing data.")
+            if os.path.isfile(path):
+                os.remove(path)
+            return None
+        with open(path, "ab") as fobj:
+            fobj.truncate(offset)
+
+        return path
+
+    def discard_partial(self, data_id):
+        """Remove the partial download of an abandoned shard, unless
+        downloads are resumed (then it is kept for the next attempt.)"""
+        if storjnode.network.file_handshake.ENABLE_RESUME_TRANSFERS:
+            return
+
+        path = self.get_partial_path(data_id)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def get_download_sink(self, data_id):
         assert(data_id in self.downloading)
+        if data_id not in self.download_sinks:
+            path = self.downloading[data_id]
+            self.download_sinks[data_id] = DownloadSink(path)
+
+        return self.download_sinks[data_id]
 
-        # Find temp file path.
-        path = self.downloading[data_id]
+    def close_download_sink(self, data_id):
+        sink = self.download_sinks.pop(data_id, None)
+        if sink is not None:
+            sink.close()
 
-        with open(path, "ab") as fp:
-            fp.write(chunk)
+        return sink
+
+    def save_data_chunk(self, data_id, chunk):
+        self.get_download_sink(data_id).write(chunk)
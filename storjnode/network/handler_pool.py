@@ -0,0 +1,217 @@
+"""
+Run message handlers on a pool of worker threads.
+
+Messages are still taken from the received queue by a single dispatcher,
+but their handlers run on workers so one slow handler doesn't hold up every
+other message. Scheduling guarantees:
+
+* At most limits[message_type] messages of a type are handled at once
+  (default_limit for types without an entry, None for no limit.)
+* Messages from the same sender are handled one at a time, in the order
+  they were received. The sender of storjnode.network.messages is the node
+  id they carry, other messages have no known sender and are unordered.
+
+Messages waiting behind another from the same sender are queued per sender,
+the rest per type, so a worker only compares the oldest message of each
+type to pick the next one, however many are pending.
+"""
+
+import time
+import itertools
+import threading
+import traceback
+from collections import deque
+import storjnode
+
+
+_log = storjnode.log.getLogger(__name__)
+
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_PENDING = 1024
+
+
+def get_sender(message):
+    """Returns: The node id a message claims to be from or None."""
+    if isinstance(message, list) and len(message) == 5 and \
+            isinstance(message[0], bytes) and len(message[0]) == 20:
+        return message[0]
+    return None
+
+
+class _Task(object):
+
+    def __init__(self, message_type, sender, func):
+        self.message_type = message_type
+        self.sender = sender
+        self.func = func
+        self.queued = time.time()
+        self.order = None  # submit order, set by HandlerPool
+
+
+class HandlerPool(object):
+
+    def __init__(self, workers=DEFAULT_WORKERS, limits=None,
+                 default_limit=None, max_pending=DEFAULT_MAX_PENDING):
+        """
+        Args:
+            workers (int): Number of worker threads.
+            limits: Dict of message type to max concurrent handlers.
+            default_limit (int): Max concurrent handlers for other types.
+            max_pending (int): Max messages waiting for a worker.
+        """
+        assert(workers > 0)
+        self.limits = dict(limits or {})
+        self.default_limit = default_limit
+        self.max_pending = max_pending
+        self.pending = 0  # messages waiting for a worker
+        self.ready = {}  # {message_type: deque of tasks} oldest first
+        self.senders = {}  # {sender: deque of tasks waiting for the sender}
+        self.order = itertools.count()
+        self.running = {}  # {message_type: count}
+        self.stats = {}  # {message_type: stats dict}
+        self.cond = threading.Condition()
+        self.stopped = False
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.start()
+            self.threads.append(thread)
+
+    def _get_stats(self, message_type):
+        if message_type not in self.stats:
+            self.stats[message_type] = {
+                "queued": 0, "running": 0, "done": 0, "dropped": 0,
+                "wait": 0.0, "latency": 0.0, "max_latency": 0.0
+            }
+        return self.stats[message_type]
+
+    def submit(self, message_type, sender, func):
+        """Queue func to handle a message.
+
+        Returns:
+            True if queued, False if dropped because the pool is full.
+        """
+        with self.cond:
+            stats = self._get_stats(message_type)
+            if self.stopped or self.pending >= self.max_pending:
+                stats["dropped"] += 1
+                _log.warning("Handler pool full, dropping message.")
+                return False
+            task = _Task(message_type, sender, func)
+            task.order = next(self.order)
+            if sender in self.senders:
+                self.senders[sender].append(task)  # after the current one
+            else:
+                if sender is not None:
+                    self.senders[sender] = deque()
+                self._add_ready(task)
+            self.pending += 1
+            stats["queued"] += 1
+            self.cond.notify()
+            return True
+
+    def _add_ready(self, task):
+        # Called with cond held.
+        if task.message_type not in self.ready:
+            self.ready[task.message_type] = deque()
+        self.ready[task.message_type].append(task)
+
+    def _is_runnable(self, message_type):
+        limit = self.limits.get(message_type, self.default_limit)
+        if limit is None:
+            return True
+        return self.running.get(message_type, 0) < limit
+
+    def _next_task(self):
+        # Called with cond held, None if nothing can run yet.
+        oldest = None
+        for message_type, tasks in self.ready.items():
+            if oldest is not None and tasks[0].order > oldest[0].order:
+                continue
+            if self._is_runnable(message_type):
+                oldest = tasks
+        if oldest is None:
+            return None
+        task = oldest.popleft()
+        if not oldest:
+            del self.ready[task.message_type]
+        self.pending -= 1
+        return task
+
+    def _sender_done(self, sender):
+        # Called with cond held, the sender's next message is ready.
+        waiting = self.senders.get(sender)
+        if waiting is None:
+            return
+        if waiting:
+            self._add_ready(waiting.popleft())
+        else:
+            del self.senders[sender]
+
+    def _work(self):
+        while True:
+            with self.cond:
+                task = self._next_task()
+                while task is None and not self.stopped:
+                    self.cond.wait()
+                    task = self._next_task()
+                if task is None:
+                    return
+
+                message_type = task.message_type
+                self.running[message_type] = \
+                    self.running.get(message_type, 0) + 1
+                stats = self._get_stats(message_type)
+                stats["queued"] -= 1
+                stats["running"] += 1
+                wait = time.time() - task.queued
+
+            try:
+                task.func()
+            except Exception as e:
+                txt = "Message handler raised exception: {0}\n\n{1}"
+                _log.error(txt.format(repr(e), traceback.format_exc()))
+
+            with self.cond:
+                self.running[message_type] -= 1
+                self._sender_done(task.sender)
+                latency = time.time() - task.queued
+                stats["running"] -= 1
+                stats["done"] += 1
+                stats["wait"] += wait
+                stats["latency"] += latency
+                stats["max_latency"] = max(stats["max_latency"], latency)
+                self.cond.notify_all()  # blocked tasks may run now
+
+    def get_stats(self):
+        """Get queue depth and latency of handled messages per type.
+
+        Returns:
+            {message_type: {
+                "queued": messages waiting for a worker,
+                "running": messages being handled,
+                "done": messages handled,
+                "dropped": messages dropped because the pool was full,
+                "wait": average seconds waited for a worker,
+                "latency": average seconds from queued to handled,
+                "max_latency": max seconds from queued to handled
+            }}
+        """
+        result = {}
+        with self.cond:
+            for message_type, stats in self.stats.items():
+                stats = dict(stats)
+                done = stats["done"]
+                stats["wait"] = stats["wait"] / done if done else 0.0
+                stats["latency"] = stats["latency"] / done if done else 0.0
+                result[message_type] = stats
+        return result
+
+    def stop(self):
+        """Handle messages still pending and stop the workers."""
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
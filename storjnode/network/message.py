@@ -1,8 +1,81 @@
 import sys
 import binascii
+from threading import Lock
 from collections import OrderedDict
 from btctxstore import BtcTxStore
-from storjnode.util import node_id_to_address
+from storjnode.util import node_id_to_address, address_to_node_id
+
+
+SIGNER_CACHE_SIZE = 16  # signing contexts kept by get_signer
+VERIFIER_CACHE_SIZE = 1024  # addresses kept by a Verifier
+
+
+class Signer(object):
+    """Signing context that derives the address and node id only once.
+
+    Signatures are created with btctxstore.BtcTxStore.sign_data.
+    """
+
+    def __init__(self, wif):
+        self.wif = wif
+        self.api = BtcTxStore(testnet=False, dryrun=True)
+        self.address = self.api.get_address(wif)
+        self.node_id = address_to_node_id(self.address)
+
+    def sign_data(self, data):
+        """Returns: Base64 encoded signature of data (bytes)."""
+        return self.api.sign_data(self.wif, binascii.hexlify(data))
+
+    def verify_data(self, signature, data):
+        """Verify signature of data by this key."""
+        return verifier.verify_data(self.address, signature, data)
+
+
+class Verifier(object):
+    """Verify signatures, remembering the addresses of known node ids."""
+
+    def __init__(self, cache_size=VERIFIER_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.api = BtcTxStore(testnet=False, dryrun=True)
+        self.addresses = OrderedDict()  # {node_id: address}
+        self.mutex = Lock()
+
+    def get_address(self, node_id):
+        with self.mutex:
+            address = self.addresses.pop(node_id, None)
+        if address is None:
+            address = node_id_to_address(node_id)
+        with self.mutex:
+            self.addresses[node_id] = address  # most recently used
+            while len(self.addresses) > self.cache_size:
+                self.addresses.popitem(last=False)
+        return address
+
+    def verify_data(self, address, signature, data):
+        """Verify signature of data by address, same as
+        btctxstore.BtcTxStore.verify_signature with unhexlified data."""
+        try:
+            return self.api.verify_signature(address, signature,
+                                             binascii.hexlify(data))
+        except Exception:
+            return False
+
+
+verifier = Verifier()
+_signers = OrderedDict()  # {wif: Signer}
+_signers_mutex = Lock()
+
+
+def get_signer(wif):
+    """Returns: A cached Signer for wif."""
+    with _signers_mutex:
+        signer = _signers.pop(wif, None)
+        if signer is None:
+            signer = Signer(wif)
+        _signers[wif] = signer
+        while len(_signers) > SIGNER_CACHE_SIZE:
+            _signers.popitem(last=False)
+        return signer
 
 
 def sign(dict_obj, wif):  # FIXME use create instead
@@ -18,9 +91,7 @@ def sign(dict_obj, wif):  # FIXME use create instead
     # assert("signature" not in msg)  # must be unsigned
     # todo: fix this
 
-    api = BtcTxStore(testnet=False, dryrun=True)
-    msg = binascii.hexlify(msg).decode("utf-8")
-    sig = api.sign_data(wif, msg)
+    sig = get_signer(wif).sign_data(msg)
 
     if sys.version_info >= (3, 0, 0):
         dict_obj[u"signature"] = sig.decode("utf-8")
@@ -40,15 +111,13 @@ def verify_signature(msg, wif, node_id=None):  # FIXME use read instead
     sig = msg.pop("signature")
 
     # Use our address.
-    api = BtcTxStore(testnet=False, dryrun=True)
     try:
         if node_id is None:
-            address = api.get_address(wif)
-            ret = api.verify_signature_unicode(address, sig, str(msg))
+            address = get_signer(wif).address
         else:
-            address = node_id_to_address(node_id)
-            ret = api.verify_signature_unicode(address, sig, str(msg))
+            address = verifier.get_address(node_id)
+        data = str(msg).encode("utf-8")
     except TypeError:
         return 0
 
-    return ret
+    return verifier.verify_data(address, sig, data)
@@ -0,0 +1,104 @@
+"""
+Deliver relayed messages only to the handlers that care about them.
+
+Messages are classified by a cheap look at their structure, no signatures
+are checked and nothing is decompressed:
+
+* storjnode.network.messages: the token, e.g. "info" or "peers". Signals
+  include their name, e.g. "signal:request_info".
+* OrderedDict messages sent as lists of pairs (UNL requests, bandwidth
+  tests, file transfer handshakes): the value of their "type" or "status"
+  field, e.g. "unl_request" or "SYN".
+
+Handlers registered without types receive every message.
+"""
+
+import six
+from threading import Lock
+
+
+def _is_pairs(message):
+    for item in message:
+        if not isinstance(item, (list, tuple)) or len(item) != 2:
+            return False
+        if not isinstance(item[0], six.string_types):
+            return False
+    return True
+
+
+def classify(message):
+    """Returns: The type of a message or None if unknown."""
+    if not isinstance(message, list):
+        return None
+
+    # storjnode.network.messages.base message
+    if len(message) == 5 and isinstance(message[0], bytes) and \
+            len(message[0]) == 20 and isinstance(message[1], int):
+        token = message[2]
+        if not isinstance(token, six.string_types):
+            return None
+        if token == "signal" and isinstance(message[3], six.string_types):
+            return "signal:" + message[3]
+        return token
+
+    # OrderedDict sent as list of pairs
+    if _is_pairs(message):
+        for key, value in message:
+            if key in ("type", "status"):
+                if isinstance(value, six.string_types):
+                    return value
+                return None
+
+    return None
+
+
+class MessageRouter(object):
+
+    def __init__(self):
+        self.catch_all = set()
+        self.typed = {}  # {message_type: set(handlers)}
+        self.mutex = Lock()
+
+    def add(self, handler, types=None):
+        with self.mutex:
+            if types is None:
+                self.catch_all.add(handler)
+            else:
+                for message_type in types:
+                    self.typed.setdefault(message_type, set()).add(handler)
+        return handler
+
+    def remove(self, handler):
+        """Remove handler from all types.
+
+        Raises:
+            KeyError if handler was not previously added.
+        """
+        with self.mutex:
+            found = handler in self.catch_all
+            self.catch_all.discard(handler)
+            for message_type in list(self.typed):
+                handlers = self.typed[message_type]
+                if handler in handlers:
+                    found = True
+                    handlers.remove(handler)
+                    if not handlers:
+                        del self.typed[message_type]
+            if not found:
+                raise KeyError(handler)
+
+    def get_handlers(self, message):
+        """Returns: Handlers a message should be delivered to."""
+        message_type = classify(message)
+        with self.mutex:
+            handlers = set(self.catch_all)
+            if message_type is not None:
+                handlers.update(self.typed.get(message_type, ()))
+        return list(handlers)
+
+    def __len__(self):
+        with self.mutex:
+            typed = set()
+            for handlers in self.typed.values():
+                typed.update(handlers)
+            return len(self.catch_all | typed)
@@ -1,13 +1,17 @@
 import binascii
 import base64
+import hashlib
 import umsgpack
+from threading import Lock
 from collections import namedtuple
+from collections import OrderedDict
 from storjnode.util import node_id_to_address, address_to_node_id
 from storjnode.common import PROTOCOL_VERSION
 from storjnode.common import MAX_PACKAGE_DATA
 
 
 MAX_MESSAGE_DATA = MAX_PACKAGE_DATA - 29  # max data - message call overhead
+VERIFY_CACHE_SIZE = 4096  # signature verdicts remembered by read
 
 
 Message = namedtuple('Message', [
@@ -23,6 +27,56 @@ class MaxSizeExceeded(Exception):
     pass
 
 
+class VerdictCache(object):
+    """Bounded LRU cache of signature verification verdicts.
+
+    Every message handler reads the same incoming message, this makes sure
+    its signature is only verified once.
+    """
+
+    def __init__(self, max_size=VERIFY_CACHE_SIZE):
+        self.max_size = max_size
+        self.verdicts = OrderedDict()  # {digest: verdict} lru first
+        self.hits = 0
+        self.misses = 0
+        self.mutex = Lock()
+
+    def get(self, digest):
+        """Returns: The cached verdict or None if unknown."""
+        with self.mutex:
+            verdict = self.verdicts.pop(digest, None)
+            if verdict is None:
+                self.misses += 1
+                return None
+            self.verdicts[digest] = verdict
+            self.hits += 1
+            return verdict
+
+    def set(self, digest, verdict):
+        with self.mutex:
+            self.verdicts.pop(digest, None)
+            self.verdicts[digest] = verdict
+            while len(self.verdicts) > self.max_size:
+                self.verdicts.popitem(last=False)
+
+    def clear(self):
+        with self.mutex:
+            self.verdicts.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.verdicts),
+            "max_size": self.max_size
+        }
+
+
+verdict_cache = VerdictCache()
+
+
 def create(btctxstore, node_wif, token, body):
 
     # FIXME make sure body does not contain dicts
@@ -69,10 +123,20 @@ def read(btctxstore, message):
     if len(msg.rawsig) != 65:
         return None
 
+    # already verified by another handler
+    digest = hashlib.sha256(umsgpack.packb(message)).digest()
+    verdict = verdict_cache.get(digest)
+
     # verify signature
-    address = node_id_to_address(msg.sender)
-    signature = base64.b64encode(msg.rawsig)
-    data = binascii.hexlify(umsgpack.packb([msg.version, msg.token, msg.body]))
-    if btctxstore.verify_signature(address, signature, data):
+    if verdict is None:
+        address = node_id_to_address(msg.sender)
+        signature = base64.b64encode(msg.rawsig)
+        data = binascii.hexlify(
+            umsgpack.packb([msg.version, msg.token, msg.body])
+        )
+        verdict = bool(btctxstore.verify_signature(address, signature, data))
+        verdict_cache.set(digest, verdict)
+
+    if verdict:
         return msg
     return None
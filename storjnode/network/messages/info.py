@@ -159,4 +159,5 @@ def enable(node, store_config):
             if request is not None:
                 _respond(node, request.sender, self.store_config)
 
-    return node.add_message_handler(_Handler(store_config))
+    return node.add_message_handler(_Handler(store_config),
+                                    types=["signal:request_info"])
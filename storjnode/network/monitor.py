@@ -7,6 +7,7 @@ from io import BytesIO
 from threading import Thread, RLock
 from storjnode.common import THREAD_SLEEP
 from storjnode.util import node_id_to_address
+from storjnode.network.dht_batch import WalkFailed
 from storjnode.network.messages.peers import read as read_peers
 from storjnode.network.messages.peers import request as request_peers
 from storjnode.network.messages.info import read as read_info
@@ -16,6 +17,10 @@ from storjnode.network.messages.info import request as request_info
 _log = storjnode.log.getLogger(__name__)
 
 
+DATASET_PROBES = 8  # dataset keys looked up at once
+DATASET_RETRIES = 3  # times a failed dataset key lookup is repeated
+
+
 # TODO add unl to data
 DEFAULT_DATA = {
     "peers": None,      # [nodeid, ...]
@@ -246,8 +251,10 @@ class Crawler(object):  # will not scale but good for now
     def crawl(self):
 
         # add info and peers message handlers
-        self.node.add_message_handler(self._handle_info_message)
-        self.node.add_message_handler(self._handle_peers_message)
+        self.node.add_message_handler(self._handle_info_message,
+                                      types=["info"])
+        self.node.add_message_handler(self._handle_peers_message,
+                                      types=["peers"])
 
         # start crawl at self
         nodeid = self.node.get_id()
@@ -280,13 +287,32 @@ def predictable_key(node, num):
     return "monitor_dataset_{0}_{1}".format(node.get_address(), str(num))
 
 
+def get_dataset_keys(node, keys):
+    # A failed lookup isn't a free dataset, retry rather than overwrite it.
+    values = {}
+    for attempt in range(DATASET_RETRIES):
+        try:
+            values.update(node.get_many(keys))
+            return values
+        except WalkFailed as e:
+            _log.warning("Retrying dataset lookup: {0}".format(e))
+            values.update(e.results)
+            keys = e.keys
+    raise WalkFailed(keys, values)
+
+
 def find_next_free_dataset_num(node):
     # FIXME probe with exponential increase then binary search lowest unused
     num = 0
-    while node[predictable_key(node, num)] is not None:
-        _log.info("Dataset {0} already exists!".format(num))
-        num += 1
-    return num
+    while True:
+        nums = range(num, num + DATASET_PROBES)
+        keys = [predictable_key(node, n) for n in nums]
+        values = get_dataset_keys(node, keys)
+        for key in keys:
+            if values[key] is None:
+                return num
+            _log.info("Dataset {0} already exists!".format(num))
+            num += 1
 
 
 def create_shard(node, num, begin, end, processed):
@@ -0,0 +1,137 @@
+"""
+Framing for multiplexed transfers over a single connection.
+
+When both nodes agree during the handshake (SYN carries mux = 1 and the
+SYN-ACK confirms it) the connection created for that contract carries
+frames instead of the serial contract_id, file_size, file_data protocol.
+Every transfer queued on the connection becomes a stream and streams are
+interleaved a frame at a time, so one large shard doesn't hold up the
+others. A frame looks like this:
+
+    contract_id (32 bytes, binary) type (1 byte) length (4 bytes) payload
+
+* SIZE: the uploader announces the file size (8 byte unsigned int.)
+* DATA: part of the file, sent in order.
+* WINDOW: the downloader allows the uploader to send more bytes of a stream
+  (4 byte unsigned int.) Uploaders start with no credit so nothing is sent
+  before the downloader has a stream ready to receive it.
+* RESET: abort a stream (e.g. the uploader doesn't have the file.)
+"""
+
+import struct
+import binascii
+from collections import OrderedDict
+
+
+MUX_SIZE = 1
+MUX_DATA = 2
+MUX_WINDOW = 3
+MUX_RESET = 4
+
+MUX_FRAME_SIZE = 65536  # max payload of a frame
+MUX_WINDOW_SIZE = 1048576  # max bytes in flight per stream
+MUX_SEND_BUF = MUX_FRAME_SIZE * 4  # stop building frames past this
+MUX_READ_SIZE = 1048576  # max bytes read from a socket at once
+
+HEADER = struct.Struct("<32sBI")
+SIZE_PAYLOAD = struct.Struct("<Q")
+WINDOW_PAYLOAD = struct.Struct("<I")
+
+
+class FramingError(Exception):
+    pass
+
+
+def encode_frame(contract_id, frame_type, payload=b""):
+    if len(payload) > MUX_FRAME_SIZE:
+        raise FramingError("Frame payload too large.")
+
+    raw_id = binascii.unhexlify(contract_id)
+    return HEADER.pack(raw_id, frame_type, len(payload)) + payload
+
+
+def parse_frames(buf):
+    """Split a receive buffer into complete frames.
+
+    Returns: ([(contract_id, frame_type, payload)], unparsed bytes)
+    """
+    frames = []
+    offset = 0
+    while len(buf) - offset >= HEADER.size:
+        raw_id, frame_type, length = HEADER.unpack_from(buf, offset)
+        if length > MUX_FRAME_SIZE:
+            raise FramingError("Frame payload too large.")
+        if frame_type not in (MUX_SIZE, MUX_DATA, MUX_WINDOW, MUX_RESET):
+            raise FramingError("Unknown frame type.")
+
+        end = offset + HEADER.size + length
+        if len(buf) < end:
+            break
+
+        contract_id = binascii.hexlify(raw_id).decode("ascii")
+        payload = buf[offset + HEADER.size:end]
+        frames.append((contract_id, frame_type, payload))
+        offset = end
+
+    return frames, buf[offset:]
+
+
+def get_wanted_window(con_info):
+    """Returns: Bytes a downloader wants in flight for a stream."""
+    if not con_info["file_size"]:
+        return MUX_WINDOW_SIZE
+
+    return min(MUX_WINDOW_SIZE, con_info["remaining"])
+
+
+class MuxStream(object):
+
+    def __init__(self, contract_id):
+        self.contract_id = contract_id
+
+        # Uploader: bytes we may still send.
+        self.credit = 0
+
+        # Downloader: bytes granted to the uploader not received yet.
+        self.window = 0
+
+
+class MuxConnection(object):
+    """Framing state of a multiplexed connection."""
+
+    def __init__(self):
+        self.streams = OrderedDict()  # {contract_id: MuxStream}
+        self.recv_buf = b""
+        self.send_buf = b""
+        self.bytes_recv = 0
+        self.bytes_sent = 0
+
+    def get_stream(self, contract_id):
+        if contract_id not in self.streams:
+            self.streams[contract_id] = MuxStream(contract_id)
+
+        return self.streams[contract_id]
+
+    def rotate(self, contract_id):
+        # Move a stream to the back of the line after it sent a frame.
+        self.streams[contract_id] = self.streams.pop(contract_id)
+
+    def queue_frame(self, contract_id, frame_type, payload=b""):
+        self.send_buf += encode_frame(contract_id, frame_type, payload)
+
+    def feed(self, data):
+        """Returns: Complete frames received so far."""
+        self.bytes_recv += len(data)
+        self.recv_buf += data
+        frames, self.recv_buf = parse_frames(self.recv_buf)
+        return frames
+
+    def flush(self, con):
+        """Send as much of the send buffer as the socket takes."""
+        if not self.send_buf or not con.connected:
+            return 0
+
+        bytes_sent = con.send(self.send_buf) or 0
+        self.send_buf = self.send_buf[bytes_sent:]
+        self.bytes_sent += bytes_sent
+        return bytes_sent
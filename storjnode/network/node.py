@@ -1,15 +1,28 @@
 import time
+import functools
 import threading
 import traceback
 import random
 import storjnode
 from storjnode.common import THREAD_SLEEP
 from twisted.internet import defer
+from twisted.internet import threads
+from twisted.internet import reactor
 from collections import OrderedDict
 from crochet import wait_for, run_in_reactor
 from twisted.internet.task import LoopingCall
 from storjnode import util
 from storjnode.network.repeat_relay import RepeatRelay
+from storjnode.network.wakeup import Wakeup
+from storjnode.network.unl_cache import UnlCache
+from storjnode.network.correlation import Correlator
+from storjnode.network.message_router import MessageRouter, classify
+from storjnode.network.handler_pool import HandlerPool, get_sender
+from storjnode.network.dedup import DuplicateFilter
+from storjnode.network.dedup import DEDUP_WINDOW, DEDUP_MAX_ENTRIES
+from storjnode.network.dht_cache import DhtCache
+from storjnode.network.dht_batch import BatchWalk, WalkFailed
+from storjnode.network.dht_batch import DHT_PARALLELISM
 from storjnode.network.message import sign, verify_signature
 from storjnode.network.server import Server, QUERY_TIMEOUT, WALK_TIMEOUT
 from pyp2p.unl import UNL
@@ -18,7 +31,8 @@ from pyp2p.unl import UNL
 # File transfer.
 from storjnode.network.file_transfer import FileTransfer
 from storjnode.network.file_transfer import process_unl_requests
-from storjnode.network.process_transfers import process_transfers
+from storjnode.network.file_transfer import get_unl_requestee
+from storjnode.network.transfer_engine import TransferEngine
 from storjnode.network.bandwidth.test import BandwidthTest
 from pyp2p.net import Net
 
@@ -64,6 +78,11 @@ class Node(object):
                  key, ksize=20, port=None, bootstrap_nodes=None,
                  dht_storage=None, max_messages=1024,
                  refresh_neighbours_interval=WALK_TIMEOUT,
+                 threadless=False, handler_workers=0, handler_limits=None,
+                 dedup_window=DEDUP_WINDOW,
+                 dedup_max_entries=DEDUP_MAX_ENTRIES,
+                 dht_cache_ttl=0, dht_negative_ttl=0,
+                 dht_parallelism=DHT_PARALLELISM,
 
                  # data transfer args
                  disable_data_transfer=True, store_config=None,
@@ -81,8 +100,29 @@ class Node(object):
             port (port): Port to for incoming packages, randomly by default.
             bootstrap_nodes [(ip, port), ...]: Known network node addresses as.
             dht_storage: implements :interface:`~kademlia.storage.IStorage`
+                         such as dht_storage.SqliteStorage(path)
             max_messages (int): Max unprecessed messages, additional dropped.
             refresh_neighbours_interval (float): Auto refresh neighbours.
+            threadless (bool): Wake message processing from the reactor when
+                               messages are queued and use timers instead of
+                               polling threads. Message handlers run in the
+                               reactor thread pool.
+            handler_workers (int): Run message handlers on this many worker
+                                   threads, 0 to run them on the dispatcher.
+            handler_limits: Dict of message type to max messages of that type
+                            handled at once by the workers, see
+                            storjnode.network.handler_pool.
+            dedup_window (float): Drop messages received again within this
+                                  many seconds, 0 to dispatch duplicates.
+            dedup_max_entries (int): Max received messages remembered.
+            dht_cache_ttl (float): Seconds DHT values read are reused,
+                                   0 (default) to always ask the network.
+                                   Reads may return values up to this old,
+                                   see storjnode.network.dht_cache.
+            dht_negative_ttl (float): Seconds missing DHT keys are reused,
+                                      0 (default) to always ask again.
+            dht_parallelism (int): Max DHT walks in flight for
+                                   get_many and set_many.
 
             disable_data_transfer: Disable data transfer for this node.
             store_config: Dict of storage paths to optional attributes.
@@ -96,6 +136,7 @@ class Node(object):
             nat_type: TODO doc string
         """
         self.bandwidth = bandwidth
+        self._threadless = bool(threadless)
         self.disable_data_transfer = bool(disable_data_transfer)
         self._transfer_request_handlers = set()
         self._transfer_complete_handlers = set()
@@ -136,12 +177,31 @@ class Node(object):
         # start services
         self._setup_server(key, ksize, dht_storage, max_messages,
                            refresh_neighbours_interval, bootstrap_nodes)
+        self._dht_cache = DhtCache(ttl=dht_cache_ttl,
+                                   negative_ttl=dht_negative_ttl)
+        self._dht_parallelism = dht_parallelism
 
         # Process incoming messages.
+        self._dedup = None
+        if dedup_window > 0:
+            self._dedup = DuplicateFilter(window=dedup_window,
+                                          max_entries=dedup_max_entries)
+        self._handler_pool = None
+        if handler_workers > 0:
+            self._handler_pool = HandlerPool(
+                workers=handler_workers, limits=handler_limits,
+                max_pending=max_messages
+            )
         self._setup_message_dispatcher()
 
         # Rebroadcast relay messages.
-        self.repeat_relay = RepeatRelay(self)
+        self.repeat_relay = RepeatRelay(self, threadless=self._threadless)
+        self._unl_cache = UnlCache()
+
+        # Route responses to pending requests.
+        self._correlator = Correlator(get_peer=get_unl_requestee)
+        self.add_message_handler(self._correlator.handle,
+                                 types=["unl_response"])
 
         if not self.disable_data_transfer:
             self._setup_data_transfer_client(
@@ -154,7 +214,15 @@ class Node(object):
             )
 
     def _setup_message_dispatcher(self):
-        self._message_handlers = set()
+        self._message_router = MessageRouter()
+        if self._threadless:
+            self._message_wakeup = Wakeup(self._dispatch_messages,
+                                          in_thread=True)
+            self.server.protocol.on_message_queued = \
+                self._message_wakeup.notify
+            self._message_wakeup.notify()  # anything queued before the hook
+            return
+
         self._message_dispatcher_thread_stop = False
         self._message_dispatcher_thread = threading.Thread(
             target=self._message_dispatcher_loop
@@ -166,7 +234,8 @@ class Node(object):
         self.server = Server(
             key, self.port, ksize=ksize, storage=storage,
             max_messages=max_messages,
-            refresh_neighbours_interval=refresh_neighbours_interval
+            refresh_neighbours_interval=refresh_neighbours_interval,
+            threadless=self._threadless
         )
         port_handler = self.server.listen(self.port)
         self.server.set_port_handler(port_handler)
@@ -206,15 +275,26 @@ class Node(object):
 
         # Setup success callback values.
         self._data_transfer.success_value = result
+
+        # Sockets are serviced when ready, the rest on a slow timer.
+        self._transfer_engine = TransferEngine(self._data_transfer)
         self.process_data_transfers()
+        self.reconcile_store()
 
     def stop(self):
         """Stop storj node."""
-        self._message_dispatcher_thread_stop = True
-        self._message_dispatcher_thread.join()
+        if self._threadless:
+            self.server.protocol.on_message_queued = None
+            self._message_wakeup.stop()
+        else:
+            self._message_dispatcher_thread_stop = True
+            self._message_dispatcher_thread.join()
+        if self._handler_pool is not None:
+            self._handler_pool.stop()
         self.server.stop()
         self.repeat_relay.stop()
         if not self.disable_data_transfer:
+            reactor.callFromThread(self._transfer_engine.stop)
             self._data_transfer.net.stop()
 
     ##################
@@ -316,70 +396,86 @@ class Node(object):
     ###########################
 
     def get_unl_by_node_id(self, node_id):
-        """Get the WAN IP of this Node.
+        """Get the UNL of a node.
+
+        UNLs are cached, see storjnode.network.unl_cache.
 
         Returns:
-            A twisted.internet.defer.Deferred that resolves to
-            The UNL on success or None.
+            A twisted.internet.defer.Deferred that resolves to the UNL or
+            errbacks with storjnode.network.correlation.RequestTimeout.
         """
+        return self._unl_cache.get(
+            node_id, functools.partial(self._request_unl, node_id)
+        )
 
-        # UNL request.
-        _log.debug("In get UNL by node id")
-        unl_req = OrderedDict([
-            (u"type", u"unl_request"),
-            (u"requester", self.get_address())
-        ])
+    def invalidate_unl(self, node_id):
+        """Forget the cached UNL of a node."""
+        self._unl_cache.invalidate(node_id)
 
-        # Sign UNL request.
-        unl_req = sign(unl_req, self.get_key())
+    def _watch_transfer(self, node_id, contract_id):
+        # Forget the UNL if the transfer fails, it may have changed.
+        d = self._data_transfer.defers.get(contract_id)
+        if d is None:
+            return
+
+        def errback(failure):
+            self.invalidate_unl(node_id)
+            return failure
 
-        # Handle responses for this request.
-        def handler_builder(self, d, their_node_id, wif):
-            def handler(node, msg):
-                # Is this a response to our request?
-                try:
-                    msg = util.list_to_ordered_dict(msg)
+        d.addErrback(errback)
 
-                    # Not a UNL response.
-                    if msg[u"type"] != u"unl_response":
-                        _log.debug("unl response: type !=")
-                        return
+    def _request_unl(self, node_id):
+        wif = self.get_key()
 
-                    # Invalid UNL.
-                    their_unl = UNL(value=msg[u"unl"]).deconstruct()
-                    if their_unl is None:
-                        _log.debug("unl response:their unl !=")
-                        return
+        # Read responses to this request.
+        def read_response(msg):
+            try:
+                msg = util.list_to_ordered_dict(msg)
 
-                    # Invalid signature.
-                    if not verify_signature(msg, wif, their_node_id):
-                        _log.debug("unl response: their sig")
-                        return
+                # Not a UNL response.
+                if msg[u"type"] != u"unl_response":
+                    _log.debug("unl response: type !=")
+                    return None
 
-                    # Everything passed: fire callback.
-                    d.callback(msg[u"unl"])
+                # Invalid UNL.
+                their_unl = UNL(value=msg[u"unl"]).deconstruct()
+                if their_unl is None:
+                    _log.debug("unl response:their unl !=")
+                    return None
 
-                    # Remove this callback.
-                    node.remove_message_handler(handler)
-                except (ValueError, KeyError):
-                    _log.debug("unl response:val or key er")
-                    pass  # not a unl response
+                # Invalid signature.
+                if not verify_signature(msg, wif, node_id):
+                    _log.debug("unl response: their sig")
+                    return None
 
-            return handler
+                return msg[u"unl"]
+            except (ValueError, KeyError):
+                _log.debug("unl response:val or key er")
+                return None  # not a unl response
 
-        # Build message handler.
-        d = defer.Deferred()
-        handler = handler_builder(self, d, node_id, self.get_key())
+        request_id, d = self._correlator.register(read_response, peer=node_id)
 
-        # Register new handler for this UNL request.
-        self.add_message_handler(handler)
+        # UNL request.
+        _log.debug("In get UNL by node id")
+        unl_req = OrderedDict([
+            (u"type", u"unl_request"),
+            (u"requester", self.get_address()),
+            (u"request_id", request_id)
+        ])
+
+        # Sign UNL request.
+        unl_req = sign(unl_req, wif)
 
         # Send our get UNL request to node.
         unl_req = util.ordered_dict_to_list(unl_req)
-        self.repeat_relay_message(node_id, unl_req)
+        relay_id = self.repeat_relay_message(node_id, unl_req)
 
-        # Return a new deferred.
-        return d
+        # Stop asking once answered or timed out.
+        def stop_relay(result):
+            self.cancel_repeat_relay(relay_id)
+            return result
+
+        return d.addBoth(stop_relay)
 
     def get_unl(self):
         if self.disable_data_transfer:
@@ -395,12 +491,34 @@ class Node(object):
             txt = "An unknown error occured in process_transfers: %s"
             _log.error(txt % repr(ret))
 
-        d = LoopingCall(
-            process_transfers,
-            self._data_transfer
-        ).start(0.002, now=True)
+        d = self._transfer_engine.start()
         d.addErrback(process_transfers_error)
 
+    @run_in_reactor
+    def reconcile_store(self):
+        """Periodically reconcile the store used space and shard index.
+
+        Shards are added and removed through the storage manager, which
+        keeps the used space accounting up to date. This catches changes
+        made behind its back, the walk runs in a thread pool.
+        """
+        if self.disable_data_transfer:
+            raise Exception("Data transfer disabled!")
+
+        def reconcile():
+            store_config = self._data_transfer.store_config
+            return threads.deferToThread(storjnode.storage.manager.reconcile,
+                                         store_config)
+
+        def reconcile_error(ret):
+            txt = "An unknown error occured reconciling the store: %s"
+            _log.error(txt % repr(ret))
+
+        d = LoopingCall(reconcile).start(
+            storjnode.storage.manager.RECONCILE_INTERVAL, now=False
+        )
+        d.addErrback(reconcile_error)
+
     def test_bandwidth(self, node_id):
         """Tests the bandwidth between yourself and a remote peer.
         Only one test can be active at any given time! If a test
@@ -477,9 +595,12 @@ class Node(object):
         def callback_builder(data_id, direction):
             def callback(peer_unl):
                 # Deferred.
-                return self._data_transfer.simple_data_request(
+                result = self._data_transfer.simple_data_request(
                     data_id, peer_unl, direction
                 )
+                if not isinstance(result, defer.Deferred):
+                    self._watch_transfer(node_id, result)  # contract id
+                return result
 
             return callback
 
@@ -592,8 +713,21 @@ class Node(object):
     #######################
 
     def repeat_relay_message(self, node_id, message):
+        """Relay a message and rebroadcast it until cancelled or expired.
+
+        Returns:
+            ID to pass to cancel_repeat_relay once a reply was received.
+        """
         return self.repeat_relay.relay(node_id, message)
 
+    def cancel_repeat_relay(self, relay_id):
+        """Stop rebroadcasting a message sent with repeat_relay_message.
+
+        Returns:
+            True if the message was still being rebroadcast.
+        """
+        return self.repeat_relay.cancel(relay_id)
+
     def relay_message(self, nodeid, message):
         """Send relay message to a node.
 
@@ -623,20 +757,80 @@ class Node(object):
             txt = """Message handler raised exception: {0}\n\n{1}"""
             _log.error(txt.format(repr(e), traceback.format_exc()))
 
+    def _dispatch_handlers(self, message, handlers):
+        for handler in handlers:
+            self._dispatch_message(message, handler)
+
+    def _dispatch_messages(self):
+        for message in self.server.get_messages():
+            if self._dedup is not None and self._dedup.is_duplicate(message):
+                continue
+            handlers = self._message_router.get_handlers(message)
+            if self._handler_pool is None:
+                self._dispatch_handlers(message, handlers)
+            elif handlers:
+                self._handler_pool.submit(
+                    classify(message), get_sender(message),
+                    functools.partial(self._dispatch_handlers,
+                                      message, handlers)
+                )
+
+    def get_handler_stats(self):
+        """Get queue depth and latency per message type.
+
+        Returns:
+            See storjnode.network.handler_pool.HandlerPool.get_stats or
+            None if message handlers are not run by worker threads.
+        """
+        if self._handler_pool is None:
+            return None
+        return self._handler_pool.get_stats()
+
+    def get_dedup_stats(self):
+        """Get the number of suppressed duplicate messages.
+
+        Returns:
+            See storjnode.network.dedup.DuplicateFilter.info or None if
+            duplicate messages are not suppressed.
+        """
+        if self._dedup is None:
+            return None
+        return self._dedup.info()
+
+    def get_relay_stats(self):
+        """Get next hop cache hits and skipped unresponsive peers.
+
+        Returns:
+            See storjnode.network.relay_cache.RelayCache.info.
+        """
+        return self.server.relay_cache.info()
+
+    def get_dht_cache_stats(self):
+        """Get DHT read cache hits and misses.
+
+        Returns:
+            See storjnode.network.dht_cache.DhtCache.info.
+        """
+        return self._dht_cache.info()
+
     def _message_dispatcher_loop(self):
         while not self._message_dispatcher_thread_stop:
-            for message in self.server.get_messages():
-                for handler in self._message_handlers.copy():
-                    self._dispatch_message(message, handler)
-
+            self._dispatch_messages()
             time.sleep(THREAD_SLEEP)
 
-    def add_message_handler(self, handler):
+    def add_message_handler(self, handler, types=None):
         """Add message handler to be call when a message is received.
 
         The handler must be callable and accept two arguments. The first is the
         calling node itself, the second argument is the message.
 
+        Args:
+            handler: The message handler.
+            types: Only call handler for messages of these types, e.g.
+                   ["info", "signal:request_info", "unl_request", "SYN"].
+                   See storjnode.network.message_router. By default the
+                   handler is called for every message.
+
         Returns:
             The given handler.
 
@@ -646,8 +840,7 @@ class Node(object):
                print("Received message: {0}".format(message))
            node.add_message_handler(handler)
         """
-        self._message_handlers.add(handler)
-        return handler
+        return self._message_router.add(handler, types=types)
 
     def remove_message_handler(self, handler):
         """Remove a message handler from the Node.
@@ -655,7 +848,7 @@ class Node(object):
         Raises:
             KeyError if handler was not previously added.
         """
-        self._message_handlers.remove(handler)
+        self._message_router.remove(handler)
 
     ##############################
     # non blocking DHT interface #
@@ -664,12 +857,23 @@ class Node(object):
     def async_get(self, key, default=None):
         """Get a key if the network has it.
 
+        Values read within dht_cache_ttl (or missing within
+        dht_negative_ttl) are answered from the cache without asking the
+        network.
+
         Returns:
             A twisted.internet.defer.Deferred that resloves to
             None if not found, the value otherwise.
         """
         # FIXME return default if not found (add to kademlia)
-        return self.server.get(key)
+        cached, value = self._dht_cache.get(key)
+        if cached:
+            return defer.succeed(value)
+
+        def callback(value):
+            self._dht_cache.set(key, value)
+            return value
+        return self.server.get(key).addCallback(callback)
 
     def async_set(self, key, value):
         """Set the given key to the given value in the network.
@@ -677,7 +881,77 @@ class Node(object):
         Returns:
             A twisted.internet.defer.Deferred that resloves when set.
         """
-        self.server.set(key, value)
+        self._dht_cache.invalidate(key)
+
+        def callback(stored):
+            if stored:
+                self._dht_cache.set(key, value)
+            return stored
+        return self.server.set(key, value).addCallback(callback)
+
+    def async_get_many(self, keys, default=None, parallelism=None):
+        """Get many keys at once, walking the network concurrently.
+
+        Args:
+            keys: Iterable of keys.
+            default: Value for keys not found.
+            parallelism: Max walks in flight, dht_parallelism by default.
+
+        Returns:
+            A twisted.internet.defer.Deferred that resloves to a dict of
+            key to value, default if not found. Fails with
+            storjnode.network.dht_batch.WalkFailed if the walk for any
+            key failed, its keys are the keys to retry.
+        """
+        results = {}
+        missing = []
+        for key in keys:
+            cached, value = self._dht_cache.get(key)
+            if cached:
+                results[key] = default if value is None else value
+            elif key not in missing:
+                missing.append(key)
+        if len(missing) == 0:
+            return defer.succeed(results)
+
+        def callback(found):
+            failed = []
+            for key in missing:
+                if key not in found:  # walk failed, not the same as missing
+                    failed.append(key)
+                    continue
+                value = found[key]
+                self._dht_cache.set(key, value)
+                results[key] = default if value is None else value
+            if len(failed) > 0:
+                raise WalkFailed(failed, results)
+            return results
+        walk = BatchWalk(self.server, parallelism or self._dht_parallelism)
+        return walk.get(missing).addCallback(callback)
+
+    def async_set_many(self, items, parallelism=None):
+        """Set many keys at once, walking the network concurrently.
+
+        Args:
+            items: Dict of key to value.
+            parallelism: Max walks in flight, dht_parallelism by default.
+
+        Returns:
+            A twisted.internet.defer.Deferred that resloves to a dict of
+            key to True if set.
+        """
+        for key in items:
+            self._dht_cache.invalidate(key)
+
+        def callback(stored):
+            results = {}
+            for key in items:
+                results[key] = bool(stored.get(key))
+                if results[key]:
+                    self._dht_cache.set(key, items[key])
+            return results
+        walk = BatchWalk(self.server, parallelism or self._dht_parallelism)
+        return walk.set(items).addCallback(callback)
 
     ###############################
     # blocking DHT dict interface #
@@ -699,7 +973,32 @@ class Node(object):
         Raises:
             crochet.TimeoutError after storjnode.network.server.WALK_TIMEOUT
         """
-        self.async_set(key, value)
+        return self.async_set(key, value)
+
+    def get_many(self, keys, default=None, timeout=WALK_TIMEOUT):
+        """Get many keys at once, see async_get_many.
+
+        Returns:
+            Dict of key to value, default if not found.
+
+        Raises:
+            crochet.TimeoutError after timeout seconds
+            storjnode.network.dht_batch.WalkFailed if any key's walk failed
+        """
+        get_many = run_in_reactor(self.async_get_many)
+        return get_many(keys, default=default).wait(timeout)
+
+    def set_many(self, items, timeout=WALK_TIMEOUT):
+        """Set many keys at once, see async_set_many.
+
+        Returns:
+            Dict of key to True if set.
+
+        Raises:
+            crochet.TimeoutError after timeout seconds
+        """
+        set_many = run_in_reactor(self.async_set_many)
+        return set_many(items).wait(timeout)
 
     def __getitem__(self, key):
         """x.__getitem__(y) <==> x[y]"""
@@ -726,17 +1025,20 @@ class Node(object):
             self[key] = default
         return self[key]
 
+    @wait_for(timeout=WALK_TIMEOUT)
     def update(self, e=None, **f):
         """D.update([e, ]**f) -> None.  Update D from dict/iterable e and f.
         If e present and has a .keys() method, does: for k in e: D[k] = e[k]
         If e present and lacks .keys() method, does: for (k, v) in e: D[k] = v
         In either case, this is followed by: for k in f: D[k] = f[k]
         """
+        items = OrderedDict()
         if e and "keys" in dir(e):
             for k in e:
-                self[k] = e[k]
-        else:
+                items[k] = e[k]
+        elif e:
             for (k, v) in e:
-                self[k] = v
+                items[k] = v
         for k in f:
-            self[k] = f[k]
+            items[k] = f[k]
+        return self.async_set_many(items)
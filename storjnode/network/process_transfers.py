@@ -14,18 +14,28 @@ sense of it all. The protocol is actually quite simple:
 * The person sending the contract ID depends on whoever has the greatest UNL
   when converted to an int -- this person is known as the master.
 * The person sending the file_size is always the person who has the file.
+* A SYN may carry an offset to resume a partial download. The file_size
+  sent is still the full size but only data after the offset follows.
 * At the end of a transfer, the next data request is processed (send or recv
   contract_id) and the process continues.
 """
 
 import logging
 import struct
+import socket
+import errno
 import time
+import ssl
 import os
 from twisted.internet import defer
 import storjnode.storage as storage
 from storjnode.util import safe_log_var
 from storjnode.network.file_handshake import protocol
+from storjnode.network.multiplex import MUX_SIZE, MUX_DATA, MUX_WINDOW
+from storjnode.network.multiplex import MUX_RESET, MUX_FRAME_SIZE
+from storjnode.network.multiplex import MUX_SEND_BUF, MUX_READ_SIZE
+from storjnode.network.multiplex import SIZE_PAYLOAD, WINDOW_PAYLOAD
+from storjnode.network.multiplex import FramingError, get_wanted_window
 import pyp2p.unl
 import pyp2p.net
 import pyp2p.dht_msg
@@ -44,11 +54,51 @@ logging.verbose = lambda msg, *args, **kwargs:\
 
 _log = storjnode.log.getLogger(__name__)
 
+# Upload directly from the shard file to plain TCP sockets with sendfile,
+# so uploaded data is not copied through user space. Set to 0 to disable.
+ENABLE_SENDFILE = 1
+
 
 class TransferError(Exception):
     pass
 
 
+def can_sendfile(con):
+    if not ENABLE_SENDFILE or not hasattr(os, "sendfile"):
+        return 0
+    sock = getattr(con, "s", None)
+    if not isinstance(sock, socket.socket) or isinstance(sock, ssl.SSLSocket):
+        return 0
+    return 1
+
+
+def sendfile_chunk(client, con, contract_id, position, size):
+    """Send part of an upload from the shard file to the socket.
+
+    Returns: Bytes sent, 0 if the socket isn't ready or was closed.
+    """
+    if not con.connected:
+        return 0
+
+    try:
+        bytes_sent = os.sendfile(
+            con.s.fileno(),
+            client.upload_sources.fileno(contract_id),
+            position,
+            size
+        )
+    except (OSError, IOError) as e:
+        if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+            return 0
+
+        _log.debug("Sendfile failed: " + str(e))
+        con.close()
+        return 0
+
+    con.alive = time.time()
+    return bytes_sent
+
+
 def cleanup_cons(client):
     # Record old connections (dead connections.)
     old_cons = []
@@ -60,8 +110,8 @@ def cleanup_cons(client):
                     e = TransferError("Connection died.")
                     client.defers[contract_id].errback(e)
 
-            # Cleanup old structures.
-            client.cleanup_transfers(con, contract_id)
+                # Cleanup old structures.
+                client.cleanup_transfers(con, contract_id)
 
             # Record old connection.
             old_cons.append(con)
@@ -73,17 +123,14 @@ def cleanup_cons(client):
 
 
 def expire_handshakes(client):
-    # Deletes handshakes that don't have a response
+    # Errback handshakes that don't have a response
     # after N seconds.
-    for contract_id in list(client.contracts):
-        if contract_id in client.handshake:
-            handshake = client.handshake[contract_id]
-            elapsed = time.time() - handshake["timestamp"]
-            if elapsed >= 350:  # Tree fiddy. 'bout 6 mins.
-                if contract_id in client.defers:
-                    e = Exception("Handshake timed out.")
-                    client.defers[contract_id].errback(e)
-                    del client.defers[contract_id]
+    for contract_id in client.pop_expired_handshakes():
+        if contract_id in client.contracts:
+            if contract_id in client.defers:
+                e = Exception("Handshake timed out.")
+                client.defers[contract_id].errback(e)
+                del client.defers[contract_id]
 
 
 def do_upload(client, con, contract, con_info, contract_id):
@@ -92,18 +139,18 @@ def do_upload(client, con, contract, con_info, contract_id):
     # Send file size.
     if not con_info["file_size"]:
         # Get file size.
-        path = storage.manager.find(
-            client.store_config,
+        source = client.get_upload_source(
+            contract_id,
             contract["data_id"]
         )
-        if path is None:
+        if source is None:
             _log.debug("Error: we don't have this file!")
             con.close()
             return 0
 
-        file_size = os.path.getsize(path)
+        file_size = source.size
         con_info["file_size"] = file_size
-        con_info["remaining"] = file_size
+        con_info["remaining"] = file_size - contract.get(u"offset", 0)
 
         # Marshal file size for network.
         if sys.version_info >= (3, 0, 0):
@@ -120,6 +167,10 @@ def do_upload(client, con, contract, con_info, contract_id):
         # Send file size.
         con.send(net_file_size, send_all=1)
 
+        # Resumed download was already complete.
+        if not con_info["remaining"]:
+            return 1
+
     # Request bandwidth for transfer.
     chunk_size = 1048576
     allocation = client.bandwidth.request(
@@ -128,16 +179,24 @@ def do_upload(client, con, contract, con_info, contract_id):
         chunk_size
     )
 
-    # Get next chunk from file.
+    # Upload next chunk from file to socket.
     position = con_info["file_size"] - con_info["remaining"]
-    data_chunk = client.get_data_chunk(
-        contract["data_id"],
-        position,
-        allocation
-    )
-
-    # Upload chunk binary to socket.
-    bytes_sent = con.send(data_chunk)
+    if can_sendfile(con) and contract_id in client.upload_sources:
+        bytes_sent = sendfile_chunk(
+            client,
+            con,
+            contract_id,
+            position,
+            allocation
+        )
+    else:
+        data_chunk = client.get_data_chunk(
+            contract["data_id"],
+            position,
+            allocation,
+            contract_id
+        )
+        bytes_sent = con.send(data_chunk)
     if bytes_sent:
         con_info["remaining"] -= bytes_sent
         client.bandwidth.update(
@@ -177,11 +236,21 @@ def do_download(client, con, contract, con_info, contract_id):
 
                 file_size, = struct.unpack("<20s", file_size_buf)
                 file_size = int(file_size_buf.rstrip(b"\0"))
+                remaining = file_size - contract.get(u"offset", 0)
+                if remaining < 0:
+                    _log.debug("Offset is past the end of the file.")
+                    con.close()
+                    return -2
+
                 con_info["file_size"] = file_size
-                con_info["remaining"] = file_size
+                con_info["remaining"] = remaining
             else:
                 return -3
 
+        # Resumed download was already complete.
+        if not con_info["remaining"]:
+            return finish_download(client, contract)
+
     # Request bandwidth for transfer.
     chunk_size = con_info["remaining"]
     allocation = client.bandwidth.request(
@@ -211,37 +280,41 @@ def do_download(client, con, contract, con_info, contract_id):
 
     # When done downloading close con.
     if not con_info["remaining"]:
-        # Check download.
-        data_id = contract["data_id"]
-        temp_path = client.downloading[data_id]
-        invalid_hash = False
-        with open(temp_path, "rb+") as shard:
-            # Delete file if it doesn't hash right!
-            found_hash = storage.shard.get_id(shard)
-            if found_hash != data_id:
-                invalid_hash = True
-                _log.debug(found_hash)
-                _log.debug(data_id)
-                _log.debug("Error: downloaded file doesn't hash right! \a")
-                return -4
-
-            # Move shard to storage.
-            storage.manager.add(
-                client.store_config,
-                shard
-            )
+        return finish_download(client, contract)
 
-        # Remove corrupt file.
-        if invalid_hash:
-            os.remove(temp_path)
+    return -5
 
-        # Remove that we're downloading this.
-        del client.downloading[data_id]
 
-        # Ready for a new transfer (if there are any.)
-        return 1
+def finish_download(client, contract):
+    # Check download (hashed while it was written.)
+    data_id = contract["data_id"]
+    temp_path = client.downloading[data_id]
+    sink = client.get_download_sink(data_id)
+    client.close_download_sink(data_id)
+    found_hash = sink.hexdigest()
+
+    # Delete file if it doesn't hash right!
+    if found_hash != data_id:
+        _log.debug(found_hash)
+        _log.debug(data_id)
+        _log.debug("Error: downloaded file doesn't hash right! \a")
+        os.remove(temp_path)
+        return -4
+
+    # Move shard to storage.
+    with open(temp_path, "rb") as shard:
+        storage.manager.add(
+            client.store_config,
+            shard,
+            shard_id=found_hash,
+            move=True
+        )
 
-    return -5
+    # Remove that we're downloading this.
+    del client.downloading[data_id]
+
+    # Ready for a new transfer (if there are any.)
+    return 1
 
 
 def get_contract_id(client, con, contract_id):
@@ -272,6 +345,12 @@ def complete_transfer(client, contract_id, con):
         # Leave bandwidth slice table.
         client.bandwidth.remove_transfer(contract_id)
 
+        # Close shard of finished upload.
+        client.upload_sources.remove(contract_id)
+
+        # Transfer is no longer pending on this con.
+        client.dequeue_contract(con, contract_id)
+
         # Determine who is master.
         contract = client.contracts[contract_id]
         their_unl = client.get_their_unl(contract)
@@ -301,6 +380,10 @@ def complete_transfer(client, contract_id, con):
         for handler in old_handlers:
             client.handlers["complete"].remove(handler)
 
+        # Streams of multiplexed cons run in parallel.
+        if con in client.con_mux:
+            return
+
         # Queue next transfer.
         if is_master:
             # Set next contract ID and send to client.
@@ -331,102 +414,386 @@ def process_dht_messages(client):
             client.net.dht_messages.remove(msg)
 
 
-def process_transfers(client):
-    # Process DHT messages.
-    process_dht_messages(client)
+def is_hung(con):
+    # Socket has hung ungracefully.
+    duration = time.time() - con.alive
+    if duration >= 120.0:
+        _log.debug("Ungraceful socket close")
+        con.close()
+        return 1
 
-    # Process and accept connections.
-    client.net.synchronize()
+    return 0
 
-    # Raise appropriate async callbacks for errors.
-    cleanup_cons(client)
 
-    # Expired handshakes and call any errbacks for errors.
-    expire_handshakes(client)
+def fire_start_handlers(client, con, contract_id):
+    _log.debug("In con, and starting new transfer =")
+    old_handlers = set()
+    for handler in client.handlers["start"]:
+        # Test start handler.
+        ret = handler(client, con, contract_id)
 
-    # Process connections.
-    for con in client.cons:
-        # Socket has hung ungracefully.
-        duration = time.time() - con.alive
-        if duration >= 120.0:
-            _log.debug("Ungraceful socket close")
-            con.close()
-            continue
+        # Handler was associated with this transfer.
+        if ret == -1:
+            old_handlers.add(handler)
 
-        # Wait until there's new transfers to process.
-        if not client.is_queued(con):
-            continue
+    # Remove old start handlers.
+    for handler in old_handlers:
+        client.handlers["start"].remove(handler)
 
-        # Get active contract ID (if we're not master.)
-        contract_id = client.con_transfer[con]
-        if len(contract_id) < 64:
-            _log.debug("Contract id =")
-            _log.debug(contract_id)
-            if not get_contract_id(client, con, contract_id):
-                continue
-            else:
-                # Check contract ID is associated with right con.
-                contract_id = client.con_transfer[con]
-                if contract_id not in client.con_info[con]:
-                    _log.debug("Client sent wrong contract ID!")
-                    con.close()
-                    continue
 
-        # Check contract id.
+def process_con(client, con):
+    # Multiplexed cons carry their own framing.
+    if con in client.con_mux:
+        process_mux_con(client, con)
+        return
+
+    # Wait until there's new transfers to process.
+    if not client.is_queued(con):
+        return
+
+    # Get active contract ID (if we're not master.)
+    contract_id = client.con_transfer[con]
+    if len(contract_id) < 64:
+        _log.debug("Contract id =")
+        _log.debug(contract_id)
+        if not get_contract_id(client, con, contract_id):
+            return
+        else:
+            # Check contract ID is associated with right con.
+            contract_id = client.con_transfer[con]
+            if contract_id not in client.con_info[con]:
+                _log.debug("Client sent wrong contract ID!")
+                con.close()
+                return
+
+    # Check contract id.
+    if contract_id not in client.contracts:
+        _log.debug("Contract ID not found")
+        con.close()
+        return
+
+    # Reached end of transfer queue.
+    if contract_id == u"0" * 64:
+        return
+
+    # Anything left to do?
+    con_info = client.con_info[con][contract_id]
+    if not con_info["remaining"]:
+        return
+
+    # Execute start callbacks.
+    if not con_info["file_size"]:
+        fire_start_handlers(client, con, contract_id)
+
+    # Transfer data.
+    contract = client.contracts[contract_id]
+    if client.get_direction(contract_id) == u"send":
+        transfer_complete = do_upload(
+            client,
+            con,
+            contract,
+            con_info,
+            contract_id
+        )
+    else:
+        transfer_complete = do_download(
+            client,
+            con,
+            contract,
+            con_info,
+            contract_id
+        )
+
+    # Run any callbacks and schedule next transfer.
+    if transfer_complete == 1:
+        _log.debug("Transfer completed")
+        complete_transfer(client, contract_id, con)
+
+
+def reset_stream(client, con, contract_id, notify=1):
+    """Abort a single stream of a multiplexed con."""
+    mux = client.con_mux[con]
+    if notify:
+        mux.queue_frame(contract_id, MUX_RESET)
+    mux.streams.pop(contract_id, None)
+
+    # Nothing left to transfer.
+    client.dequeue_contract(con, contract_id)
+    con_info = client.con_info.get(con, {}).get(contract_id)
+    if con_info is not None:
+        con_info["remaining"] = 0
+
+    # Stop downloading (partial download is kept if resuming is enabled.)
+    contract = client.contracts.get(contract_id)
+    if contract is not None:
+        data_id = contract["data_id"]
+        if client.get_direction(contract_id) == u"receive":
+            if data_id in client.downloading:
+                client.close_download_sink(data_id)
+                del client.downloading[data_id]
+                client.discard_partial(data_id)
+
+    # Cleanup upload.
+    client.upload_sources.remove(contract_id)
+
+    # Leave bandwidth slice table.
+    if contract_id in client.bandwidth.transfers:
+        client.bandwidth.remove_transfer(contract_id)
+
+    # Return async error.
+    if contract_id in client.defers:
+        e = TransferError("Stream was reset.")
+        client.defers[contract_id].errback(e)
+        del client.defers[contract_id]
+
+
+def process_mux_frame(client, con, mux, contract_id, frame_type, payload):
+    """Returns: 1 if processed, 0 if ignored, -1 for protocol errors."""
+
+    # Credit may arrive before the contract is associated with this con.
+    if frame_type == MUX_WINDOW:
         if contract_id not in client.contracts:
-            _log.debug("Contract ID not found")
-            con.close()
-            continue
+            return 0
+        if client.contract_cons.get(contract_id) not in (None, con):
+            return 0
+
+        increment, = WINDOW_PAYLOAD.unpack(payload)
+        mux.get_stream(contract_id).credit += increment
+        return 1
+
+    # Everything else needs an open stream (may have been reset.)
+    if client.contract_cons.get(contract_id) is not con:
+        return 0
+    if contract_id not in mux.streams:
+        return 0
+
+    if frame_type == MUX_RESET:
+        _log.debug("Stream reset by peer.")
+        reset_stream(client, con, contract_id, notify=0)
+        return 1
+
+    # Only downloads receive file data.
+    if client.get_direction(contract_id) != u"receive":
+        return -1
+
+    stream = mux.streams[contract_id]
+    contract = client.contracts[contract_id]
+    con_info = client.con_info[con][contract_id]
+    if frame_type == MUX_SIZE:
+        if con_info["file_size"]:
+            return -1
+
+        file_size, = SIZE_PAYLOAD.unpack(payload)
+        if not file_size:
+            reset_stream(client, con, contract_id)
+            return 0
+
+        remaining = file_size - contract.get(u"offset", 0)
+        if remaining < 0:
+            return -1
+
+        con_info["file_size"] = file_size
+        con_info["remaining"] = remaining
+        fire_start_handlers(client, con, contract_id)
+
+        # Resumed download was already complete.
+        if not remaining:
+            finish_mux_download(client, con, mux, contract_id)
+        return 1
+
+    # Check data is within what we asked for.
+    bytes_recv = len(payload)
+    if not con_info["file_size"]:
+        return -1
+    if bytes_recv > stream.window or bytes_recv > con_info["remaining"]:
+        return -1
+
+    # Save data.
+    stream.window -= bytes_recv
+    con_info["remaining"] -= bytes_recv
+    client.save_data_chunk(contract["data_id"], payload)
+    client.bandwidth.update(
+        "downstream",
+        bytes_recv,
+        contract_id
+    )
+
+    # Download complete.
+    if not con_info["remaining"]:
+        finish_mux_download(client, con, mux, contract_id)
 
-        # Reached end of transfer queue.
-        if contract_id == u"0" * 64:
+    return 1
+
+
+def finish_mux_download(client, con, mux, contract_id):
+    del mux.streams[contract_id]
+    contract = client.contracts[contract_id]
+    if finish_download(client, contract) == 1:
+        complete_transfer(client, contract_id, con)
+    else:
+        reset_stream(client, con, contract_id)
+
+
+def grant_mux_windows(client, con, mux):
+    # Let uploaders send more once half of a window was received.
+    for contract_id, stream in list(mux.streams.items()):
+        if client.contract_cons.get(contract_id) is not con:
+            continue
+        if client.get_direction(contract_id) != u"receive":
             continue
 
-        # Anything left to do?
         con_info = client.con_info[con][contract_id]
-        if not con_info["remaining"]:
+        wanted = get_wanted_window(con_info)
+        if stream.window * 2 > wanted:
             continue
 
-        # Execute start callbacks.
-        if not con_info["file_size"]:
-            # Fire start handlers.
-            _log.debug("In con, and starting new transfer =")
-            old_handlers = set()
-            for handler in client.handlers["start"]:
-                # Test start handler.
-                ret = handler(client, con, contract_id)
+        # Downstream bandwidth is limited by what we let them send.
+        increment = client.bandwidth.request(
+            "downstream",
+            contract_id,
+            wanted - stream.window
+        )
+        if not increment:
+            continue
 
-                # Handler was associated with this transfer.
-                if ret == -1:
-                    old_handlers.add(handler)
+        stream.window += increment
+        payload = WINDOW_PAYLOAD.pack(increment)
+        mux.queue_frame(contract_id, MUX_WINDOW, payload)
 
-            # Remove old start handlers.
-            for handler in old_handlers:
-                client.handlers["start"].remove(handler)
 
-        # Transfer data.
-        contract = client.contracts[contract_id]
-        if client.get_direction(contract_id) == u"send":
-            transfer_complete = do_upload(
-                client,
-                con,
-                contract,
-                con_info,
-                contract_id
-            )
-        else:
-            transfer_complete = do_download(
-                client,
-                con,
-                contract,
-                con_info,
-                contract_id
-            )
+def start_mux_upload(client, con, mux, contract_id, con_info):
+    contract = client.contracts[contract_id]
+    source = client.get_upload_source(contract_id, contract["data_id"])
+    if source is None:
+        _log.debug("Error: we don't have this file!")
+        reset_stream(client, con, contract_id)
+        return 0
+
+    con_info["file_size"] = source.size
+    con_info["remaining"] = source.size - contract.get(u"offset", 0)
+    fire_start_handlers(client, con, contract_id)
+    mux.queue_frame(contract_id, MUX_SIZE, SIZE_PAYLOAD.pack(source.size))
+    return 1
 
-        # Run any callbacks and schedule next transfer.
-        if transfer_complete == 1:
-            _log.debug("Transfer completed")
+
+def send_mux_frame(client, con, mux, contract_id):
+    """Returns: 1 if a frame was queued for the stream, otherwise 0."""
+    stream = mux.streams[contract_id]
+    if not stream.credit:
+        return 0
+    if client.contract_cons.get(contract_id) is not con:
+        return 0
+    if client.get_direction(contract_id) != u"send":
+        return 0
+
+    # Announce file size first.
+    con_info = client.con_info[con][contract_id]
+    if not con_info["file_size"]:
+        if not start_mux_upload(client, con, mux, contract_id, con_info):
+            return 1
+
+        # Resumed download was already complete.
+        if not con_info["remaining"]:
+            del mux.streams[contract_id]
             complete_transfer(client, contract_id, con)
+            return 1
+
+    # Request bandwidth for transfer.
+    ceiling = min(stream.credit, MUX_FRAME_SIZE, con_info["remaining"])
+    allocation = client.bandwidth.request(
+        "upstream",
+        contract_id,
+        ceiling
+    )
+    if not allocation:
+        return 0
+
+    # Frame next chunk.
+    contract = client.contracts[contract_id]
+    position = con_info["file_size"] - con_info["remaining"]
+    data_chunk = client.get_data_chunk(
+        contract["data_id"],
+        position,
+        allocation,
+        contract_id
+    )
+    if not data_chunk:
+        _log.debug("Error: shard is shorter than its file size!")
+        reset_stream(client, con, contract_id)
+        return 1
+
+    mux.queue_frame(contract_id, MUX_DATA, data_chunk)
+    stream.credit -= len(data_chunk)
+    con_info["remaining"] -= len(data_chunk)
+    client.bandwidth.update(
+        "upstream",
+        len(data_chunk),
+        contract_id
+    )
+
+    # Give other streams a turn.
+    mux.rotate(contract_id)
+
+    # Everything framed (flushed to the socket later.)
+    if not con_info["remaining"]:
+        del mux.streams[contract_id]
+        complete_transfer(client, contract_id, con)
+
+    return 1
+
+
+def fill_mux_send_buf(client, con, mux):
+    # Round robin a frame at a time between streams with credit.
+    progress = 1
+    while progress and len(mux.send_buf) < MUX_SEND_BUF:
+        progress = 0
+        for contract_id in list(mux.streams):
+            if send_mux_frame(client, con, mux, contract_id):
+                progress = 1
+                break
+
+
+def process_mux_con(client, con):
+    mux = client.con_mux[con]
+    if not client.is_queued(con) and not mux.send_buf:
+        return
+
+    try:
+        # Process received frames.
+        data = con.recv(MUX_READ_SIZE, encoding="ascii")
+        if len(data):
+            for frame in mux.feed(data):
+                if process_mux_frame(client, con, mux, *frame) == -1:
+                    raise FramingError("Invalid frame.")
+
+        # Ask for more data.
+        grant_mux_windows(client, con, mux)
+
+        # Send data.
+        fill_mux_send_buf(client, con, mux)
+        mux.flush(con)
+    except (FramingError, struct.error) as e:
+        _log.debug("Multiplexed con error: " + str(e))
+        con.close()
+
+
+def process_transfers(client):
+    # Process DHT messages.
+    process_dht_messages(client)
+
+    # Process and accept connections.
+    client.net.synchronize()
+
+    # Raise appropriate async callbacks for errors.
+    cleanup_cons(client)
+
+    # Expired handshakes and call any errbacks for errors.
+    expire_handshakes(client)
+
+    # Process connections.
+    for con in client.cons:
+        if not is_hung(con):
+            process_con(client, con)
 
     # Only reschedule the Looping call when this is done.
     d = defer.Deferred()
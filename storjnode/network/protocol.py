@@ -1,34 +1,16 @@
-import heapq
-import operator
 try:
     from Queue import Queue, Full  # py2
 except ImportError:
     from queue import Queue, Full  # py3
 from kademlia.protocol import KademliaProtocol
-from kademlia.routing import RoutingTable
-from kademlia.routing import TableTraverser
 from kademlia.node import Node
 import storjnode
+from storjnode.network.routing_index import IndexedRoutingTable
 
 
 _log = storjnode.log.getLogger(__name__)
 
 
-def _findNearest(self, node, k=None, exclude=None):
-    k = k or self.ksize
-    nodes = []
-    for neighbor in TableTraverser(self, node):
-        if exclude is None or not neighbor.sameHomeAs(exclude):
-            heapq.heappush(nodes, (node.distanceTo(neighbor), neighbor))
-        if len(nodes) == k:
-            break
-
-    return list(map(operator.itemgetter(1), heapq.nsmallest(k, nodes)))
-
-
-RoutingTable.findNeighbors = _findNearest  # XXX monkey patch find neighbors
-
-
 class Protocol(KademliaProtocol):
 
     def __init__(self, *args, **kwargs):
@@ -36,7 +18,14 @@ class Protocol(KademliaProtocol):
         self.max_hop_limit = kwargs.pop("max_hop_limit")
         self.messages_relay = Queue(maxsize=max_messages)
         self.messages_received = Queue(maxsize=max_messages)
+
+        # optional callables to wake up queue consumers
+        self.on_relay_queued = None
+        self.on_message_queued = None
+
         KademliaProtocol.__init__(self, *args, **kwargs)
+        self.router = IndexedRoutingTable(self, self.router.ksize,
+                                          self.router.node)
         self.log = storjnode.log.getLogger("kademlia.protocol")
         self.log.setLevel(60)
         self.noisy = False
@@ -50,6 +39,8 @@ class Protocol(KademliaProtocol):
     def queue_relay_message(self, entry):
         try:
             self.messages_relay.put_nowait(entry)
+            if self.on_relay_queued is not None:
+                self.on_relay_queued()
             return True
         except Full:
             msg = "Relay message queue full, dropping message for %s"
@@ -60,6 +51,8 @@ class Protocol(KademliaProtocol):
     def queue_received_message(self, message):
         try:
             self.messages_received.put_nowait(message)
+            if self.on_message_queued is not None:
+                self.on_message_queued()
             return True
         except Full:
             self.log.warning("Received message queue full, dropping message.")
@@ -68,7 +61,30 @@ class Protocol(KademliaProtocol):
     def rpc_relay_message(self, sender, sender_id, dest_id,
                           hop_limit, message):
         # FIXME self.welcomeIfNewNode(Node(sender_id, sender[0], sender[1]))
+        queued = self._accept_relay_message(sender, sender_id, dest_id,
+                                            hop_limit, message)
+        return (sender[0], sender[1]) if queued else None
+
+    def rpc_relay_messages(self, sender, sender_id, entries):
+        """Relay message batch, entries are [dest_id, hop_limit, message].
 
+        Returns: List of booleans, True for each accepted message.
+        """
+        if not isinstance(entries, list):
+            return None
+        results = []
+        for entry in entries:
+            if not isinstance(entry, list) or len(entry) != 3:
+                results.append(False)
+                continue
+            dest_id, hop_limit, message = entry
+            results.append(self._accept_relay_message(
+                sender, sender_id, dest_id, hop_limit, message
+            ))
+        return results
+
+    def _accept_relay_message(self, sender, sender_id, dest_id,
+                              hop_limit, message):
         logargs = (sender, storjnode.util.node_id_to_address(sender_id),
                    storjnode.util.node_id_to_address(dest_id), hop_limit)
         msg = "Got relay message from {1} at {0} for {2} with limit {3}."
@@ -76,27 +92,25 @@ class Protocol(KademliaProtocol):
 
         # message is for this node
         if dest_id == self.sourceNode.id:
-            queued = self.queue_received_message(message)
-            return (sender[0], sender[1]) if queued else None
+            return self.queue_received_message(message)
 
         # invalid hop limit
         if not (0 < hop_limit <= self.max_hop_limit):
             msg = "Dropping relay message, bad hop limit {0}."
             self.log.debug(msg.format(hop_limit))
-            return None
+            return False
 
         # do not relay away from dest
         sender_distance = Node(sender_id).distanceTo(Node(dest_id))
         our_distance = self.sourceNode.distanceTo(Node(dest_id))
         if our_distance >= sender_distance:
             self.log.debug("Dropping relay message, self not closer to dest.")
-            return None
+            return False
 
         # add to relay queue
-        queued = self.queue_relay_message({
+        return self.queue_relay_message({
             "dest": dest_id, "message": message, "hop_limit": hop_limit - 1
         })
-        return (sender[0], sender[1]) if queued else None
 
     def callRelayMessage(self, nodeToAsk, destid, hop_limit, message):
         address = (nodeToAsk.ip, nodeToAsk.port)
@@ -104,3 +118,18 @@ class Protocol(KademliaProtocol):
         d = self.relay_message(address, self.sourceNode.id, destid,
                                hop_limit, message)
         return d.addCallback(self.handleCallResponse, nodeToAsk)
+
+    def callRelayMessages(self, nodeToAsk, entries):
+        address = (nodeToAsk.ip, nodeToAsk.port)
+        txt = "Sending {0} relay messages to {1}:{2}"
+        self.log.debug(txt.format(len(entries), *address))
+        d = self.relay_messages(address, self.sourceNode.id, entries)
+
+        def handle(result):
+            # Peers without relay_messages don't respond either, leave it to
+            # the single message fallback to remove offline peers.
+            if result[0]:
+                return self.handleCallResponse(result, nodeToAsk)
+            return result
+
+        return d.addCallback(handle)
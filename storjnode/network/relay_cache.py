@@ -0,0 +1,133 @@
+"""
+Remember which neighbours relay messages and which don't respond.
+
+Without it every relay message looks up the peers nearest its destination
+and tries them one after the other, waiting QUERY_TIMEOUT for each dead
+peer on the way. With it
+
+* the neighbour that last relayed a message toward a destination prefix
+  is tried first for other messages to that prefix,
+* neighbours that didn't respond are skipped for FAILED_TTL seconds and
+* neighbours that didn't respond to a batch of relay messages (they may not
+  support batches) are sent single messages for UNBATCHED_TTL seconds.
+"""
+
+import time
+from threading import Lock
+from collections import OrderedDict
+
+
+HOP_PREFIX_SIZE = 2  # bytes of the destination id that share a next hop
+HOP_TTL = 60  # seconds a successful next hop is reused
+HOP_CACHE_SIZE = 1024  # destination prefixes remembered, lru first
+FAILED_TTL = 30  # seconds a neighbour is skipped after it didn't respond
+UNBATCHED_TTL = 600  # seconds a neighbour isn't sent batches
+
+
+def get_prefix(dest_id):
+    return dest_id[:HOP_PREFIX_SIZE]
+
+
+class RelayCache(object):
+
+    def __init__(self, hop_ttl=HOP_TTL, failed_ttl=FAILED_TTL,
+                 max_size=HOP_CACHE_SIZE, unbatched_ttl=UNBATCHED_TTL):
+        self.hop_ttl = hop_ttl
+        self.failed_ttl = failed_ttl
+        self.unbatched_ttl = unbatched_ttl
+        self.max_size = max_size
+        self.hops = OrderedDict()  # {prefix: (kademlia node, expires)}
+        self.failed = {}  # {node_id: expires}
+        self.unbatched = {}  # {node_id: expires}
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.mutex = Lock()
+
+    def get_hop(self, dest_id, now=None):
+        """Returns: Kademlia node that last relayed toward dest_id or None."""
+        if now is None:
+            now = time.time()
+        prefix = get_prefix(dest_id)
+        with self.mutex:
+            hop, expires = self.hops.pop(prefix, (None, None))
+            if hop is None or expires <= now or \
+                    self._is_failed(hop.id, now):
+                self.misses += 1
+                return None
+            self.hops[prefix] = (hop, expires)  # most recently used
+            self.hits += 1
+            return hop
+
+    def set_hop(self, dest_id, hop, now=None):
+        """Remember that hop successfully relayed a message for dest_id."""
+        if now is None:
+            now = time.time()
+        with self.mutex:
+            self.failed.pop(hop.id, None)  # it responded
+            prefix = get_prefix(dest_id)
+            self.hops.pop(prefix, None)
+            self.hops[prefix] = (hop, now + self.hop_ttl)
+            while len(self.hops) > self.max_size:
+                self.hops.popitem(last=False)
+
+    def forget_hop(self, dest_id, hop):
+        """Forget hop for dest_id, e.g. after it refused a message."""
+        prefix = get_prefix(dest_id)
+        with self.mutex:
+            cached = self.hops.get(prefix)
+            if cached is not None and cached[0].id == hop.id:
+                del self.hops[prefix]
+
+    def mark_failed(self, node, now=None):
+        """Skip node for failed_ttl seconds after it didn't respond."""
+        if now is None:
+            now = time.time()
+        with self.mutex:
+            for node_id, expires in list(self.failed.items()):
+                if expires <= now:
+                    del self.failed[node_id]
+            self.failed[node.id] = now + self.failed_ttl
+
+    def mark_unbatched(self, node, now=None):
+        """Send node single messages for unbatched_ttl seconds."""
+        if now is None:
+            now = time.time()
+        with self.mutex:
+            for node_id, expires in list(self.unbatched.items()):
+                if expires <= now:
+                    del self.unbatched[node_id]
+            self.unbatched[node.id] = now + self.unbatched_ttl
+
+    def is_unbatched(self, node, now=None):
+        """Returns: True if node recently didn't respond to a batch."""
+        if now is None:
+            now = time.time()
+        with self.mutex:
+            expires = self.unbatched.get(node.id)
+            return expires is not None and expires > now
+
+    def _is_failed(self, node_id, now):
+        # Called with mutex held.
+        expires = self.failed.get(node_id)
+        return expires is not None and expires > now
+
+    def filter_failed(self, nodes, now=None):
+        """Returns: nodes without the ones that recently didn't respond."""
+        if now is None:
+            now = time.time()
+        with self.mutex:
+            result = [n for n in nodes if not self._is_failed(n.id, now)]
+            self.skipped += len(nodes) - len(result)
+            return result
+
+    def info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "hops": len(self.hops),
+            "failed": len(self.failed),
+            "unbatched": len(self.unbatched),
+            "max_size": self.max_size
+        }
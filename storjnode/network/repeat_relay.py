@@ -1,72 +1,149 @@
+"""
+Rebroadcast relay messages until they are acknowledged or expire.
+
+Relay messages may be dropped on the way, so they are sent again with
+exponential backoff (after 1, 3, 7, 15, 31 and 63 seconds) until
+RELAY_EXPIRY. Callers should cancel the rebroadcast with the ID returned
+by relay() as soon as the reply arrives.
+"""
+
 import time
-from threading import Thread
-import logging
+import heapq
+import itertools
+from threading import Thread, Condition
 import storjnode
+from crochet import run_in_reactor
+from twisted.internet import reactor
 
 _log = storjnode.log.getLogger(__name__)
 
 
+RELAY_EXPIRY = 120  # seconds after which messages aren't sent again
+BACKOFF_START = 1  # seconds until the first rebroadcast
+BACKOFF_FACTOR = 2
+
+
+def cancel_relay(api, relay_id):
+    """Cancel a rebroadcast, if api (node or pyp2p DHT) supports it."""
+    cancel = getattr(api, "cancel_repeat_relay", None)
+    if relay_id is not None and cancel is not None:
+        cancel(relay_id)
+
+
 class RepeatRelay:
-    def __init__(self, node):
+    def __init__(self, node, threadless=False):
         self.node = node
-        self.relaying = []
-        self.thread_running = True
-        self.t = Thread(target=self.rebroadcast_loop)
-        self.t.start()
+        self.relaying = {}  # {relay_id: relay_info}
+        self.schedule = []  # heap of (due, relay_id)
+        self.ids = itertools.count()
+        self.cond = Condition()
+        self.threadless = threadless
+        self.running = True
+        if self.threadless:
+            self.timer = None
+        else:
+            self.t = Thread(target=self.rebroadcast_loop)
+            self.t.start()
 
     def stop(self):
-        self.thread_running = False
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.threadless:
+            self.reschedule()
+
+    def get_next_due(self):
+        with self.cond:
+            if not self.schedule:
+                return None
+            return self.schedule[0][0]
+
+    @run_in_reactor
+    def reschedule(self):
+        # Set the timer to the next rebroadcast.
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+
+        due = self.get_next_due()
+        if due is None or not self.running:
+            return
+
+        def on_timer():
+            self.timer = None
+            self.rebroadcast()
+            self.reschedule()
+
+        self.timer = reactor.callLater(max(0, due - time.time()), on_timer)
 
     def rebroadcast_loop(self):
-        while self.thread_running:
+        while True:
+            with self.cond:
+                if not self.running:
+                    return
+                due = self.get_next_due()
+                if due is None:
+                    self.cond.wait()
+                elif due > time.time():
+                    self.cond.wait(due - time.time())
+
             self.rebroadcast()
-            time.sleep(1)
-
-    def rebroadcast(self):
-        # Rebroadcast after these thresholds.
-        intervals = [
-            120, 60, 30, 25, 20,
-            15, 10, 5, 3, 1
-        ]
-
-        # Process messages.
-        expired = []
-        for relay_info in self.relaying:
-            elapsed = time.time() - relay_info["timestamp"]
-            for interval in intervals:
-                if elapsed >= interval:
-                    # Already broadcast.
-                    if relay_info["interval"] == interval:
-                        break
-
-                    # Broadcast.
-                    # _log.debug(str(relay_info))
-                    self.node.relay_message(
-                        relay_info["node_id"],
-                        relay_info["msg"]
-                    )
-                    relay_info["interval"] = interval
-
-                    # Expire.
-                    if interval == 120:
-                        expired.append(relay_info)
-
-                    break
-
-        for relay_info in expired:
-            self.relaying.remove(relay_info)
+
+    def rebroadcast(self, now=None):
+        now = now or time.time()
+
+        # Pop due messages and schedule their next rebroadcast.
+        due = []
+        with self.cond:
+            while self.schedule and self.schedule[0][0] <= now:
+                _, relay_id = heapq.heappop(self.schedule)
+                relay_info = self.relaying.get(relay_id)
+                if relay_info is None:
+                    continue  # cancelled
+
+                due.append(relay_info)
+                relay_info["attempts"] += 1
+                relay_info["delay"] *= BACKOFF_FACTOR
+                next_due = now + relay_info["delay"]
+                if next_due - relay_info["timestamp"] > RELAY_EXPIRY:
+                    del self.relaying[relay_id]  # expired
+                else:
+                    heapq.heappush(self.schedule, (next_due, relay_id))
+
+        # Broadcast.
+        for relay_info in due:
+            self.node.relay_message(relay_info["node_id"], relay_info["msg"])
 
     def relay(self, node_id, msg):
+        """Relay a message and keep rebroadcasting it.
+
+        Returns: ID to cancel the rebroadcast with.
+        """
+        relay_id = next(self.ids)
+        now = time.time()
         relay_info = {
             "msg": msg,
             "node_id": node_id,
-            "timestamp": time.time(),
-            "interval": 0
+            "timestamp": now,
+            "delay": BACKOFF_START,
+            "attempts": 0
         }
 
-        # _log.debug(str(relay_info))
+        with self.cond:
+            self.relaying[relay_id] = relay_info
+            heapq.heappush(self.schedule, (now + BACKOFF_START, relay_id))
+            self.cond.notify()
+        if self.threadless:
+            self.reschedule()
 
-        self.relaying.append(relay_info)
         self.node.relay_message(node_id, msg)
 
-        return None
+        return relay_id
+
+    def cancel(self, relay_id):
+        """Stop rebroadcasting a message, e.g. after a reply arrived.
+
+        Returns: True if the message was still being rebroadcast.
+        """
+        with self.cond:
+            return self.relaying.pop(relay_id, None) is not None
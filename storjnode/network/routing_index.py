@@ -0,0 +1,117 @@
+"""
+Exact k nearest lookups on the routing table.
+
+kademlia's findNeighbors walks the buckets from the target outward and
+stops after k nodes, comparing distances one Node pair at a time. The
+RoutingIndex keeps the ids of all contacts as integers in sorted order
+instead. Ids sharing the first p bits with the target are a contiguous
+slice of that list and all of them are nearer than any id outside it, so a
+query only has to XOR the smallest such slice holding k ids.
+"""
+
+import heapq
+import bisect
+from kademlia.routing import RoutingTable
+
+
+ID_BITS = 160
+
+
+class RoutingIndex(object):
+
+    def __init__(self):
+        self.ids = []  # sorted long ids
+        self.nodes = {}  # {long id: kademlia node}
+
+    def add(self, node):
+        if node.long_id not in self.nodes:
+            bisect.insort(self.ids, node.long_id)
+        self.nodes[node.long_id] = node  # may have a new address
+
+    def remove(self, node):
+        if self.nodes.pop(node.long_id, None) is not None:
+            del self.ids[bisect.bisect_left(self.ids, node.long_id)]
+
+    def clear(self):
+        self.ids = []
+        self.nodes = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, node):
+        return node.long_id in self.nodes
+
+    def _prefix_range(self, target, prefix_bits):
+        # Returns: Slice of ids sharing the first prefix_bits with target.
+        shift = ID_BITS - prefix_bits
+        lower = (target >> shift) << shift
+        upper = lower + (1 << shift)
+        return (bisect.bisect_left(self.ids, lower),
+                bisect.bisect_left(self.ids, upper))
+
+    def _candidates(self, target, count):
+        # Returns: Smallest prefix slice with at least count ids.
+        if count >= len(self.ids):
+            return 0, len(self.ids)
+        lower, upper = 0, ID_BITS  # prefix lengths, lower always has count
+        while lower < upper:
+            middle = (lower + upper + 1) // 2
+            start, stop = self._prefix_range(target, middle)
+            if stop - start >= count:
+                lower = middle
+            else:
+                upper = middle - 1
+        return self._prefix_range(target, lower)
+
+    def nearest(self, target, k, exclude=None):
+        """Get the k nodes nearest to target.
+
+        Args:
+            target: Long id to find nodes near.
+            k: Max number of nodes returned.
+            exclude: Optional callable, nodes it returns True for are skipped.
+
+        Returns:
+            List of kademlia nodes, nearest first.
+        """
+        count = k
+        while True:
+            start, stop = self._candidates(target, count)
+            ids = heapq.nsmallest(count, self.ids[start:stop],
+                                  key=lambda i: i ^ target)
+            nodes = [self.nodes[i] for i in ids]
+            if exclude is not None:
+                nodes = [n for n in nodes if not exclude(n)]
+            if len(nodes) >= k or count >= len(self.ids):
+                return nodes[:k]
+            count += k  # excluded nodes, widen the search
+
+
+class IndexedRoutingTable(RoutingTable):
+    """kademlia RoutingTable answering findNeighbors with a RoutingIndex."""
+
+    def flush(self):
+        RoutingTable.flush(self)
+        self.index = RoutingIndex()
+
+    def addContact(self, node):
+        RoutingTable.addContact(self, node)
+        added = self.buckets[self.getBucketFor(node)][node.id]
+        if added is not None:  # not only a replacement node
+            self.index.add(added)
+
+    def removeContact(self, node):
+        bucket = self.buckets[self.getBucketFor(node)]
+        RoutingTable.removeContact(self, node)
+        self.index.remove(node)
+        for replacement in bucket.getNodes():
+            self.index.add(replacement)
+
+    def findNeighbors(self, node, k=None, exclude=None):
+        k = k or self.ksize
+        self.buckets[self.getBucketFor(node)].touchLastUpdated()
+        if exclude is None:
+            return self.index.nearest(node.long_id, k)
+        return self.index.nearest(node.long_id, k,
+                                  exclude=lambda n: n.sameHomeAs(exclude))
@@ -5,13 +5,16 @@ import datetime
 import threading
 import btctxstore
 import storjnode
+from collections import OrderedDict
 from storjnode.util import safe_log_var
-from storjnode.common import THREAD_SLEEP
+from storjnode.common import THREAD_SLEEP, MAX_PACKAGE_DATA
 from kademlia.network import Server as KademliaServer
 from kademlia.storage import ForgetfulStorage
 from kademlia.node import Node as KademliaNode
 from kademlia.routing import TableTraverser
 from storjnode.network.protocol import Protocol
+from storjnode.network.wakeup import Wakeup
+from storjnode.network.relay_cache import RelayCache
 from twisted.internet import defer
 from twisted.internet.task import LoopingCall
 from crochet import run_in_reactor
@@ -25,68 +28,181 @@ else:
 WALK_TIMEOUT = QUERY_TIMEOUT * 24.0
 
 
+# Relay queued messages for the same next hop with one RPC.
+ENABLE_RELAY_BATCHING = 1
+RPC_HEADER_SIZE = 21  # rpcudp datagram type and message id
+
+
 _log = storjnode.log.getLogger(__name__)
 
 
 class MessageRelayer(object):
 
-    def __init__(self, server, dest, hop_limit, message):
+    def __init__(self, server, dest, hop_limit, message, exclude=None):
         self.server = server
         self.node = self.server.node
+        self.cache = self.server.relay_cache
         self.dest = KademliaNode(dest)
         self.hop_limit = hop_limit
         self.message = message
-        self.nearest = None
+        self.nearest = []
+        self.looked_up = False
+        self.relay_node = None
+        self.tried = set(exclude or [])  # node ids
 
     @run_in_reactor
     def start(self):
-        self.nearest = self.server.protocol.router.findNeighbors(
-            self.dest, exclude=self.server.node
-        )
-        txt = "{1}: Relaying to nearest peers: {0}"
-        _log.debug(txt.format(repr(self.nearest), self.server.get_address()))
-        self.nearest.reverse()  # reverse so you can pop the next
+        self.relay()
+
+    def relay(self):
+        # Called in the reactor thread, try the peer that last relayed
+        # toward dest first.
+        hop = self.cache.get_hop(self.dest.id)
+        if hop is not None and hop.id not in self.tried and \
+                self.dest.distanceTo(hop) < self.dest.distanceTo(self.node):
+            txt = "{1}: Relaying to cached next hop: {0}"
+            _log.debug(txt.format(repr(hop), self.server.get_address()))
+            self.nearest = [hop]
         self.attempt_relay([True, None])
 
     def __call__(self, result):
         self.attempt_relay(result)
 
+    def get_next_hop(self):
+        if not self.nearest and not self.looked_up:
+            self.looked_up = True
+            nearest = self.server.protocol.router.findNeighbors(
+                self.dest, exclude=self.server.node
+            )
+            nearest = [n for n in nearest if n.id not in self.tried]
+            self.nearest = self.cache.filter_failed(nearest)
+            txt = "{1}: Relaying to nearest peers: {0}"
+            _log.debug(txt.format(repr(self.nearest),
+                                  self.server.get_address()))
+            self.nearest.reverse()  # reverse so you can pop the next
+        if not self.nearest:
+            return None
+        return self.nearest.pop()
+
+    def update_cache(self, result, success):
+        if self.relay_node is None:
+            return
+        if success:
+            self.cache.set_hop(self.dest.id, self.relay_node)
+        elif not result[0]:  # no response
+            self.cache.mark_failed(self.relay_node)
+            self.cache.forget_hop(self.dest.id, self.relay_node)
+        else:  # refused
+            self.cache.forget_hop(self.dest.id, self.relay_node)
+
     def attempt_relay(self, result):
         success = bool(result[0] and result[1])
         dest_address = storjnode.util.node_id_to_address(self.dest.id)
+        self.update_cache(result, success)
 
         if success:
             txt = "{1}: Successfully relayed message for {0}"
             _log.debug(txt.format(dest_address, self.server.get_address()))
             return  # relay only to nearest peer, avoid amplification attacks!
 
-        elif not self.nearest:
+        relay_node = self.get_next_hop()
+        if relay_node is None:
             txt = "{1}: Failed to relay message for {0}"
             _log.debug(txt.format(dest_address, self.server.get_address()))
             return
 
-        relay_node = self.nearest.pop()
         address = storjnode.util.node_id_to_address(relay_node.id)
 
         # do not relay away from node
         if self.dest.distanceTo(self.node) <= self.dest.distanceTo(relay_node):
             txt = "{1}: Aborting relay attempt, {0} farther then self."
-            _log.debug(txt.format(address, self.get_address()))
+            _log.debug(txt.format(address, self.server.get_address()))
             return
 
         # attempt to relay message
         txt = "{1}: Attempting to relay message for {0}"
         _log.debug(txt.format(address, self.server.get_address()))
+        self.relay_node = relay_node
+        self.tried.add(relay_node.id)
         self.server.protocol.callRelayMessage(
             relay_node, self.dest.id, self.hop_limit, self.message
         ).addCallback(self)
 
 
+def get_batch_size(sender_id, items):
+    """Returns: Datagram size of a relay_messages RPC for items."""
+    data = umsgpack.packb([u"relay_messages", [sender_id, items]])
+    return RPC_HEADER_SIZE + len(data)
+
+
+def split_batches(sender_id, entries, max_size=MAX_PACKAGE_DATA):
+    """Split relay queue entries into batches that fit a datagram."""
+    batches = []
+    batch = []
+    items = []
+    for entry in entries:
+        item = [entry["dest"], entry["hop_limit"], entry["message"]]
+        if batch and get_batch_size(sender_id, items + [item]) > max_size:
+            batches.append(batch)
+            batch = []
+            items = []
+        batch.append(entry)
+        items.append(item)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class BatchRelayer(object):
+    """Relay several messages to the same next hop with one RPC.
+
+    Messages the hop refused are relayed again on their own through other
+    peers. If the hop doesn't respond (it may be offline or not support
+    batches) all messages are relayed on their own, and the hop is sent
+    single messages until the relay cache forgets it. If the hop did relay
+    them and only the response was lost, the destination drops the
+    duplicates (see storjnode.network.dedup).
+    """
+
+    def __init__(self, server, hop, entries):
+        self.server = server
+        self.cache = self.server.relay_cache
+        self.hop = hop
+        self.entries = entries
+
+    def start(self):
+        items = [[e["dest"], e["hop_limit"], e["message"]]
+                 for e in self.entries]
+        txt = "{1}: Relaying {0} messages to {2}"
+        _log.debug(txt.format(len(items), self.server.get_address(),
+                              repr(self.hop)))
+        self.server.protocol.callRelayMessages(
+            self.hop, items
+        ).addCallback(self)
+
+    def __call__(self, result):
+        responded, relayed = result
+        if not responded or not isinstance(relayed, list) or \
+                len(relayed) != len(self.entries):
+            self.cache.mark_unbatched(self.hop)
+            for entry in self.entries:
+                MessageRelayer(self.server, **entry).relay()
+            return
+
+        for entry, success in zip(self.entries, relayed):
+            if success:
+                self.cache.set_hop(entry["dest"], self.hop)
+            else:
+                self.cache.forget_hop(entry["dest"], self.hop)
+                MessageRelayer(self.server, exclude=[self.hop.id],
+                               **entry).relay()
+
+
 class Server(KademliaServer):
 
     def __init__(self, key, port, ksize=20, alpha=3, storage=None,
                  max_messages=1024, default_hop_limit=64,
-                 refresh_neighbours_interval=WALK_TIMEOUT):
+                 refresh_neighbours_interval=WALK_TIMEOUT, threadless=False):
         """
         Create a server instance.  This will start listening on the given port.
 
@@ -96,11 +212,15 @@ class Server(KademliaServer):
             alpha (int): The alpha parameter from the kademlia paper
             storage: implements :interface:`~kademlia.storage.IStorage`
             refresh_neighbours_interval (float): Auto refresh neighbours.
+            threadless (bool): Drive relaying and refreshing neighbours from
+                               the reactor instead of polling threads.
         """
         self.port = port
         self._default_hop_limit = default_hop_limit
         self._refresh_neighbours_interval = refresh_neighbours_interval
+        self._threadless = threadless
         self._cached_address = None
+        self.relay_cache = RelayCache()
 
         self.port_handler = None
 
@@ -125,7 +245,34 @@ class Server(KademliaServer):
         )
         self.refreshLoop = LoopingCall(self.refreshTable).start(3600)
 
-        self._start_threads()
+        if self._threadless:
+            self._start_reactor_driven()
+        else:
+            self._start_threads()
+
+    def _start_reactor_driven(self):
+
+        # relay messages as soon as they are queued
+        self._relay_wakeup = Wakeup(self._process_relay_queue)
+        self.protocol.on_relay_queued = self._relay_wakeup.notify
+        self._relay_wakeup.notify()  # anything queued before the hook
+
+        # refresh neighbours on a timer
+        self._refresh_loop_call = None
+        if self._refresh_neighbours_interval > 0.0:
+            self._start_refresh_loop_call()
+
+    @run_in_reactor
+    def _start_refresh_loop_call(self):
+        self._refresh_loop_call = LoopingCall(self.refresh_neighbours)
+        self._refresh_loop_call.start(self._refresh_neighbours_interval,
+                                      now=False)
+
+    @run_in_reactor
+    def _stop_refresh_loop_call(self):
+        loop = self._refresh_loop_call
+        if loop is not None and loop.running:
+            loop.stop()
 
     def _start_threads(self):
 
@@ -144,6 +291,18 @@ class Server(KademliaServer):
         self.port_handler = port_handler
 
     def stop(self):
+        if self._threadless:
+            self.protocol.on_relay_queued = None
+            self._relay_wakeup.stop()
+            self._stop_refresh_loop_call()
+        else:
+            self._stop_threads()
+
+        # disconnect from port and stop properly
+        if self.port_handler is not None:
+            self.port_handler.stopListening()
+
+    def _stop_threads(self):
         if self._refresh_neighbours_interval > 0.0:
             self._refresh_thread_stop = True
             self._refresh_thread.join()
@@ -151,10 +310,6 @@ class Server(KademliaServer):
         self._relay_thread_stop = True
         self._relay_thread.join()
 
-        # disconnect from port and stop properly
-        if self.port_handler is not None:
-            self.port_handler.stopListening()
-
     @run_in_reactor
     def refresh_neighbours(self):
         _log.debug("Refreshing neighbours ...")
@@ -235,12 +390,53 @@ class Server(KademliaServer):
                 last_refresh = datetime.datetime.now()
             time.sleep(THREAD_SLEEP)
 
+    def _process_relay_queue(self):
+        q = self.protocol.messages_relay
+        entries = storjnode.util.empty_queue(q)
+        if ENABLE_RELAY_BATCHING and len(entries) > 1:
+            self._relay_batched(entries)
+            return
+        for entry in entries:
+            message_relayer = MessageRelayer(self, **entry)
+            message_relayer.start()
+
+    def get_next_hop(self, dest_id):
+        """Returns: Peer to relay a message for dest_id to or None."""
+        dest = KademliaNode(dest_id)
+        hop = self.relay_cache.get_hop(dest_id)
+        if hop is None:
+            nearest = self.protocol.router.findNeighbors(dest,
+                                                         exclude=self.node)
+            nearest = self.relay_cache.filter_failed(nearest)
+            hop = nearest[0] if nearest else None
+        if hop is None or dest.distanceTo(hop) >= dest.distanceTo(self.node):
+            return None  # do not relay away from node
+        return hop
+
+    @run_in_reactor
+    def _relay_batched(self, entries):
+        hops = OrderedDict()  # {hop id: (hop, entries)}
+        for entry in entries:
+            hop = self.get_next_hop(entry["dest"])
+            if hop is None:
+                MessageRelayer(self, **entry).relay()  # logs the failure
+                continue
+            hops.setdefault(hop.id, (hop, []))[1].append(entry)
+
+        for hop, hop_entries in hops.values():
+            if self.relay_cache.is_unbatched(hop):
+                for entry in hop_entries:
+                    MessageRelayer(self, **entry).relay()
+                continue
+            for batch in split_batches(self.node.id, hop_entries):
+                if len(batch) == 1:
+                    MessageRelayer(self, **batch[0]).relay()
+                else:
+                    BatchRelayer(self, hop, batch).start()
+
     def _relay_loop(self):
         while not self._relay_thread_stop:
-            q = self.protocol.messages_relay
-            for entry in storjnode.util.empty_queue(q):
-                message_relayer = MessageRelayer(self, **entry)
-                message_relayer.start()
+            self._process_relay_queue()
             time.sleep(THREAD_SLEEP)
 
     def get_transport_info(self, unl=None):
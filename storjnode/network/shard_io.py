@@ -0,0 +1,134 @@
+"""
+File objects used to read and write shards while they are transferred.
+"""
+
+import os
+import hashlib
+from threading import Lock
+from collections import OrderedDict
+from storjnode.storage.shard import BUFFER_SIZE
+
+
+MAX_OPEN_UPLOADS = 64  # max file descriptors kept open for uploads
+
+
+class DownloadSink(object):
+    """Append only shard download that is hashed while it is written.
+
+    The file stays open for the whole transfer and the sha256 of everything
+    written so far is kept up to date, so the completed download can be
+    verified without reading it back from disc.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hasher = hashlib.sha256()
+        self.size = 0
+
+        # hash any data already in the file
+        with open(path, "rb") as fobj:
+            while True:
+                chunk = fobj.read(BUFFER_SIZE)
+                if not chunk:
+                    break
+                self.hasher.update(chunk)
+                self.size += len(chunk)
+
+        self.fobj = open(path, "ab")
+
+    def write(self, chunk):
+        self.fobj.write(chunk)
+        self.hasher.update(chunk)
+        self.size += len(chunk)
+
+    def hexdigest(self):
+        """Returns: The sha256 hex digest of all data written."""
+        return self.hasher.hexdigest()
+
+    def close(self):
+        if not self.fobj.closed:
+            self.fobj.close()
+
+
+class UploadSource(object):
+    """Shard being uploaded that is read at arbitrary positions.
+
+    The file is opened on the first read and kept open until closed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.fobj = None
+
+    def fileno(self):
+        if self.fobj is None:
+            self.fobj = open(self.path, "rb")
+        return self.fobj.fileno()
+
+    def read(self, position, size):
+        fd = self.fileno()
+        if hasattr(os, "pread"):  # py3.3+ unix
+            return os.pread(fd, size, position)
+        self.fobj.seek(position, 0)
+        return self.fobj.read(size)
+
+    def close(self):
+        if self.fobj is not None:
+            self.fobj.close()
+            self.fobj = None
+
+
+class UploadSourceCache(object):
+    """Upload sources of active transfers.
+
+    The sources with the least recently used file descriptors are closed
+    once more than max_open are open, they are reopened when read again.
+    """
+
+    def __init__(self, max_open=MAX_OPEN_UPLOADS):
+        self.max_open = max_open
+        self.sources = {}  # {key: UploadSource}
+        self.open_sources = OrderedDict()  # {key: UploadSource} lru first
+        self.mutex = Lock()
+
+    def add(self, key, path):
+        with self.mutex:
+            if key not in self.sources:
+                self.sources[key] = UploadSource(path)
+            return self.sources[key]
+
+    def get(self, key):
+        return self.sources.get(key)
+
+    def _touch(self, key):
+        # expects caller to have mutex
+        source = self.sources[key]
+        self.open_sources.pop(key, None)
+        self.open_sources[key] = source
+        while len(self.open_sources) > self.max_open:
+            lru_key, lru_source = self.open_sources.popitem(last=False)
+            lru_source.close()
+        return source
+
+    def read(self, key, position, size):
+        with self.mutex:
+            return self._touch(key).read(position, size)
+
+    def fileno(self, key):
+        """Returns: The open file descriptor of a source."""
+        with self.mutex:
+            return self._touch(key).fileno()
+
+    def remove(self, key):
+        with self.mutex:
+            source = self.sources.pop(key, None)
+            self.open_sources.pop(key, None)
+            if source is not None:
+                source.close()
+
+    def __contains__(self, key):
+        return key in self.sources
+
+    def __len__(self):
+        return len(self.sources)
@@ -0,0 +1,242 @@
+"""
+Readiness driven scheduling of file transfers.
+
+Instead of polling every connection every few milliseconds, the sockets of
+active transfers are registered with the twisted reactor and only serviced
+when they are readable (receiving a contract ID, file size or data) or
+writable (uploading). Everything that is not tied to a socket (handshake
+messages, accepting connections, expiring handshakes and dead connections)
+runs on a much slower housekeeping timer.
+"""
+
+import storjnode
+from zope.interface import implementer
+from twisted.internet.interfaces import IReadWriteDescriptor
+from twisted.internet.task import LoopingCall
+from storjnode.network.process_transfers import process_dht_messages
+from storjnode.network.process_transfers import cleanup_cons
+from storjnode.network.process_transfers import expire_handshakes
+from storjnode.network.process_transfers import is_hung
+from storjnode.network.process_transfers import process_con
+from storjnode.network.multiplex import get_wanted_window
+
+
+HOUSEKEEPING_INTERVAL = 0.05  # seconds
+THROTTLE_DELAY = 0.01  # seconds to wait after a ready con made no progress
+
+
+_log = storjnode.log.getLogger(__name__)
+
+
+def get_interest(client, con):
+    """Get what a connection is waiting for.
+
+    Returns: (read, write) flags.
+    """
+    if not con.connected:
+        return 0, 0
+
+    mux = client.con_mux.get(con)
+    if mux is not None:
+        return get_mux_interest(client, con, mux)
+
+    if not client.is_queued(con):
+        return 0, 0
+
+    # Waiting for contract ID.
+    contract_id = client.con_transfer.get(con, u"")
+    if len(contract_id) < 64:
+        return 1, 0
+
+    # Reached end of transfer queue.
+    if contract_id == u"0" * 64:
+        return 0, 0
+
+    # Invalid contract, let process_con close it.
+    if contract_id not in client.contracts:
+        return 1, 1
+
+    con_info = client.con_info[con].get(contract_id)
+    if con_info is None or not con_info["remaining"]:
+        return 0, 0
+
+    if client.get_direction(contract_id) == u"send":
+        return 0, 1
+    return 1, 0
+
+
+def get_mux_interest(client, con, mux):
+    # Unsent frames.
+    write = int(bool(mux.send_buf))
+    if not client.is_queued(con):
+        return 0, write
+
+    # Streams that can send data or should ask for more.
+    for contract_id, stream in mux.streams.items():
+        if write:
+            break
+        if client.contract_cons.get(contract_id) is not con:
+            continue
+        if client.get_direction(contract_id) == u"send":
+            write = int(stream.credit > 0)
+        else:
+            con_info = client.con_info[con][contract_id]
+            write = int(stream.window * 2 <= get_wanted_window(con_info))
+
+    return 1, write
+
+
+def get_progress(client, con):
+    """Returns: Snapshot of a connections transfer state."""
+    mux = client.con_mux.get(con)
+    if mux is not None:
+        return mux.bytes_recv, mux.bytes_sent, len(mux.send_buf)
+
+    contract_id = client.con_transfer.get(con)
+    con_info = client.con_info.get(con, {}).get(contract_id, {})
+    return (
+        contract_id,
+        con_info.get("remaining"),
+        con_info.get("file_size"),
+        len(con_info.get("file_size_buf", b""))
+    )
+
+
+@implementer(IReadWriteDescriptor)
+class ConnectionWatcher(object):
+
+    def __init__(self, engine, con):
+        self.engine = engine
+        self.con = con
+        self.reading = 0
+        self.writing = 0
+        self.paused = 0
+
+    def set_interest(self, read, write):
+        reactor = self.engine.reactor
+        if read and not self.reading:
+            reactor.addReader(self)
+        elif not read and self.reading:
+            reactor.removeReader(self)
+        if write and not self.writing:
+            reactor.addWriter(self)
+        elif not write and self.writing:
+            reactor.removeWriter(self)
+        self.reading, self.writing = read, write
+
+    def fileno(self):
+        if self.con.s is None:
+            return -1
+        try:
+            return self.con.s.fileno()
+        except Exception:
+            return -1
+
+    def doRead(self):
+        self.engine.service(self.con)
+
+    def doWrite(self):
+        self.engine.service(self.con)
+
+    def connectionLost(self, reason):
+        # reactor already removed the descriptor
+        self.reading, self.writing = 0, 0
+        self.engine.unwatch(self.con)
+
+    def logPrefix(self):
+        return "TransferConnection"
+
+
+class TransferEngine(object):
+    """Drive a FileTransfer client from reactor events.
+
+    Must be started and stopped from the reactor thread.
+    """
+
+    def __init__(self, client, interval=HOUSEKEEPING_INTERVAL, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.client = client
+        self.interval = interval
+        self.reactor = reactor
+        self.watchers = {}  # {con: ConnectionWatcher}
+        self.loop = None
+
+    def start(self):
+        self.loop = LoopingCall(self.housekeeping)
+        self.loop.clock = self.reactor
+        return self.loop.start(self.interval, now=True)
+
+    def stop(self):
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        for con in list(self.watchers):
+            self.unwatch(con)
+
+    def housekeeping(self):
+        client = self.client
+
+        # Process DHT messages.
+        process_dht_messages(client)
+
+        # Process and accept connections.
+        client.net.synchronize()
+
+        # Raise appropriate async callbacks for errors.
+        cleanup_cons(client)
+
+        # Expired handshakes and call any errbacks for errors.
+        expire_handshakes(client)
+
+        # Watch new connections.
+        for con in list(client.cons):
+            if con not in self.watchers and con.connected:
+                self.watchers[con] = ConnectionWatcher(self, con)
+
+        # Drop dead connections and update what the rest wait for.
+        for con in list(self.watchers):
+            if con not in client.cons or is_hung(con) or not con.connected:
+                self.unwatch(con)
+            else:
+                self.update_interest(con)
+
+    def update_interest(self, con):
+        watcher = self.watchers.get(con)
+        if watcher is None or watcher.paused:
+            return
+        read, write = get_interest(self.client, con)
+        watcher.set_interest(read, write)
+
+    def service(self, con):
+        before = get_progress(self.client, con)
+        try:
+            process_con(self.client, con)
+        except Exception as e:
+            txt = "An unknown error occured in process_con: %s"
+            _log.error(txt % repr(e))
+            con.close()
+
+        if con not in self.watchers:
+            return
+        if not con.connected:
+            self.unwatch(con)
+        elif get_progress(self.client, con) == before:
+            self.pause(con)  # bandwidth limited or spurious wake up
+        else:
+            self.update_interest(con)
+
+    def pause(self, con):
+        watcher = self.watchers[con]
+        watcher.set_interest(0, 0)
+        watcher.paused = 1
+
+        def resume():
+            watcher.paused = 0
+            self.update_interest(con)
+
+        self.reactor.callLater(THROTTLE_DELAY, resume)
+
+    def unwatch(self, con):
+        watcher = self.watchers.pop(con, None)
+        if watcher is not None:
+            watcher.set_interest(0, 0)
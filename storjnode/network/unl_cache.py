@@ -0,0 +1,106 @@
+"""
+Cache the UNLs of other nodes.
+
+Looking up a UNL relays a signed request to the node and waits for its
+response, back to back transfers with the same node would pay this round
+trip every time. UNLs are kept for UNL_TTL seconds and concurrent lookups
+for the same node share one request.
+"""
+
+import time
+from threading import Lock
+from collections import OrderedDict
+from twisted.internet import defer
+from twisted.python.failure import Failure
+from storjnode.network.repeat_relay import RELAY_EXPIRY
+
+
+UNL_TTL = 300  # seconds a UNL is reused
+UNL_CACHE_SIZE = 1024  # UNLs remembered, lru first
+UNL_LOOKUP_TIMEOUT = RELAY_EXPIRY  # seconds until a lookup is started again
+
+
+class UnlCache(object):
+
+    def __init__(self, ttl=UNL_TTL, max_size=UNL_CACHE_SIZE,
+                 lookup_timeout=UNL_LOOKUP_TIMEOUT):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lookup_timeout = lookup_timeout
+        self.unls = OrderedDict()  # {node_id: (unl, expires)} lru first
+        self.lookups = {}  # {node_id: (started, [deferred, ...])}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.mutex = Lock()
+
+    def get(self, node_id, lookup, now=None):
+        """Get the UNL of a node, calling lookup() if it isn't cached.
+
+        Args:
+            node_id: Binary node id.
+            lookup: Callable returning a Deferred that resolves to the UNL
+                    or None. Not called while a lookup for the same node is
+                    still outstanding, its result is shared instead.
+
+        Returns:
+            A twisted.internet.defer.Deferred that resolves to the UNL.
+        """
+        if now is None:
+            now = time.time()
+        with self.mutex:
+            cached = self.unls.pop(node_id, None)
+            if cached is not None and cached[1] > now:
+                self.unls[node_id] = cached  # most recently used
+                self.hits += 1
+                return defer.succeed(cached[0])
+
+            d = defer.Deferred()
+            pending = self.lookups.get(node_id)
+            if pending is not None and \
+                    pending[0] + self.lookup_timeout > now:
+                pending[1].append(d)
+                self.coalesced += 1
+                return d
+
+            self.misses += 1
+            waiters = [d]
+            self.lookups[node_id] = (now, waiters)
+
+        lookup().addBoth(self._resolved, node_id, waiters)
+        return d
+
+    def _resolved(self, result, node_id, waiters):
+        with self.mutex:
+            pending = self.lookups.get(node_id)
+            if pending is not None and pending[1] is waiters:
+                del self.lookups[node_id]
+            if result is not None and not isinstance(result, Failure):
+                self._set(node_id, result)
+
+        for d in waiters:
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+    def _set(self, node_id, unl):
+        # Called with mutex held.
+        self.unls.pop(node_id, None)
+        self.unls[node_id] = (unl, time.time() + self.ttl)
+        while len(self.unls) > self.max_size:
+            self.unls.popitem(last=False)
+
+    def invalidate(self, node_id):
+        """Forget the UNL of a node, e.g. after connecting to it failed."""
+        with self.mutex:
+            self.unls.pop(node_id, None)
+
+    def info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "size": len(self.unls),
+            "max_size": self.max_size
+        }
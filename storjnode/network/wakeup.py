@@ -0,0 +1,78 @@
+"""
+Wake a queue consumer from the reactor instead of polling the queue.
+"""
+
+import threading
+import traceback
+import storjnode
+from twisted.internet import threads
+
+
+_log = storjnode.log.getLogger(__name__)
+
+
+class Wakeup(object):
+    """Coalesced calls of a consumer after work was queued.
+
+    notify() may be called from any thread. Calls made while the consumer
+    is already scheduled are merged, calls made while it is running make
+    it run again afterwards so nothing queued is missed.
+
+    The consumer runs in the reactor thread, or in the reactor thread pool
+    if in_thread is set (for consumers that may block). It never runs
+    concurrently with itself.
+    """
+
+    def __init__(self, consumer, in_thread=False, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.consumer = consumer
+        self.in_thread = in_thread
+        self.reactor = reactor
+        self.mutex = threading.Lock()
+        self.scheduled = False
+        self.running = False
+        self.stopped = False
+
+    def notify(self):
+        with self.mutex:
+            if self.scheduled or self.stopped:
+                return
+            self.scheduled = True
+        self.reactor.callFromThread(self._run)
+
+    def stop(self):
+        with self.mutex:
+            self.stopped = True
+
+    def _run(self):
+        with self.mutex:
+            if self.running or not self.scheduled:
+                return  # rescheduled by _done or already handled
+            self.scheduled = False
+            if self.stopped:
+                return
+            self.running = True
+
+        if self.in_thread:
+            d = threads.deferToThreadPool(
+                self.reactor, self.reactor.getThreadPool(), self._consume
+            )
+            d.addBoth(self._done)
+        else:
+            self._consume()
+            self._done(None)
+
+    def _consume(self):
+        try:
+            self.consumer()
+        except Exception as e:
+            txt = "Queue consumer raised exception: {0}\n\n{1}"
+            _log.error(txt.format(repr(e), traceback.format_exc()))
+
+    def _done(self, result):
+        with self.mutex:
+            self.running = False
+            rerun = self.scheduled
+        if rerun:
+            self._run()
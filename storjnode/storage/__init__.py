@@ -1,2 +1,3 @@
 from . import shard  # NOQA
+from . import index  # NOQA
 from . import manager  # NOQA
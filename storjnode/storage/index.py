@@ -0,0 +1,180 @@
+import os
+import json
+import threading
+import storjnode
+
+
+INDEX_FILENAME = ".storjnode_index"
+COMPACT_MIN = 1024  # journal lines always allowed before compacting
+COMPACT_FACTOR = 2  # journal lines allowed per indexed shard
+
+
+_log = storjnode.log.getLogger(__name__)
+
+
+class ShardIndex(object):
+    """Persistent shard_id -> (relative path, size, mtime) index.
+
+    The index is kept in memory and journaled to a file in the store path,
+    so lookups do not touch the file system. The bytes used by all indexed
+    shards are tracked as a running total. Each line of the journal is a
+    json list, either ["add", shard_id, relpath, size, mtime] or
+    ["remove", shard_id]. The journal is compacted when loaded and once it
+    has more than compact_min lines and compact_factor lines per entry.
+    """
+
+    def __init__(self, store_path, compact_min=COMPACT_MIN,
+                 compact_factor=COMPACT_FACTOR):
+        self.store_path = store_path
+        self.compact_min = compact_min
+        self.compact_factor = compact_factor
+        self.index_path = os.path.join(store_path, INDEX_FILENAME)
+        self.mutex = threading.RLock()
+        self.entries = {}  # {shard_id: [relpath, size, mtime]}
+        self.used = 0  # total size of all indexed shards in bytes
+        self._journal = None
+        self._journal_lines = 0
+        self.load()
+
+    def load(self):
+        """Load the index from its journal, rebuild if missing or corrupt."""
+        with self.mutex:
+            self.entries = {}
+            self.used = 0
+            try:
+                with open(self.index_path, "r") as fobj:
+                    for line in fobj:
+                        self._replay(json.loads(line))
+            except (IOError, OSError, ValueError, TypeError) as e:
+                if os.path.exists(self.index_path):
+                    msg = "Corrupt shard index {0}, rebuilding: {1}"
+                    _log.warning(msg.format(self.index_path, repr(e)))
+                self.rebuild()
+                return
+            self._compact()
+
+    def _replay(self, entry):
+        if entry[0] == "add":
+            previous = self.entries.get(entry[1])
+            if previous is not None:
+                self.used -= previous[1]
+            self.entries[entry[1]] = entry[2:5]
+            self.used += entry[3]
+        elif entry[0] == "remove":
+            previous = self.entries.pop(entry[1], None)
+            if previous is not None:
+                self.used -= previous[1]
+        else:
+            raise ValueError("Unknown journal entry {0}".format(entry[0]))
+
+    def _stat(self, relpath):
+        # Returns: [relpath, size, mtime] or None if the file is gone.
+        try:
+            stat = os.stat(os.path.join(self.store_path, relpath))
+        except OSError:
+            return None
+        return [relpath, stat.st_size, stat.st_mtime]
+
+    def _scan(self):
+        found = {}
+        for dirpath, dirnames, filenames in os.walk(self.store_path):
+            for filename in filenames:
+                if not storjnode.storage.shard.valid_id(filename):
+                    continue
+                path = os.path.join(dirpath, filename)
+                entry = self._stat(os.path.relpath(path, self.store_path))
+                if entry is not None:
+                    found[filename] = entry
+        return found
+
+    def rebuild(self):
+        """Rebuild the index from the shards found in the store path."""
+        with self.mutex:
+            self.entries = self._scan()
+            self.used = sum([entry[1] for entry in self.entries.values()])
+            self._compact()
+
+    def reconcile(self):
+        """Fix the index to match the shards found in the store path.
+
+        Returns: The number of entries that were added, changed or removed.
+        """
+        # Scan without the lock so the manager isn't blocked meanwhile,
+        # shards added or removed since are checked again before changing
+        # their entries.
+        found = self._scan()
+        with self.mutex:
+            changes = 0
+            for shard_id in set(self.entries) - set(found):
+                if self._stat(self.entries[shard_id][0]) is not None:
+                    continue  # added since the scan
+                self._write(["remove", shard_id])
+                changes += 1
+            for shard_id, entry in found.items():
+                if self.entries.get(shard_id) == entry:
+                    continue
+                entry = self._stat(entry[0])
+                if entry is None:
+                    continue  # removed since the scan
+                if self.entries.get(shard_id) != entry:
+                    self._write(["add", shard_id] + entry)
+                    changes += 1
+            if changes:
+                msg = "Reconciled {0} shard index entries for {1}."
+                _log.info(msg.format(changes, self.store_path))
+            return changes
+
+    def _compact(self):
+        if self._journal is not None:
+            self._journal.close()
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w") as fobj:
+            for shard_id, entry in self.entries.items():
+                fobj.write(json.dumps(["add", shard_id] + entry) + "\n")
+        if os.name == "nt" and os.path.exists(self.index_path):
+            os.remove(self.index_path)  # pragma: no cover
+        os.rename(temp_path, self.index_path)
+        self._journal = open(self.index_path, "a")
+        self._journal_lines = len(self.entries)
+
+    def _write(self, entry):
+        self._replay(entry)
+        self._journal.write(json.dumps(entry) + "\n")
+        self._journal.flush()
+        self._journal_lines += 1
+        limit = max(self.compact_min, self.compact_factor * len(self.entries))
+        if self._journal_lines > limit:
+            self._compact()
+
+    def add(self, shard_id, path):
+        """Record a shard saved at the given path."""
+        stat = os.stat(path)
+        relpath = os.path.relpath(path, self.store_path)
+        with self.mutex:
+            self._write(["add", shard_id, relpath,
+                         stat.st_size, stat.st_mtime])
+
+    def remove(self, shard_id):
+        """Forget a shard, does nothing if not indexed."""
+        with self.mutex:
+            if shard_id in self.entries:
+                self._write(["remove", shard_id])
+
+    def find(self, shard_id):
+        """Returns: Path to the shard or None if not indexed."""
+        entry = self.entries.get(shard_id)
+        if entry is None:
+            return None
+        return os.path.join(self.store_path, entry[0])
+
+    def close(self):
+        with self.mutex:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    def __contains__(self, shard_id):
+        return shard_id in self.entries
+
+    def __len__(self):
+        return len(self.entries)
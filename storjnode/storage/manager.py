@@ -1,11 +1,13 @@
 import os
 import random
+import threading
 import storjnode
 from storjnode.common import STORJ_HOME
 
 
 DEFAULT_SHARD_SIZE = 1024 * 1024 * 128  # 128M
 DEFAULT_STORE_PATH = os.path.join(STORJ_HOME, "store")
+RECONCILE_INTERVAL = 3600  # seconds between shard index reconciles
 DEFAULT_STORE_CONFIG = {
     DEFAULT_STORE_PATH: {"limit": 0, "use_folder_tree": False}
 }
@@ -15,6 +17,12 @@ _log = storjnode.log.getLogger(__name__)
 _builtin_open = open
 
 
+# normalized store paths and shard indexes are loaded once per process
+_mutex = threading.RLock()
+_setup_cache = {}  # {(path, limit, use_folder_tree): (real_path, attributes)}
+_indexes = {}  # {real_path: storjnode.storage.index.ShardIndex}
+
+
 def _get_shard_path(store_path, shard_id, use_folder_tree,
                     create_needed_folders=False):
     if use_folder_tree:
@@ -84,6 +92,52 @@ def setup(store_config=None):
     return normal_paths
 
 
+def _setup_cached(store_config):
+    """Like setup but only validates each store path once per process."""
+    normal_paths = {}
+    store_config = store_config or DEFAULT_STORE_CONFIG
+    for path, attributes in store_config.items():
+        attributes = attributes or {}  # None allowed
+        key = (path, attributes.get("limit", 0),
+               attributes.get("use_folder_tree", False))
+        with _mutex:
+            if key not in _setup_cache:
+                normalized = setup(store_config={path: attributes})
+                _setup_cache[key] = list(normalized.items())[0]
+            real_path, normalized_attributes = _setup_cache[key]
+        normal_paths[real_path] = normalized_attributes
+    return normal_paths
+
+
+def get_index(store_path):
+    """Get the shard index of a normalized store path.
+
+    The index is loaded from disk (or rebuilt) on first use.
+
+    Returns:
+        The storjnode.storage.index.ShardIndex for the store path.
+    """
+    with _mutex:
+        index = _indexes.get(store_path)
+        if index is None:
+            index = storjnode.storage.index.ShardIndex(store_path)
+            _indexes[store_path] = index
+        return index
+
+
+def reconcile(store_config):
+    """Reconcile the shard indexes with the shards on disk.
+
+    Args:
+        store_config: Dict of storage paths to optional attributes.
+
+    Returns:
+        The number of index entries that were fixed.
+    """
+    store_config = _setup_cached(store_config)
+    return sum([get_index(path).reconcile() for path in store_config])
+
+
 def open(store_config, shard_id):
     """Retreives a shard from storage.
 
@@ -119,6 +173,11 @@ def open(store_config, shard_id):
 def capacity(store_config):
     """ Get the total, used and free capacity of the store.
 
+    Used space only counts indexed shards, not other files in the store
+    paths (partial downloads, the index journal or foreign files). For
+    paths without a limit the total is the free disc space plus the space
+    used by shards, so free is the free disc space.
+
     Args:
         store_config: Dict of storage paths to optional attributes.
                       limit: The dir size limit in bytes, 0 for no limit.
@@ -136,20 +195,24 @@ def capacity(store_config):
         store_config = {"path/alpha": None, "path/beta": None}
         print(storjnode.storage.manager.capacity(store_config))
     """
-    store_config = setup(store_config=store_config)  # setup if needed
+    store_config = _setup_cached(store_config)  # setup if needed
     total, used, free = 0, 0, 0
     # FIXME doesn't give correct total if multiple paths on same drive
     for store_path, attributes in store_config.items():
-        free_disc_space = storjnode.util.get_free_space(store_path)
-        limit = attributes["limit"] or free_disc_space
-        path_used = storjnode.util.get_folder_size(store_path)
+        path_used = get_index(store_path).used
+        if attributes["limit"]:
+            limit = attributes["limit"]
+        else:
+            free_disc_space = storjnode.util.get_free_space(store_path)
+            limit = free_disc_space + path_used
+        limit = max(limit, path_used)
         total += limit
         used += path_used
-        free += limit - used
+        free += limit - path_used
     return {"total": total, "used": used, "free": free}
 
 
-def add(store_config, shard):
+def add(store_config, shard, shard_id=None, move=False):
     """ Add a shard to the storage.
 
     Args:
@@ -158,6 +221,8 @@ def add(store_config, shard):
                       use_folder_tree: Files organized in a folder tree
                                        (always on for fat partitions).
         shard: A file like object representing the shard.
+        shard_id: The shard id if already known, saves hashing the shard.
+        move: Move the shard file into the store instead of copying it.
 
     Returns:
         Path to the added shard.
@@ -172,23 +237,26 @@ def add(store_config, shard):
         with open("path/to/loose/shard", "rb") as shard:
             storjnode.storage.store.add(store_config, shard)
     """
-    store_config = setup(store_config=store_config)  # setup if needed
-    shard_id = storjnode.storage.shard.get_id(shard)
+    store_config = _setup_cached(store_config)  # setup if needed
+    shard_id = shard_id or storjnode.storage.shard.get_id(shard)
     shard_size = storjnode.storage.shard.get_size(shard)
 
     # check if already in storage
     shard_path = find(store_config, shard_id)
     if shard_path is not None:
+        src_path = storjnode.storage.shard.get_path(shard)
+        if move and src_path is not None:
+            os.remove(src_path)
         return shard_path
 
     # shuffle store paths to spread shards somewhat evenly
-    items = store_config.items()
+    items = list(store_config.items())
     random.shuffle(items)
     for store_path, attributes in items:
 
         # check if store path limit reached
         limit = attributes["limit"]
-        used = storjnode.util.get_folder_size(store_path)
+        used = get_index(store_path).used
         free = limit - used
         if limit > 0 and shard_size > free:
             msg = ("Store path limit reached for {3} cannot add {0}: "
@@ -210,7 +278,8 @@ def add(store_config, shard):
         use_folder_tree = attributes["use_folder_tree"]
         shard_path = _get_shard_path(store_path, shard_id, use_folder_tree,
                                      create_needed_folders=True)
-        storjnode.storage.shard.save(shard, shard_path)
+        storjnode.storage.shard.save(shard, shard_path, move=move)
+        get_index(store_path).add(shard_id, shard_path)
         return shard_path
 
     raise MemoryError("Not enough space to add {0}!".format(shard_id))
@@ -235,9 +304,15 @@ def remove(store_config, shard_id):
         store_config = {"path/alpha": None, "path/beta": None}
         storjnode.storage.store.remove(store_config, id)
     """
-    shard_path = find(store_config, shard_id)
-    if shard_path is not None:
-        return os.remove(shard_path)
+    assert(storjnode.storage.shard.valid_id(shard_id))
+    store_config = _setup_cached(store_config)  # setup if needed
+    for store_path in store_config:
+        index = get_index(store_path)
+        shard_path = index.find(shard_id)
+        if shard_path is not None:
+            index.remove(shard_id)
+            if os.path.isfile(shard_path):
+                os.remove(shard_path)
 
 
 def find(store_config, shard_id):
@@ -264,11 +339,22 @@ def find(store_config, shard_id):
         print("shard located at %s" % shard_path)
     """
     assert(storjnode.storage.shard.valid_id(shard_id))
-    store_config = setup(store_config=store_config)  # setup if needed
+    store_config = _setup_cached(store_config)  # setup if needed
+    for store_path in store_config:
+        index = get_index(store_path)
+        shard_path = index.find(shard_id)
+        if shard_path is None:
+            continue
+        if os.path.isfile(shard_path):
+            return shard_path
+        index.remove(shard_id)  # removed without the manager
+
+    # adopt shards placed in the store without the manager
     for store_path, attributes in store_config.items():
         use_folder_tree = attributes["use_folder_tree"]
         shard_path = _get_shard_path(store_path, shard_id, use_folder_tree)
         if os.path.isfile(shard_path):
+            get_index(store_path).add(shard_id, shard_path)
             return shard_path
     return None
 
@@ -1,7 +1,11 @@
+import os
 import re
 import hashlib
 
 
+BUFFER_SIZE = 1024 * 1024  # 1M
+
+
 def valid_id(shard_id):
     return bool(re.match(r"^[0-9abcdef]{64}$", shard_id))
 
@@ -34,7 +38,7 @@ def get_hash(shard, salt=None, limit=None):
 
     # Don't read whole file into memory.
     remaining = limit
-    max_chunk_size = 4096
+    max_chunk_size = BUFFER_SIZE
 
     def get_chunk_size(remaining, max_chunk_size):
         if remaining is not None:
@@ -64,23 +68,98 @@ def get_id(shard):
     return get_hash(shard)
 
 
+def get_path(shard):
+    """Get the path of a shard if it is a file on disc.
+
+    Args:
+        shard: A file like object representing the shard.
+
+    Returns: The shard path or None.
+    """
+    path = getattr(shard, "name", None)
+    if not isinstance(path, (type(b""), type(u""))):
+        return None
+    if not os.path.isfile(path):
+        return None
+    return path
+
+
 def copy(src_shard, dest_fobj):
     """Copy a shard to a file like object.
 
+    The shard is streamed so it is never read into memory as a whole.
+
     Args:
         src_shard: A file like object representing the shard to copy.
         dest_fobj: A file like object to copy the shard to.
     """
     src_shard.seek(0)
-    dest_fobj.write(src_shard.read())
+    while True:
+        chunk = src_shard.read(BUFFER_SIZE)
+        if not chunk:
+            break
+        dest_fobj.write(chunk)
+    src_shard.seek(0)
+
 
+def _kernel_copy(src_shard, dest_fobj):
+    """Copy a shard to an empty file without passing it through user space.
 
-def save(shard, path):
+    Returns: True if copied, False if not supported for the given files.
+    """
+    copy_file_range = getattr(os, "copy_file_range", None)  # py3.8+ linux
+    sendfile = getattr(os, "sendfile", None)  # py3.3+ unix
+    if copy_file_range is None and sendfile is None:
+        return False  # pragma: no cover
+    try:
+        src_fd = src_shard.fileno()
+        dest_fd = dest_fobj.fileno()
+    except (AttributeError, IOError, OSError, ValueError):
+        return False  # not backed by a file descriptor
+
+    size = get_size(src_shard)
+    src_shard.seek(0)
+    offset = 0
+    while offset < size:
+        count = min(size - offset, BUFFER_SIZE * 16)
+        try:
+            if copy_file_range is not None:
+                copied = copy_file_range(src_fd, dest_fd, count, offset)
+            else:
+                copied = sendfile(dest_fd, src_fd, offset, count)
+        except OSError:
+            if offset == 0:
+                return False  # unsupported by file systems, nothing written
+            raise
+        if not copied:
+            raise IOError("Shard truncated while copying!")
+        offset += copied
+    return True
+
+
+def save(shard, path, move=False):
     """Copy a shard to a file.
 
+    If the shard is a file on disc it is copied by the kernel where
+    supported. If move is given it is renamed instead when both paths
+    are on the same file system and removed after copying otherwise.
+
     Args:
-        src_shard: A file like object representing the shard to copy.
+        shard: A file like object representing the shard to copy.
         path: The path to save the shard at.
+        move: Remove the shard file after it was saved.
     """
+    src_path = get_path(shard)
+    if move and src_path is not None:
+        try:
+            os.rename(src_path, path)
+            return
+        except OSError:
+            pass  # different file system
+
     with open(path, "wb") as fobj:
-        copy(shard, fobj)
+        if not _kernel_copy(shard, fobj):
+            copy(shard, fobj)
+
+    if move and src_path is not None:
+        os.remove(src_path)
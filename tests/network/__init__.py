@@ -8,6 +8,22 @@ from . queued_file_transfer import *  # NOQA
 from . process_transfers import *  # NOQA
 from . bandwidth_test import *  # NOQA
 from . server_test import *  # NOQA
+from . shard_io import *  # NOQA
+from . transfer_engine import *  # NOQA
+from . multiplex import *  # NOQA
+from . message_router import *  # NOQA
+from . wakeup import *  # NOQA
+from . handler_pool import *  # NOQA
+from . contract_codec import *  # NOQA
+from . repeat_relay import *  # NOQA
+from . dedup import *  # NOQA
+from . relay_cache import *  # NOQA
+from . unl_cache import *  # NOQA
+from . correlation import *  # NOQA
+from . routing_index import *  # NOQA
+from . dht_storage import *  # NOQA
+from . dht_cache import *  # NOQA
+from . dht_batch import *  # NOQA
 
 
 if __name__ == "__main__":
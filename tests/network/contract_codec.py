@@ -0,0 +1,103 @@
+import zlib
+import base64
+import hashlib
+import unittest
+import umsgpack
+from collections import OrderedDict
+from storjnode.util import ordered_dict_to_list, list_to_ordered_dict
+from storjnode.network import contract_codec
+from storjnode.network.contract_codec import ContractFormatError
+from storjnode.network.message import sign, verify_signature, get_signer
+
+
+WIF = "L18vBLrz3A5QxJ6K4bUraQQZm6BAdjuAxU83e16y3x7eiiHTApHj"
+HOST_UNL = base64.b64encode(hashlib.sha512(b"host").digest())
+DEST_UNL = base64.b64encode(hashlib.sha512(b"dest").digest()).decode("ascii")
+
+
+def create_syn():
+    return sign(OrderedDict([
+        (u"status", u"SYN"),
+        (u"data_id", hashlib.sha256(b"foo").hexdigest()),
+        (u"file_size", 1024),
+        (u"host_unl", HOST_UNL),
+        (u"dest_unl", DEST_UNL),
+        (u"src_unl", HOST_UNL),
+        (u"mux", 1)
+    ]), WIF)
+
+
+def roundtrip(msg):
+    return list_to_ordered_dict(
+        contract_codec.decode(contract_codec.encode(msg))
+    )
+
+
+class TestContractCodec(unittest.TestCase):
+
+    def test_roundtrip(self):
+        syn = create_syn()
+        syn_ack = sign(OrderedDict([
+            (u"status", u"SYN-ACK"),
+            (u"syn", syn),
+            (u"mux", 1)
+        ]), WIF)
+        ack = sign(OrderedDict([
+            (u"status", u"ACK"),
+            (u"syn_ack", syn_ack)
+        ]), WIF)
+
+        for msg in (syn, syn_ack, ack):
+            decoded = roundtrip(msg)
+            self.assertEqual(str(decoded), str(msg))
+            self.assertTrue(verify_signature(
+                decoded, WIF, get_signer(WIF).node_id
+            ))
+
+            # Same bytes for equal messages.
+            self.assertEqual(contract_codec.encode(decoded),
+                             contract_codec.encode(msg))
+
+            # Much smaller than the old format, UNLs are only sent once.
+            compact = contract_codec.encode(msg)
+            old = zlib.compress(str(ordered_dict_to_list(msg)).encode())
+            self.assertTrue(len(compact) < len(old))
+            _, unls, _ = umsgpack.unpackb(compact[1:])
+            self.assertEqual(len(unls), 2)
+
+    def test_fallback(self):
+        msg = OrderedDict([
+            (u"status", u"FOO"),
+            (u"data_id", u"not hex"),
+            (u"signature", b"#"),
+            (u"file_size", True),
+            (u"extra", None)
+        ])
+        self.assertEqual(str(roundtrip(msg)), str(msg))
+
+        msg = OrderedDict([(u"extra", [1, 2])])
+        self.assertRaises(ContractFormatError, contract_codec.encode, msg)
+
+    def test_invalid(self):
+        def encode(obj):
+            return contract_codec.MAGIC + umsgpack.packb(obj)
+
+        invalid = [
+            b"",
+            zlib.compress(b"[]"),
+            contract_codec.MAGIC + b"foo",
+            encode([2, [], []]),
+            encode([1, [], [1]]),
+            encode([1, [], [42, 0]]),
+            encode([1, [], [1, 42]]),
+            encode([1, [], [7, 0]]),
+            encode([1, [], [3, u"foo"]]),
+            encode([1, [], [11, 0]]),
+        ]
+        for data in invalid:
+            self.assertRaises(ContractFormatError,
+                              contract_codec.decode, data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import unittest
+from twisted.internet.task import Clock
+from storjnode.network.correlation import Correlator, RequestTimeout
+from storjnode.network.correlation import get_request_id
+
+
+class MockReactor(Clock):
+
+    def callFromThread(self, f, *args, **kwargs):
+        f(*args, **kwargs)
+
+
+def read_response(message):
+    message = dict(message)
+    if message.get(u"type") != u"response":
+        return None
+    return message[u"value"]
+
+
+def response(request_id, value, message_type=u"response"):
+    return [[u"type", message_type], [u"request_id", request_id],
+            [u"value", value]]
+
+
+def legacy_response(peer, value):
+    # response from a node that doesn't echo request ids
+    return [[u"type", u"response"], [u"peer", peer], [u"value", value]]
+
+
+def get_peer(message):
+    return dict(message)[u"peer"]
+
+
+class TestCorrelator(unittest.TestCase):
+
+    def setUp(self):
+        self.reactor = MockReactor()
+        self.correlator = Correlator(reactor=self.reactor, get_peer=get_peer)
+        self.results = []
+        self.errors = []
+
+    def register(self, timeout=10, peer=None):
+        request_id, d = self.correlator.register(read_response,
+                                                 timeout=timeout, peer=peer)
+        d.addCallbacks(self.results.append, self.errors.append)
+        return request_id
+
+    def test_get_request_id(self):
+        self.assertEqual(get_request_id(response(u"foo", 1)), u"foo")
+        self.assertIsNone(get_request_id([[u"request_id", 1]]))
+        self.assertIsNone(get_request_id([[u"type", u"foo"]]))
+        self.assertIsNone(get_request_id(u"foo"))
+
+    def test_resolve(self):
+        first = self.register()
+        second = self.register()
+        self.assertNotEqual(first, second)
+
+        self.correlator.handle(None, response(second, u"b"))
+        self.correlator.handle(None, response(second, u"again"))  # ignored
+        self.correlator.handle(None, response(u"unknown", u"c"))
+        self.correlator.handle(None, response(first, u"a"))
+        self.assertEqual(self.results, [u"b", u"a"])
+        self.assertEqual(len(self.correlator), 0)
+
+    def test_invalid_response(self):
+        request_id = self.register()
+        self.correlator.handle(None, response(request_id, u"a", u"other"))
+        self.assertEqual(self.results, [])
+        self.correlator.handle(None, response(request_id, u"a"))
+        self.assertEqual(self.results, [u"a"])
+
+    def test_timeout(self):
+        request_id = self.register(timeout=10)
+        self.reactor.advance(9)
+        self.assertEqual(self.errors, [])
+        self.reactor.advance(1)
+        self.assertEqual(len(self.errors), 1)
+        self.errors[0].trap(RequestTimeout)
+        self.assertEqual(self.correlator.timeouts, 1)
+
+        # late responses are ignored
+        self.correlator.handle(None, response(request_id, u"a"))
+        self.assertEqual(self.results, [])
+
+    def test_resolved_before_timeout(self):
+        request_id = self.register(timeout=10)
+        self.correlator.handle(None, response(request_id, u"a"))
+        self.reactor.advance(10)
+        self.assertEqual(self.results, [u"a"])
+        self.assertEqual(self.errors, [])
+
+    def test_response_without_request_id(self):
+        first = self.register(peer=u"alice")
+        self.register(peer=u"alice")
+        self.register()  # not matched by peer
+        self.correlator.handle(None, legacy_response(u"bob", u"b"))
+        self.correlator.handle(None, [[u"type", u"response"]])
+        self.assertEqual(self.results, [])
+
+        # oldest request for the peer first
+        self.correlator.handle(None, legacy_response(u"alice", u"a1"))
+        self.assertEqual(self.results, [u"a1"])
+        self.assertFalse(self.correlator.cancel(first))
+        self.correlator.handle(None, legacy_response(u"alice", u"a2"))
+        self.assertEqual(self.results, [u"a1", u"a2"])
+        self.correlator.handle(None, legacy_response(u"alice", u"a3"))
+        self.assertEqual(self.results, [u"a1", u"a2"])
+        self.assertEqual(len(self.correlator), 1)
+        self.assertEqual(self.correlator.peers, {})
+
+    def test_peer_request_expires(self):
+        self.register(timeout=10, peer=u"alice")
+        self.reactor.advance(10)
+        self.assertEqual(len(self.errors), 1)
+        self.assertEqual(self.correlator.peers, {})
+        self.correlator.handle(None, legacy_response(u"alice", u"a"))
+        self.assertEqual(self.results, [])
+
+    def test_cancel(self):
+        request_id = self.register()
+        self.assertTrue(self.correlator.cancel(request_id))
+        self.assertFalse(self.correlator.cancel(request_id))
+        self.reactor.advance(10)
+        self.assertEqual(self.results + self.errors, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import unittest
+from storjnode.network.dedup import DuplicateFilter, get_digest
+
+
+class TestDuplicateFilter(unittest.TestCase):
+
+    def test_suppress(self):
+        dedup = DuplicateFilter(window=10)
+        node_id = os.urandom(20)
+        message = [node_id, 0, b"info", os.urandom(65), 1]
+        self.assertFalse(dedup.is_duplicate(message, now=100))
+        self.assertTrue(dedup.is_duplicate(list(message), now=101))
+        self.assertTrue(dedup.is_duplicate(message, now=109))
+        self.assertFalse(dedup.is_duplicate(u"other", now=109))
+        self.assertEqual(dedup.info()["suppressed"], 2)
+        self.assertEqual(dedup.info()["size"], 2)
+
+    def test_window(self):
+        dedup = DuplicateFilter(window=10)
+        self.assertFalse(dedup.is_duplicate(u"foo", now=100))
+        self.assertTrue(dedup.is_duplicate(u"foo", now=105))
+
+        # window starts when first received, duplicates don't extend it
+        self.assertFalse(dedup.is_duplicate(u"foo", now=110))
+        self.assertEqual(dedup.info()["size"], 1)
+        self.assertEqual(dedup.info()["suppressed"], 1)
+
+    def test_max_entries(self):
+        dedup = DuplicateFilter(window=10, max_entries=3)
+        for i in range(5):
+            self.assertFalse(dedup.is_duplicate(i, now=100))
+        self.assertEqual(dedup.info()["size"], 3)
+        self.assertFalse(dedup.is_duplicate(0, now=100))  # forgotten
+        self.assertTrue(dedup.is_duplicate(4, now=100))
+
+    def test_unpackable(self):
+        dedup = DuplicateFilter()
+        self.assertIsNone(get_digest(object()))
+        message = object()
+        self.assertFalse(dedup.is_duplicate(message))
+        self.assertFalse(dedup.is_duplicate(message))
+
+    def test_clear(self):
+        dedup = DuplicateFilter()
+        dedup.is_duplicate(u"foo")
+        dedup.is_duplicate(u"foo")
+        dedup.clear()
+        self.assertEqual(dedup.info()["suppressed"], 0)
+        self.assertFalse(dedup.is_duplicate(u"foo"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,215 @@
+import os
+import unittest
+from twisted.internet import defer
+from kademlia.node import Node as KademliaNode
+from kademlia.utils import digest
+from storjnode.network.dht_batch import BatchWalk, group_keys, get_nearest
+from storjnode.network.dht_batch import WalkFailed
+from storjnode.network.monitor import find_next_free_dataset_num
+from storjnode.network.monitor import predictable_key
+
+
+KSIZE = 20
+
+
+class MockRouter(object):
+
+    def __init__(self, contacts):
+        self.contacts = contacts
+
+    def findNeighbors(self, node, k=None, exclude=None):
+        return get_nearest(node, self.contacts, k or KSIZE)
+
+
+class MockProtocol(object):
+
+    def __init__(self, size=200, contacts=10, delayed=False):
+        self.nodes = [KademliaNode(os.urandom(20), "127.0.0.1", i)
+                      for i in range(size)]
+        self.storage = dict((n.id, {}) for n in self.nodes)
+        self.router = MockRouter(self.nodes[:contacts])
+        self.delayed = delayed
+        self.pending = []  # [(deferred, result, target id)]
+
+    def respond(self, result, target_id):
+        if not self.delayed:
+            return defer.succeed(result)
+        d = defer.Deferred()
+        self.pending.append((d, result, target_id))
+        return d
+
+    def flush(self):
+        rounds = 0
+        while self.pending:
+            pending, self.pending = self.pending, []
+            for d, result, target_id in pending:
+                d.callback(result)
+            rounds += 1
+        return rounds
+
+    def nearest(self, target_id):
+        nodes = get_nearest(KademliaNode(target_id), self.nodes, KSIZE)
+        return [(n.id, n.ip, n.port) for n in nodes]
+
+    def callFindNode(self, nodeToAsk, nodeToFind):
+        return self.respond((True, self.nearest(nodeToFind.id)),
+                            nodeToFind.id)
+
+    def callFindValue(self, nodeToAsk, nodeToFind):
+        value = self.storage[nodeToAsk.id].get(nodeToFind.id)
+        if value is not None:
+            return self.respond((True, {"value": value}), nodeToFind.id)
+        return self.respond((True, self.nearest(nodeToFind.id)),
+                            nodeToFind.id)
+
+    def callStore(self, nodeToAsk, key, value):
+        self.storage[nodeToAsk.id][key] = value
+        return self.respond((True, True), key)
+
+
+class MockServer(object):
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.ksize = KSIZE
+        self.alpha = 3
+
+    def _anyRespondSuccess(self, responses):
+        for success, result in responses:
+            if success and result[0] and result[1]:
+                return True
+        return False
+
+
+def resolve(d):
+    results = []
+    d.addBoth(results.append)
+    return results[0]
+
+
+def keys_with_prefix(count, prefix_bits=8):
+    first = KademliaNode(digest("key_0")).long_id >> (160 - prefix_bits)
+    keys = []
+    i = 0
+    while len(keys) < count:
+        key = "key_{0}".format(i)
+        if KademliaNode(digest(key)).long_id >> (160 - prefix_bits) == first:
+            keys.append(key)
+        i += 1
+    return keys
+
+
+class TestBatchWalk(unittest.TestCase):
+
+    def test_group_keys(self):
+        keys = keys_with_prefix(3) + ["other_{0}".format(i) for i in range(5)]
+        groups = group_keys(keys, prefix_bits=8)
+        grouped = [[key for target, key in group] for group in groups]
+        self.assertEqual(grouped[0], keys[:3])
+        self.assertEqual(sum(len(g) for g in grouped), len(keys))
+        self.assertEqual(len(group_keys(keys, prefix_bits=160)), len(keys))
+        target, key = groups[0][0]
+        self.assertEqual(target.id, digest(key))
+
+    def test_set_get(self):
+        server = MockServer(MockProtocol())
+        walk = BatchWalk(server)
+        items = dict(("key_{0}".format(i), "value_{0}".format(i))
+                     for i in range(30))
+        stored = resolve(walk.set(items))
+        self.assertEqual(stored, dict((k, True) for k in items))
+
+        found = resolve(walk.get(list(items.keys()) + ["missing"]))
+        expected = dict(items, missing=None)
+        self.assertEqual(found, expected)
+
+    def test_shared_walk(self):
+        keys = keys_with_prefix(16)
+        items = dict((key, key) for key in keys)
+        protocol = MockProtocol(size=1000)
+        server = MockServer(protocol)
+        resolve(BatchWalk(server).set(items))
+        protocol.delayed = True
+
+        # keys walking from the group's nodes need fewer rounds of queries
+        rounds = []
+        for prefix_bits in (160, 8):
+            results = []
+            walk = BatchWalk(server, parallelism=4, prefix_bits=prefix_bits)
+            walk.get(keys).addCallback(results.append)
+            rounds.append(protocol.flush())
+            self.assertEqual(results, [items])
+        unshared, shared = rounds
+        self.assertLess(shared, unshared)
+
+    def test_set_nearest_nodes(self):
+        # more nodes than 2 ** WALK_PREFIX_BITS * KSIZE, so grouped keys
+        # have different nodes nearest to them
+        protocol = MockProtocol(size=6000)
+        keys = keys_with_prefix(10)
+        items = dict((key, key) for key in keys)
+        resolve(BatchWalk(MockServer(protocol)).set(items))
+        for key in keys:
+            target = KademliaNode(digest(key))
+            for node in get_nearest(target, protocol.nodes, KSIZE):
+                self.assertEqual(protocol.storage[node.id][target.id], key)
+
+    def test_parallelism(self):
+        protocol = MockProtocol(delayed=True)
+        walk = BatchWalk(MockServer(protocol), parallelism=2,
+                         prefix_bits=160)
+        results = []
+        keys = ["key_{0}".format(i) for i in range(5)]
+        walk.get(keys).addCallback(results.append)
+
+        # only two walks asking peers
+        targets = set(target_id for d, r, target_id in protocol.pending)
+        self.assertEqual(len(targets), 2)
+
+        protocol.flush()
+        self.assertEqual(results, [dict((key, None) for key in keys)])
+
+    def test_no_neighbours(self):
+        protocol = MockProtocol(contacts=0)
+        walk = BatchWalk(MockServer(protocol))
+        self.assertEqual(resolve(walk.get(["a", "b"])),
+                         {"a": None, "b": None})
+        self.assertEqual(resolve(walk.set({"a": 1, "b": 2})),
+                         {"a": False, "b": False})
+
+
+class MockNode(object):
+
+    def __init__(self, values, failures):
+        self.values = values
+        self.failures = failures  # walks failing before one succeeds
+
+    def get_address(self):
+        return "address"
+
+    def get_many(self, keys):
+        results = dict((k, self.values.get(k)) for k in keys)
+        if self.failures > 0:
+            self.failures -= 1
+            failed = keys[-1:]
+            raise WalkFailed(failed, dict((k, results[k]) for k in keys
+                                          if k not in failed))
+        return results
+
+
+class TestWalkFailed(unittest.TestCase):
+
+    def test_dataset_lookup_retried(self):
+        node = MockNode({}, failures=0)
+        values = dict((predictable_key(node, n), n) for n in range(12))
+        node.values = values
+        node.failures = 2
+        self.assertEqual(find_next_free_dataset_num(node), 12)
+
+        # a failed lookup isn't taken for a free dataset
+        node.failures = 100
+        self.assertRaises(WalkFailed, find_next_free_dataset_num, node)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+from storjnode.network.dht_cache import DhtCache
+
+
+class TestDhtCache(unittest.TestCase):
+
+    def test_ttl(self):
+        cache = DhtCache(ttl=60, negative_ttl=10)
+        cache.set("found", "value", now=100)
+        cache.set("missing", None, now=100)
+        self.assertEqual(cache.get("found", now=105), (True, "value"))
+        self.assertEqual(cache.get("missing", now=105), (True, None))
+
+        # missing keys expire sooner
+        self.assertEqual(cache.get("missing", now=110), (False, None))
+        self.assertEqual(cache.get("found", now=159), (True, "value"))
+        self.assertEqual(cache.get("found", now=160), (False, None))
+        self.assertEqual(cache.info()["hits"], 3)
+        self.assertEqual(cache.info()["misses"], 2)
+
+    def test_invalidate(self):
+        cache = DhtCache()
+        cache.set("key", "value")
+        cache.invalidate("key")
+        self.assertEqual(cache.get("key"), (False, None))
+        cache.set("key", "value")
+        cache.clear()
+        self.assertEqual(cache.info()["size"], 0)
+
+    def test_disabled(self):
+        cache = DhtCache(ttl=0, negative_ttl=0)
+        cache.set("key", "value")
+        cache.set("other", None)
+        self.assertEqual(cache.get("key"), (False, None))
+        self.assertEqual(cache.info()["size"], 0)
+
+    def test_lru(self):
+        cache = DhtCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), (True, 1))
+        self.assertEqual(cache.get("b"), (False, None))
+        self.assertEqual(cache.get("c"), (True, 3))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import unittest
+from storjnode.network import dht_storage
+from storjnode.network.dht_storage import SqliteStorage
+
+
+class TestSqliteStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "dht.db")
+        self.storage = SqliteStorage(self.path)
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.dir)
+
+    def age(self, seconds, key=None):
+        # move birthdays into the past
+        with self.storage.db:
+            if key is None:
+                self.storage.db.execute(
+                    "UPDATE items SET birthday = birthday - ?", (seconds,)
+                )
+            else:
+                self.storage.db.execute(
+                    "UPDATE items SET birthday = birthday - ? WHERE key = ?",
+                    (seconds, dht_storage.sqlite3.Binary(key))
+                )
+
+    def test_set_get(self):
+        self.storage[b"foo"] = {u"bar": [1, 2, 3]}
+        self.storage[b"\x00\xff"] = b"\x01\x02"
+        self.assertEqual(self.storage[b"foo"], {u"bar": [1, 2, 3]})
+        self.assertEqual(self.storage.get(b"\x00\xff"), b"\x01\x02")
+        self.assertIsNone(self.storage.get(b"missing"))
+        self.assertRaises(KeyError, lambda: self.storage[b"missing"])
+        self.assertTrue(b"foo" in self.storage)
+        self.assertFalse(b"missing" in self.storage)
+        self.assertEqual(len(self.storage), 2)
+
+        self.storage[b"foo"] = u"replaced"
+        self.assertEqual(self.storage[b"foo"], u"replaced")
+        self.assertEqual(len(self.storage), 2)
+        size = len(b"foo") + len(dht_storage.umsgpack.packb(u"replaced"))
+        size += len(b"\x00\xff") + len(dht_storage.umsgpack.packb(b"\x01\x02"))
+        self.assertEqual(self.storage.get_size(), size)
+
+    def test_persistent(self):
+        self.storage[b"foo"] = u"bar"
+        self.storage.close()
+        self.storage = SqliteStorage(self.path)
+        self.assertEqual(self.storage[b"foo"], u"bar")
+        self.assertEqual(self.storage.info()["size"],
+                         len(b"foo") + len(dht_storage.umsgpack.packb(u"bar")))
+
+    def test_ttl(self):
+        self.storage[b"old"] = u"a"
+        self.storage[b"new"] = u"b"
+        self.age(self.storage.ttl + 1, b"old")
+        self.assertIsNone(self.storage.get(b"old"))
+        self.assertFalse(b"old" in self.storage)
+        self.assertEqual(len(self.storage), 1)
+        self.assertEqual(list(self.storage), [b"new"])
+
+        # expired values are removed on cull
+        self.storage.cull()
+        self.assertEqual(self.storage.get_size(),
+                         len(b"new") + len(dht_storage.umsgpack.packb(u"b")))
+
+    def test_lru_eviction(self):
+        self.storage.close()
+        item_size = len(b"k0") + len(dht_storage.umsgpack.packb(b"x" * 100))
+        self.storage = SqliteStorage(self.path, max_bytes=item_size * 3)
+        for i in range(3):
+            self.storage[u"k{0}".format(i).encode("ascii")] = b"x" * 100
+            with self.storage.db:  # distinct access order
+                self.storage.db.execute(
+                    "UPDATE items SET accessed = ? WHERE key = ?",
+                    (i, dht_storage.sqlite3.Binary(b"k" + str(i).encode()))
+                )
+
+        self.storage.get(b"k0")  # k1 is now least recently used
+        self.storage[b"k3"] = b"x" * 100
+        self.assertEqual(sorted(self.storage), [b"k0", b"k2", b"k3"])
+        self.assertEqual(self.storage.info()["evicted"], 1)
+        self.assertEqual(self.storage.get_size(), item_size * 3)
+
+    def test_iteritems(self):
+        count = dht_storage.PAGE_SIZE * 2 + 10
+        for i in range(count):
+            self.storage[u"{0:04d}".format(i).encode("ascii")] = i
+        self.age(3600, b"0007")
+        self.age(3600, b"0500")
+
+        items = list(self.storage.iteritems())
+        self.assertEqual(len(items), count)
+        self.assertEqual(len(set(k for k, v in items)), count)
+        self.assertEqual(items[0], (b"0007", 7))  # oldest first
+        self.assertEqual(items[1], (b"0500", 500))
+
+        old = list(self.storage.iteritemsOlderThan(60))
+        self.assertEqual(old, [(b"0007", 7), (b"0500", 500)])
+
+
+if __name__ == "__main__":
+    unittest.main()
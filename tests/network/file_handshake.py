@@ -12,6 +12,8 @@ from storjnode.network.file_handshake import (is_valid_syn, process_syn,
                                               process_syn_ack, process_ack,
                                               process_rst, protocol)
 from storjnode.network.bandwidth.limit import BandwidthLimit
+from storjnode.network import contract_codec
+from storjnode.util import list_to_ordered_dict
 from storjnode.config import ConfigFile
 import hashlib
 import tempfile
@@ -190,6 +192,39 @@ class TestFileHandshake(unittest.TestCase):
         print("Done testing message flow")
         print("")
 
+    def test_compact_message_flow(self):
+        path = os.path.join(self.alice_storage, self.syn[u"data_id"])
+        if not os.path.exists(path):
+            with open(path, "w") as fp:
+                fp.write("0")
+        self.clean_slate_all()
+
+        def send(client, msg):
+            # Deliver msg like the DHT would in the compact format.
+            client.net.dht_messages = []
+            client.compact_msg_handler(None, contract_codec.encode(msg))
+            received = client.net.dht_messages[0][u"message"]
+            received = list_to_ordered_dict(received)
+            self.assertEqual(str(received), str(msg))
+            return received
+
+        contract_id = self.alice.simple_data_request(
+            data_id=self.syn[u"data_id"],
+            node_unl=self.bob.net.unl.value,
+            direction=u"send"
+        )
+        syn = send(self.bob, self.alice.contracts[contract_id])
+        self.assertEqual(self.bob.contract_id(syn), contract_id)
+        syn_ack = send(self.alice, process_syn(self.bob, syn))
+        ack = send(self.bob, process_syn_ack(self.alice, syn_ack))
+        self.assertEqual(process_ack(self.bob, ack), 1)
+
+        # Other messages are left to pyp2p.
+        self.bob.net.dht_messages = []
+        self.bob.compact_msg_handler(None, b"foo")
+        self.bob.compact_msg_handler(None, contract_codec.MAGIC + b"foo")
+        self.assertEqual(self.bob.net.dht_messages, [])
+
     def clean_slate(self, client):
         client.contracts = {}
         client.cons = []
@@ -585,12 +620,40 @@ class TestFileHandshake(unittest.TestCase):
         syn["file_size"] = 20
         del syn["signature"]
 
+        # Invalid mux offer.
+        syn[u"mux"] = 2
+        self.assertTrue(is_valid_syn(
+            self.alice, self.alice.sign_contract(syn)) == -11
+        )
+        del syn[u"mux"]
+        del syn["signature"]
+
+        # Invalid offset.
+        syn[u"offset"] = -1
+        self.assertTrue(is_valid_syn(
+            self.alice, self.alice.sign_contract(syn)) == -12
+        )
+        del syn[u"offset"]
+        del syn["signature"]
+
         # We're the host and we don't have this file.
         self.assertTrue(is_valid_syn(
             self.alice, self.alice.sign_contract(syn)) == -8
         )
         del syn["signature"]
 
+        # We're the host and the offset is past the end of the file.
+        path = os.path.join(self.alice_storage, syn[u"data_id"])
+        if not os.path.exists(path):
+            with open(path, "w") as fp:
+                fp.write("0")
+        syn[u"offset"] = 2
+        self.assertTrue(is_valid_syn(
+            self.alice, self.alice.sign_contract(syn)) == -13
+        )
+        del syn[u"offset"]
+        del syn["signature"]
+
         # We're not the host. We're downloading this.
         # and we already have the file.
         syn[u"host_unl"] = self.bob.net.unl.value
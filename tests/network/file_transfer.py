@@ -82,9 +82,7 @@ class TestFileTransfer(unittest.TestCase):
     def test_con_by_contract_id(self):
         contract_id = "something"
         con = 1
-        self.client.con_info[con] = {
-            contract_id: {}
-        }
+        self.client.associate_con(con, contract_id)
 
         assert(self.client.get_con_by_contract_id(contract_id) == con)
 
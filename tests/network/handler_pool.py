@@ -0,0 +1,103 @@
+import time
+import threading
+import unittest
+from storjnode.network.handler_pool import HandlerPool, get_sender
+
+
+SENDER_A = b"a" * 20
+SENDER_B = b"b" * 20
+
+
+class TestHandlerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.mutex = threading.Lock()
+        self.active = {}
+        self.max_active = {}
+        self.handled = []
+
+    def handler(self, key, value, delay=0.02):
+        def func():
+            with self.mutex:
+                self.active[key] = self.active.get(key, 0) + 1
+                self.max_active[key] = max(self.max_active.get(key, 0),
+                                           self.active[key])
+            time.sleep(delay)
+            with self.mutex:
+                self.active[key] -= 1
+                self.handled.append(value)
+        return func
+
+    def test_type_limit(self):
+        pool = HandlerPool(workers=4, limits={"info": 1})
+        for i in range(4):
+            pool.submit("info", None, self.handler("info", i))
+            pool.submit("peers", None, self.handler("peers", i))
+        pool.stop()
+        self.assertEqual(len(self.handled), 8)
+        self.assertEqual(self.max_active["info"], 1)
+        self.assertTrue(self.max_active["peers"] > 1)
+
+    def test_sender_order(self):
+        pool = HandlerPool(workers=4)
+        for i in range(5):
+            pool.submit("info", SENDER_A, self.handler(SENDER_A, ("a", i)))
+            pool.submit("info", SENDER_B, self.handler(SENDER_B, ("b", i)))
+        pool.stop()
+        self.assertEqual(self.max_active[SENDER_A], 1)
+        self.assertEqual(self.max_active[SENDER_B], 1)
+        for sender in ("a", "b"):
+            handled = [i for s, i in self.handled if s == sender]
+            self.assertEqual(handled, list(range(5)))
+
+    def test_busy_sender(self):
+        pool = HandlerPool(workers=2)
+        block = threading.Event()
+        pool.submit("info", SENDER_A, block.wait)
+        for i in range(100):
+            pool.submit("info", SENDER_A, self.handler(SENDER_A, ("a", i), 0))
+        pool.submit("info", SENDER_B, self.handler(SENDER_B, ("b", 0), 0))
+
+        # messages waiting for a busy sender don't hold up other senders
+        time.sleep(0.1)
+        self.assertEqual(self.handled, [("b", 0)])
+        self.assertEqual(pool.pending, 100)
+        block.set()
+        pool.stop()
+        self.assertEqual(self.handled[1:], [("a", i) for i in range(100)])
+
+    def test_stats(self):
+        pool = HandlerPool(workers=1, max_pending=2)
+
+        def fail():
+            raise Exception("Boom!")
+
+        block = threading.Event()
+        self.assertTrue(pool.submit("info", None, block.wait))
+        time.sleep(0.1)  # worker is busy with the first message
+        self.assertTrue(pool.submit("info", None, fail))
+        self.assertTrue(pool.submit("peers", None, lambda: None))
+        self.assertFalse(pool.submit("peers", None, lambda: None))
+
+        stats = pool.get_stats()
+        self.assertEqual(stats["info"]["running"], 1)
+        self.assertEqual(stats["info"]["queued"], 1)
+        self.assertEqual(stats["peers"]["dropped"], 1)
+
+        block.set()
+        pool.stop()
+        stats = pool.get_stats()
+        self.assertEqual(stats["info"]["done"], 2)
+        self.assertEqual(stats["info"]["queued"], 0)
+        self.assertEqual(stats["peers"]["done"], 1)
+        self.assertTrue(stats["peers"]["wait"] > 0.0)
+        self.assertTrue(stats["info"]["max_latency"] >= 0.1)
+
+    def test_get_sender(self):
+        self.assertEqual(get_sender([SENDER_A, 0, "info", [], b""]), SENDER_A)
+        self.assertIsNone(get_sender([["type", "unl_request"]]))
+        self.assertIsNone(get_sender("foo"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,10 @@
+import binascii
 import unittest
 import storjnode
 import btctxstore
+from pycoin.key import Key
 from collections import OrderedDict
+from storjnode.network.message import Signer, Verifier, get_signer
 
 
 class TestNetworkMessage(unittest.TestCase):
@@ -25,6 +28,62 @@ class TestNetworkMessage(unittest.TestCase):
             signed_msg, self.wif, node_id
         ))
 
+    def test_same_as_btctxstore(self):
+        uncompressed = Key(secret_exponent=1234567,
+                           prefer_uncompressed=True).wif()
+        for wif in (self.wif, uncompressed):
+            signer = Signer(wif)
+            self.assertEqual(signer.address, self.btctxstore.get_address(wif))
+            for data in (b"", b"foo", b"bar" * 1000):
+                sig = signer.sign_data(data)
+                hexdata = binascii.hexlify(data)
+                self.assertEqual(sig, self.btctxstore.sign_data(wif, hexdata))
+                self.assertTrue(self.btctxstore.verify_signature(
+                    signer.address, sig, hexdata
+                ))
+
+    def test_sign_same_as_btctxstore(self):
+        msg = OrderedDict([(u"type", u"test"), (u"data", u"foo")])
+        signed = storjnode.network.message.sign(msg.copy(), self.wif)
+        hexdata = binascii.hexlify(str(msg).encode("ascii"))
+        sig = self.btctxstore.sign_data(self.wif, hexdata)
+        self.assertEqual(signed[u"signature"], sig.decode("utf-8"))
+        address = self.btctxstore.get_address(self.wif)
+        self.assertTrue(self.btctxstore.verify_signature(
+            address, signed[u"signature"], hexdata
+        ))
+
+    def test_verifier(self):
+        verifier = Verifier(cache_size=1)
+        signer = Signer(self.wif)
+        other = Signer(self.btctxstore.create_key())
+        sig = signer.sign_data(b"foo")
+        self.assertTrue(verifier.verify_data(signer.address, sig, b"foo"))
+        self.assertFalse(verifier.verify_data(signer.address, sig, b"b"))
+        self.assertFalse(verifier.verify_data(
+            signer.address, other.sign_data(b"foo"), b"foo"
+        ))
+
+        # wrong recovery parameter is still rejected
+        rawsig = bytearray(binascii.a2b_base64(sig))
+        rawsig[0] ^= 1
+        badsig = binascii.b2a_base64(bytes(rawsig)).strip()
+        self.assertFalse(verifier.verify_data(signer.address, badsig, b"foo"))
+        self.assertFalse(verifier.verify_data(signer.address, b"foo", b"foo"))
+
+        # bounded cache
+        verifier.get_address(signer.node_id)
+        verifier.get_address(other.node_id)
+        self.assertEqual(verifier.get_address(other.node_id), other.address)
+        self.assertEqual(list(verifier.addresses), [other.node_id])
+
+    def test_get_signer(self):
+        signer = get_signer(self.wif)
+        self.assertIs(get_signer(self.wif), signer)
+        self.assertEqual(signer.node_id, storjnode.util.address_to_node_id(
+            self.btctxstore.get_address(self.wif)
+        ))
+
 
 if __name__ == "__main__":
     unittest.main()
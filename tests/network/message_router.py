@@ -0,0 +1,72 @@
+import unittest
+import umsgpack
+import btctxstore
+from collections import OrderedDict
+from storjnode.util import ordered_dict_to_list
+from storjnode.network.messages import info
+from storjnode.network.messages import signal
+from storjnode.network.message_router import classify, MessageRouter
+
+
+class TestMessageRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.btctxstore = btctxstore.BtcTxStore(testnet=False, dryrun=True)
+        self.wif = self.btctxstore.create_key()
+
+    def repack(self, message):
+        # eliminate namedtuples and simulate io
+        return umsgpack.unpackb(umsgpack.packb(message))
+
+    def test_classify(self):
+        msg = signal.create(self.btctxstore, self.wif, "request_info")
+        self.assertEqual(classify(self.repack(msg)), "signal:request_info")
+
+        capacity = {"total": 0, "used": 0, "free": 0}
+        msg = info.create(self.btctxstore, self.wif, capacity,
+                          ["127.0.0.1", 1234], "unl", True)
+        self.assertEqual(classify(self.repack(msg)), "info")
+
+        msg = ordered_dict_to_list(OrderedDict([
+            (u"type", u"unl_request"),
+            (u"requester", u"address")
+        ]))
+        self.assertEqual(classify(msg), u"unl_request")
+
+        msg = ordered_dict_to_list(OrderedDict([
+            (u"status", u"SYN"),
+            (u"data_id", u"0" * 64)
+        ]))
+        self.assertEqual(classify(msg), u"SYN")
+
+        self.assertIsNone(classify(None))
+        self.assertIsNone(classify(b"REVERSE_CONNECT"))
+        self.assertIsNone(classify([1, 2, 3]))
+
+    def test_get_handlers(self):
+        router = MessageRouter()
+
+        def catch_all(node, msg):
+            pass
+
+        def unl_handler(node, msg):
+            pass
+
+        router.add(catch_all)
+        router.add(unl_handler, types=["unl_request", "unl_response"])
+        self.assertEqual(len(router), 2)
+
+        msg = [[u"type", u"unl_response"]]
+        self.assertEqual(set(router.get_handlers(msg)),
+                         set([catch_all, unl_handler]))
+        msg = [[u"type", u"test_bandwidth_request"]]
+        self.assertEqual(router.get_handlers(msg), [catch_all])
+
+        router.remove(unl_handler)
+        self.assertEqual(router.get_handlers([[u"type", u"unl_request"]]),
+                         [catch_all])
+        self.assertRaises(KeyError, router.remove, unl_handler)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -99,6 +99,32 @@ class TestNetworkMessagesBase(unittest.TestCase):
 
         self.assertIsNone(base.read(self.btctxstore, repacked))
 
+    def test_read_cached(self):
+        base.verdict_cache.clear()
+        created = base.create(self.btctxstore, self.wif, "token", "body")
+        repacked = umsgpack.unpackb(umsgpack.packb(created))
+        invalid = list(repacked)
+        invalid[4] = b"x" * 65
+
+        # each message is verified once
+        for i in range(3):
+            self.assertIsNotNone(base.read(self.btctxstore, repacked))
+            self.assertIsNone(base.read(self.btctxstore, invalid))
+        info = base.verdict_cache.info()
+        self.assertEqual(info["misses"], 2)
+        self.assertEqual(info["hits"], 4)
+        self.assertEqual(info["size"], 2)
+
+    def test_verdict_cache_lru(self):
+        cache = base.VerdictCache(max_size=2)
+        cache.set("a", True)
+        cache.set("b", False)
+        self.assertTrue(cache.get("a"))  # b is now least recently used
+        cache.set("c", True)
+        self.assertIsNone(cache.get("b"))
+        self.assertFalse(cache.get("c") is None)
+        self.assertEqual(cache.info()["size"], 2)
+
 
 if __name__ == "__main__":
     unittest.main()
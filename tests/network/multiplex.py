@@ -0,0 +1,243 @@
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+import unittest
+import btctxstore
+import pyp2p
+import storjnode
+from storjnode.util import address_to_node_id
+from storjnode.network.file_transfer import FileTransfer
+from storjnode.network import file_handshake
+from storjnode.network.file_handshake import success_wrapper
+from storjnode.network.process_transfers import process_con
+from storjnode.network.bandwidth.limit import BandwidthLimit
+from storjnode.network.multiplex import MUX_DATA, MUX_WINDOW
+from storjnode.network.multiplex import MUX_FRAME_SIZE, HEADER
+from storjnode.network.multiplex import FramingError, MuxConnection
+from storjnode.network.multiplex import encode_frame, parse_frames
+
+
+CONTRACT_ID = u"ab" * 32
+
+
+class PipeCon(object):
+    """In memory connection, send() delivers to the peers recv()."""
+
+    def __init__(self):
+        self.peer = None
+        self.inbox = b""
+        self.connected = 1
+        self.alive = time.time()
+        self.s = None
+
+    def send(self, msg, send_all=0):
+        bytes_sent = min(len(msg), 100000)
+        self.peer.inbox += msg[:bytes_sent]
+        return bytes_sent
+
+    def recv(self, n, encoding="unicode"):
+        data = self.inbox[:n]
+        self.inbox = self.inbox[n:]
+        return data
+
+    def close(self):
+        self.connected = 0
+
+
+class TestFraming(unittest.TestCase):
+
+    def test_parse_frames(self):
+        buf = encode_frame(CONTRACT_ID, MUX_DATA, b"foo")
+        buf += encode_frame(CONTRACT_ID, MUX_WINDOW, b"\0\0\0\0")
+        frames, rest = parse_frames(buf + buf[:HEADER.size + 1])
+        self.assertEqual(frames, [
+            (CONTRACT_ID, MUX_DATA, b"foo"),
+            (CONTRACT_ID, MUX_WINDOW, b"\0\0\0\0")
+        ])
+        self.assertEqual(rest, buf[:HEADER.size + 1])
+
+    def test_frame_too_large(self):
+        def callback():
+            encode_frame(CONTRACT_ID, MUX_DATA, b"0" * (MUX_FRAME_SIZE + 1))
+        self.assertRaises(FramingError, callback)
+
+        header = HEADER.pack(b"0" * 32, MUX_DATA, MUX_FRAME_SIZE + 1)
+        self.assertRaises(FramingError, parse_frames, header)
+
+    def test_invalid_type(self):
+        header = HEADER.pack(b"0" * 32, 42, 0)
+        self.assertRaises(FramingError, parse_frames, header)
+
+    def test_rotate(self):
+        mux = MuxConnection()
+        mux.get_stream(u"a")
+        mux.get_stream(u"b")
+        mux.rotate(u"a")
+        self.assertEqual(list(mux.streams), [u"b", u"a"])
+
+
+class TestMultiplexedTransfers(unittest.TestCase):
+
+    def setUp(self):
+        self.test_storage_dir = tempfile.mkdtemp()
+        self.alice = self.create_client("alice", 60610)
+        self.bob = self.create_client("bob", 60611)
+
+    def tearDown(self):
+        self.alice.net.stop()
+        self.bob.net.stop()
+        shutil.rmtree(self.test_storage_dir)
+
+    def create_client(self, name, port):
+        wallet = btctxstore.BtcTxStore(testnet=False, dryrun=True)
+        wif = wallet.get_key(wallet.create_wallet())
+        node_id = address_to_node_id(wallet.get_address(wif))
+        dht_node = pyp2p.dht_msg.DHT(node_id=node_id, networking=0)
+        store_path = os.path.join(self.test_storage_dir, name)
+        return FileTransfer(
+            pyp2p.net.Net(
+                node_type="simultaneous",
+                nat_type="preserving",
+                net_type="direct",
+                passive_port=port,
+                dht_node=dht_node,
+                wan_ip="8.8.8.8",
+                debug=1
+            ),
+            BandwidthLimit(),
+            wif=wif,
+            store_config={store_path: {"limit": 0}}
+        )
+
+    def add_contract(self, size, resume=0):
+        # Alice hosts a shard that bob downloads.
+        data = os.urandom(size)
+        data_id = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.test_storage_dir, data_id)
+        with open(path, "wb") as fobj:
+            fobj.write(data)
+        with open(path, "rb") as shard:
+            storjnode.storage.manager.add(self.alice.store_config, shard)
+
+        contract = {
+            u"data_id": data_id,
+            u"file_size": 0,
+            u"host_unl": self.alice.net.unl.value,
+            u"src_unl": self.bob.net.unl.value,
+            u"dest_unl": self.alice.net.unl.value,
+            u"mux": 1
+        }
+
+        # Bob already has the start of the shard.
+        if resume:
+            with open(self.bob.get_partial_path(data_id), "wb") as fobj:
+                fobj.write(data[:resume])
+            contract[u"offset"] = self.bob.get_partial_size(data_id)
+
+        contract_id = self.alice.contract_id(contract)
+        for client in (self.alice, self.bob):
+            client.contracts[contract_id] = contract
+            client.mux_contracts.add(contract_id)
+
+        return contract_id, data_id
+
+    def test_parallel_transfers(self):
+        alice_con, bob_con = PipeCon(), PipeCon()
+        alice_con.peer, bob_con.peer = bob_con, alice_con
+
+        big_contract_id, big_data_id = self.add_contract(1024 * 1024 * 3)
+        small_contract_id, small_data_id = self.add_contract(1024)
+
+        completed = []
+
+        def complete_handler(client, contract_id, con):
+            completed.append(contract_id)
+        self.bob.add_handler("complete", complete_handler)
+
+        # Big transfer is queued first.
+        host_unl = self.alice.net.unl.value
+        for contract_id in (big_contract_id, small_contract_id):
+            success_wrapper(self.alice, contract_id, host_unl)(alice_con)
+            success_wrapper(self.bob, contract_id, host_unl)(bob_con)
+        self.assertIn(alice_con, self.alice.con_mux)
+        self.assertIn(bob_con, self.bob.con_mux)
+
+        for i in range(1000):
+            process_con(self.alice, alice_con)
+            process_con(self.bob, bob_con)
+            if not self.bob.is_queued():
+                break
+
+        # Small transfer wasn't stuck behind the big one.
+        self.assertEqual(completed, [small_contract_id, big_contract_id])
+        for data_id in (big_data_id, small_data_id):
+            path = storjnode.storage.manager.find(self.bob.store_config,
+                                                  data_id)
+            self.assertIsNotNone(path)
+        self.assertFalse(self.alice.is_queued())
+        self.assertTrue(bob_con.connected)
+
+    def test_resume(self):
+        alice_con, bob_con = PipeCon(), PipeCon()
+        alice_con.peer, bob_con.peer = bob_con, alice_con
+        resume = 1024 * 100
+        contract_id, data_id = self.add_contract(1024 * 200, resume)
+
+        host_unl = self.alice.net.unl.value
+        success_wrapper(self.alice, contract_id, host_unl)(alice_con)
+        success_wrapper(self.bob, contract_id, host_unl)(bob_con)
+        for i in range(100):
+            process_con(self.alice, alice_con)
+            process_con(self.bob, bob_con)
+            if not self.bob.is_queued():
+                break
+
+        # Only the rest of the shard was sent.
+        self.assertIsNotNone(storjnode.storage.manager.find(
+            self.bob.store_config, data_id
+        ))
+        mux = self.alice.con_mux[alice_con]
+        self.assertTrue(mux.bytes_sent < 1024 * 200 - resume + 1024)
+        self.assertFalse(os.path.exists(self.bob.get_partial_path(data_id)))
+
+    def test_open_partial(self):
+        data_id = hashlib.sha256(b"foo").hexdigest()
+        self.assertEqual(self.bob.get_partial_size(data_id), 0)
+        path = self.bob.open_partial(data_id)
+        with open(path, "ab") as fobj:
+            fobj.write(b"foobar")
+        self.assertEqual(self.bob.get_partial_size(data_id), 6)
+
+        # Resuming discards data after the offset.
+        self.bob.open_partial(data_id, 3)
+        with open(path, "rb") as fobj:
+            self.assertEqual(fobj.read(), b"foo")
+
+        # Missing data isn't padded, the download starts over.
+        self.assertIsNone(self.bob.open_partial(data_id, 4))
+        self.assertEqual(self.bob.get_partial_size(data_id), 0)
+        self.assertEqual(self.bob.open_partial(data_id), path)
+
+    def test_discard_partial(self):
+        contract_id, data_id = self.add_contract(1024, resume=100)
+        self.bob.downloading[data_id] = self.bob.open_partial(data_id, 100)
+        path = self.bob.get_partial_path(data_id)
+
+        # Kept for the next attempt if downloads are resumed.
+        file_handshake.ENABLE_RESUME_TRANSFERS = 1
+        try:
+            self.bob.discard_partial(data_id)
+        finally:
+            file_handshake.ENABLE_RESUME_TRANSFERS = 0
+        self.assertTrue(os.path.exists(path))
+
+        # Removed when the download is abandoned otherwise.
+        self.bob.cleanup_transfers(None, contract_id)
+        self.assertNotIn(data_id, self.bob.downloading)
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -350,6 +350,18 @@ class TestNode(unittest.TestCase):
             found_value = random_peer[key]
             self.assertEqual(found_value, inserted_value)
 
+    def test_set_get_many(self):
+        inserted = dict([
+            ("many_{0}".format(i), "value_{0}".format(i)) for i in range(5)
+        ])
+        stored = random.choice(self.swarm).set_many(inserted)
+        self.assertEqual(stored, dict((k, True) for k in inserted))
+
+        random_peer = random.choice(self.swarm)
+        found = random_peer.get_many(list(inserted.keys()) + ["missing"],
+                                     default="default")
+        self.assertEqual(found, dict(inserted, missing="default"))
+
     ########################
     # test network mapping #
     ########################
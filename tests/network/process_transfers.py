@@ -10,6 +10,7 @@ import unittest
 import shutil
 import time
 import hashlib
+import socket
 from twisted.internet import defer
 from storjnode.network.process_transfers import get_contract_id
 from storjnode.network.process_transfers import cleanup_cons
@@ -17,6 +18,9 @@ from storjnode.network.process_transfers import expire_handshakes
 from storjnode.network.process_transfers import do_upload
 from storjnode.network.process_transfers import do_download
 from storjnode.network.process_transfers import process_dht_messages
+from storjnode.network.process_transfers import can_sendfile
+from storjnode.network.process_transfers import sendfile_chunk
+from storjnode.network.shard_io import UploadSourceCache
 from storjnode.network.bandwidth.limit import BandwidthLimit
 from storjnode.config import ConfigFile
 from pyp2p.sock import Sock
@@ -84,13 +88,40 @@ class TestProcessTransfers(unittest.TestCase):
     def test_expired_handshake(self):
         contract_id = "something"
         self.client.contracts[contract_id] = {}
-        self.client.handshake[contract_id] = {
-            "timestamp": time.time() - 10000
-        }
+        self.client.set_handshake(contract_id, u"SYN", time.time() - 10000)
         self.client.defers[contract_id] = defer.Deferred()
         expire_handshakes(self.client)
         self.assertTrue(contract_id not in self.client.defers)
 
+    def test_superseded_handshake(self):
+        contract_id = "something"
+        self.client.contracts[contract_id] = {}
+        self.client.set_handshake(contract_id, u"SYN", time.time() - 10000)
+        self.client.set_handshake(contract_id, u"ACK")
+        self.client.defers[contract_id] = defer.Deferred()
+        expire_handshakes(self.client)
+        self.assertTrue(contract_id in self.client.defers)
+        self.assertEqual(len(self.client.handshake_deadlines), 1)
+
+    def test_con_queues(self):
+        con = Sock()
+        self.assertEqual(self.client.is_queued(), 0)
+        self.client.associate_con(con, "first")
+        self.client.associate_con(con, "second")
+        self.assertEqual(self.client.is_queued(con), 1)
+        self.assertIs(self.client.get_con_by_contract_id("second"), con)
+        self.assertEqual(list(self.client.con_queues[con]),
+                         ["first", "second"])
+
+        self.client.dequeue_contract(con, "first")
+        self.assertEqual(self.client.is_queued(con), 1)
+        self.client.dequeue_contract(con, "second")
+        self.assertEqual(self.client.is_queued(), 0)
+
+        self.client.cleanup_transfers(con, "first")
+        self.assertIsNone(self.client.get_con_by_contract_id("first"))
+        self.assertIsNone(self.client.get_con_by_contract_id("second"))
+
     def test_do_upload(self):
         contract = {
             "data_id": hashlib.sha256(b"0").hexdigest()
@@ -157,5 +188,54 @@ class TestProcessTransfers(unittest.TestCase):
         process_dht_messages(None)
 
 
+class MockCon(object):
+
+    def __init__(self, s):
+        self.s = s
+        self.connected = 1
+        self.alive = 0
+
+    def close(self):
+        self.connected = 0
+
+
+@unittest.skipIf(not hasattr(os, "sendfile"), "sendfile not supported")
+class TestSendfile(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, b"foobar")
+        os.close(fd)
+        self.client = MockClient()
+        self.client.upload_sources = UploadSourceCache()
+        self.client.upload_sources.add("contract_id", self.path)
+        self.sender, self.receiver = socket.socketpair()
+
+    def tearDown(self):
+        self.client.upload_sources.remove("contract_id")
+        self.sender.close()
+        self.receiver.close()
+        os.remove(self.path)
+
+    def test_sendfile_chunk(self):
+        con = MockCon(self.sender)
+        self.assertTrue(can_sendfile(con))
+        sent = sendfile_chunk(self.client, con, "contract_id", 3, 1024)
+        self.assertEqual(sent, 3)
+        self.assertEqual(self.receiver.recv(1024), b"bar")
+        self.assertTrue(con.alive)
+
+    def test_closed_con(self):
+        con = MockCon(self.sender)
+        con.connected = 0
+        self.assertEqual(
+            sendfile_chunk(self.client, con, "contract_id", 0, 1024), 0
+        )
+
+
+class MockClient(object):
+    pass
+
+
 if __name__ == "__main__":
     unittest.main()
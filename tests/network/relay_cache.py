@@ -0,0 +1,255 @@
+import os
+import unittest
+from twisted.internet import defer
+from kademlia.node import Node as KademliaNode
+from kademlia.storage import ForgetfulStorage
+from storjnode.common import MAX_PACKAGE_DATA
+from storjnode.network.protocol import Protocol
+from storjnode.network.relay_cache import RelayCache
+from storjnode.network.server import Server, MessageRelayer, BatchRelayer
+from storjnode.network.server import split_batches, get_batch_size
+
+
+def make_node(first_byte):
+    return KademliaNode(bytes(bytearray([first_byte] + [0] * 19)))
+
+
+class MockRouter(object):
+
+    def __init__(self, neighbours):
+        self.neighbours = neighbours
+        self.lookups = 0
+
+    def findNeighbors(self, node, exclude=None):
+        self.lookups += 1
+        return sorted(self.neighbours, key=node.distanceTo)
+
+
+class MockProtocol(object):
+
+    def __init__(self, neighbours, dead):
+        self.router = MockRouter(neighbours)
+        self.dead = dead
+        self.calls = []
+        self.batches = []
+        self.batch_result = None
+
+    def callRelayMessage(self, node, dest_id, hop_limit, message):
+        self.calls.append(node.id)
+        if node.id in self.dead:
+            return defer.succeed((False, None))  # timeout
+        return defer.succeed((True, ("127.0.0.1", 1234)))
+
+    def callRelayMessages(self, node, entries):
+        self.batches.append((node.id, entries))
+        return defer.succeed(self.batch_result)
+
+
+class MockServer(object):
+
+    def __init__(self, neighbours, dead):
+        self.node = make_node(0xff)
+        self.relay_cache = RelayCache()
+        self.protocol = MockProtocol(neighbours, dead)
+
+    def get_address(self):
+        return "mock"
+
+    get_next_hop = Server.__dict__["get_next_hop"]
+    _relay_batched = Server.__dict__["_relay_batched"].wrapped_function
+
+
+class TestRelayCache(unittest.TestCase):
+
+    def test_hop(self):
+        cache = RelayCache(hop_ttl=10)
+        hop = make_node(1)
+        dest = b"\x01\x02" + b"\x00" * 18
+        same_prefix = b"\x01\x02" + b"\xff" * 18
+        self.assertIsNone(cache.get_hop(dest, now=100))
+        cache.set_hop(dest, hop, now=100)
+        self.assertEqual(cache.get_hop(same_prefix, now=105).id, hop.id)
+        self.assertIsNone(cache.get_hop(b"\x01\x03" + b"\x00" * 18, now=105))
+        self.assertIsNone(cache.get_hop(dest, now=110))  # expired
+        self.assertEqual(cache.info()["hits"], 1)
+        self.assertEqual(cache.info()["misses"], 3)
+
+    def test_forget_hop(self):
+        cache = RelayCache()
+        dest = make_node(1).id
+        cache.set_hop(dest, make_node(2))
+        cache.forget_hop(dest, make_node(3))  # other hop
+        self.assertIsNotNone(cache.get_hop(dest))
+        cache.forget_hop(dest, make_node(2))
+        self.assertIsNone(cache.get_hop(dest))
+
+    def test_failed(self):
+        cache = RelayCache(failed_ttl=10)
+        dead, alive = make_node(1), make_node(2)
+        cache.set_hop(dead.id, dead, now=100)
+        cache.mark_failed(dead, now=100)
+        self.assertIsNone(cache.get_hop(dead.id, now=101))
+        result = cache.filter_failed([dead, alive], now=101)
+        self.assertEqual([n.id for n in result], [alive.id])
+        result = cache.filter_failed([dead, alive], now=110)
+        self.assertEqual(len(result), 2)
+        self.assertEqual(cache.info()["skipped"], 1)
+
+        # responding again clears the failure
+        cache.mark_failed(alive, now=110)
+        cache.set_hop(alive.id, alive, now=111)
+        self.assertEqual(len(cache.filter_failed([alive], now=112)), 1)
+
+    def test_unbatched(self):
+        cache = RelayCache(unbatched_ttl=10)
+        node = make_node(1)
+        self.assertFalse(cache.is_unbatched(node, now=100))
+        cache.mark_unbatched(node, now=100)
+        self.assertTrue(cache.is_unbatched(node, now=109))
+        self.assertFalse(cache.is_unbatched(node, now=110))
+        cache.mark_unbatched(make_node(2), now=110)  # expired removed
+        self.assertEqual(cache.info()["unbatched"], 1)
+
+    def test_max_size(self):
+        cache = RelayCache(max_size=2)
+        hop = make_node(1)
+        for i in range(3):
+            cache.set_hop(make_node(i).id, hop)
+        self.assertEqual(cache.info()["hops"], 2)
+        self.assertIsNone(cache.get_hop(make_node(0).id))
+
+
+class TestMessageRelayer(unittest.TestCase):
+
+    def relay(self, server, dest):
+        MessageRelayer(server, dest.id, 64, u"foo").relay()
+
+    def test_relay(self):
+        dead, alive, far = make_node(0x01), make_node(0x03), make_node(0x70)
+        server = MockServer([dead, alive, far], set([dead.id]))
+        dest = make_node(0x00)
+
+        # first message tries the dead peer, then the next nearest
+        self.relay(server, dest)
+        self.assertEqual(server.protocol.calls, [dead.id, alive.id])
+        self.assertEqual(server.protocol.router.lookups, 1)
+
+        # repeat traffic goes to the known good next hop directly
+        del server.protocol.calls[:]
+        self.relay(server, dest)
+        self.relay(server, make_node(0x00))
+        self.assertEqual(server.protocol.calls, [alive.id, alive.id])
+        self.assertEqual(server.protocol.router.lookups, 1)
+
+        # other destinations skip the dead peer
+        del server.protocol.calls[:]
+        self.relay(server, make_node(0x02))
+        self.assertEqual(server.protocol.calls, [alive.id])
+
+    def test_cached_hop_fails(self):
+        a, b = make_node(0x01), make_node(0x03)
+        server = MockServer([a, b], set())
+        dest = make_node(0x00)
+        self.relay(server, dest)
+        self.assertEqual(server.protocol.calls, [a.id])
+
+        # cached hop dies, falls back to a lookup without it
+        server.protocol.dead.add(a.id)
+        del server.protocol.calls[:]
+        self.relay(server, dest)
+        self.assertEqual(server.protocol.calls, [a.id, b.id])
+        self.assertEqual(server.relay_cache.get_hop(dest.id).id, b.id)
+
+
+class TestRelayBatching(unittest.TestCase):
+
+    def make_entries(self, count, size=20):
+        return [{"dest": os.urandom(20), "hop_limit": 64,
+                 "message": os.urandom(size)} for i in range(count)]
+
+    def test_split_batches(self):
+        sender_id = os.urandom(20)
+        entries = self.make_entries(40)
+        batches = split_batches(sender_id, entries)
+        self.assertTrue(len(batches) > 1)
+        self.assertEqual(sum(batches, []), entries)
+        for batch in batches:
+            items = [[e["dest"], e["hop_limit"], e["message"]] for e in batch]
+            self.assertTrue(get_batch_size(sender_id, items) <=
+                            MAX_PACKAGE_DATA)
+
+        # messages too large to share a datagram are sent alone
+        entries = self.make_entries(3, size=400)
+        self.assertEqual(split_batches(sender_id, entries),
+                         [[e] for e in entries])
+
+    def test_batch_relayed(self):
+        hop = make_node(0x01)
+        server = MockServer([hop], set())
+        server.protocol.batch_result = (True, [True, True])
+        entries = self.make_entries(2)
+        BatchRelayer(server, hop, entries).start()
+        self.assertEqual(len(server.protocol.batches), 1)
+        self.assertEqual(server.protocol.calls, [])
+        for entry in entries:
+            self.assertEqual(server.relay_cache.get_hop(entry["dest"]).id,
+                             hop.id)
+
+    def test_batch_refused(self):
+        hop, other = make_node(0x01), make_node(0x02)
+        server = MockServer([hop, other], set())
+        server.protocol.batch_result = (True, [True, False])
+        entries = self.make_entries(2)
+        for entry in entries:
+            entry["dest"] = make_node(0x00).id
+        BatchRelayer(server, hop, entries).start()
+        self.assertEqual(server.protocol.calls, [other.id])  # not hop again
+
+    def test_batch_no_response(self):
+        hop = make_node(0x01)
+        server = MockServer([hop], set())
+        server.protocol.batch_result = (False, None)
+        entries = self.make_entries(2)
+        for entry in entries:
+            entry["dest"] = make_node(0x00).id
+        BatchRelayer(server, hop, entries).start()
+        self.assertEqual(server.protocol.calls, [hop.id, hop.id])
+        self.assertTrue(server.relay_cache.is_unbatched(hop))
+
+    def test_unbatched_hop(self):
+        hop = make_node(0x01)
+        server = MockServer([hop], set())
+        server.protocol.batch_result = (False, None)
+        entries = self.make_entries(2)
+        for entry in entries:
+            entry["dest"] = make_node(0x00).id
+        server._relay_batched(entries)
+        self.assertEqual(len(server.protocol.batches), 1)
+
+        # the hop didn't answer the batch, it is sent single messages
+        server._relay_batched(entries)
+        self.assertEqual(len(server.protocol.batches), 1)
+        self.assertEqual(server.protocol.calls, [hop.id] * 4)
+
+    def test_rpc_relay_messages(self):
+        node = make_node(0x00)
+        protocol = Protocol(node, ForgetfulStorage(), 20, max_messages=16,
+                            max_hop_limit=64)
+        sender = ("127.0.0.1", 1234)
+        sender_id = make_node(0xff).id
+        entries = [
+            [node.id, 64, u"for me"],
+            [make_node(0x01).id, 64, u"relay"],
+            [make_node(0x01).id, 0, u"bad hop limit"],
+            [u"malformed"],
+        ]
+        result = protocol.rpc_relay_messages(sender, sender_id, entries)
+        self.assertEqual(result, [True, True, False, False])
+        self.assertEqual(protocol.get_messages(), [u"for me"])
+        self.assertEqual(protocol.messages_relay.qsize(), 1)
+        self.assertIsNone(protocol.rpc_relay_messages(sender, sender_id,
+                                                      u"foo"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import time
+import unittest
+from storjnode.network.repeat_relay import RepeatRelay, RELAY_EXPIRY
+from storjnode.network.repeat_relay import cancel_relay
+
+
+class MockNode(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def relay_message(self, node_id, msg):
+        self.sent.append((node_id, msg))
+
+
+class TestRepeatRelay(unittest.TestCase):
+
+    def setUp(self):
+        self.node = MockNode()
+        self.repeat_relay = RepeatRelay(self.node)
+        self.repeat_relay.stop()  # drive rebroadcasts by hand
+        self.repeat_relay.t.join()
+
+    def rebroadcast_until(self, start, end):
+        for elapsed in range(end + 1):
+            self.repeat_relay.rebroadcast(now=start + elapsed)
+
+    def test_backoff(self):
+        relay_id = self.repeat_relay.relay(b"0" * 20, u"foo")
+        start = time.time()
+        self.assertEqual(len(self.node.sent), 1)
+
+        self.rebroadcast_until(start, 10)
+        self.assertEqual(len(self.node.sent), 4)  # after 1, 3 and 7 seconds
+
+        self.rebroadcast_until(start, RELAY_EXPIRY * 2)
+        self.assertEqual(len(self.node.sent), 7)  # until 63 seconds
+        self.assertEqual(self.repeat_relay.relaying, {})
+        self.assertFalse(self.repeat_relay.cancel(relay_id))
+
+    def test_cancel(self):
+        relay_id = self.repeat_relay.relay(b"0" * 20, u"foo")
+        other_id = self.repeat_relay.relay(b"1" * 20, u"bar")
+        start = time.time()
+        self.rebroadcast_until(start, 1)
+        self.assertEqual(len(self.node.sent), 4)
+
+        self.assertTrue(self.repeat_relay.cancel(relay_id))
+        self.rebroadcast_until(start, RELAY_EXPIRY)
+        foo = [m for m in self.node.sent if m[1] == u"foo"]
+        bar = [m for m in self.node.sent if m[1] == u"bar"]
+        self.assertEqual(len(foo), 2)
+        self.assertEqual(len(bar), 7)
+        self.assertEqual(self.repeat_relay.schedule, [])
+
+        # Cancel using the api of a node.
+        class MockApi(object):
+            def cancel_repeat_relay(api, relay_id):
+                api.cancelled = relay_id
+        api = MockApi()
+        cancel_relay(api, other_id)
+        self.assertEqual(api.cancelled, other_id)
+        cancel_relay(object(), other_id)  # api can't cancel
+
+
+if __name__ == "__main__":
+    unittest.main()
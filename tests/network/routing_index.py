@@ -0,0 +1,105 @@
+import os
+import random
+import unittest
+from kademlia.node import Node as KademliaNode
+from storjnode.network.routing_index import RoutingIndex, IndexedRoutingTable
+
+
+class MockProtocol(object):
+
+    def callPing(self, node):
+        pass
+
+
+def random_node(port=1234):
+    return KademliaNode(os.urandom(20), "127.0.0.1", port)
+
+
+def brute_force(nodes, target, k):
+    return sorted(nodes, key=lambda n: n.long_id ^ target.long_id)[:k]
+
+
+def ids(nodes):
+    return [n.id for n in nodes]
+
+
+class TestRoutingIndex(unittest.TestCase):
+
+    def test_nearest(self):
+        index = RoutingIndex()
+        nodes = [random_node() for i in range(500)]
+        for node in nodes:
+            index.add(node)
+        self.assertEqual(len(index), 500)
+        for i in range(50):
+            target = random.choice([random_node(), random.choice(nodes)])
+            for k in (1, 20, 600):
+                self.assertEqual(ids(index.nearest(target.long_id, k)),
+                                 ids(brute_force(nodes, target, k)))
+
+    def test_exclude(self):
+        index = RoutingIndex()
+        nodes = [random_node(port=i % 3) for i in range(300)]
+        for node in nodes:
+            index.add(node)
+        target = random_node()
+        result = index.nearest(target.long_id, 20,
+                               exclude=lambda n: n.port != 0)
+        expected = brute_force([n for n in nodes if n.port == 0], target, 20)
+        self.assertEqual(ids(result), ids(expected))
+
+        # fewer nodes left than requested
+        result = index.nearest(target.long_id, 20,
+                               exclude=lambda n: n is not nodes[0])
+        self.assertEqual(ids(result), [nodes[0].id])
+
+    def test_add_remove(self):
+        index = RoutingIndex()
+        node = random_node()
+        index.add(node)
+        moved = KademliaNode(node.id, "127.0.0.2", 4321)
+        index.add(moved)  # same id, new address
+        self.assertEqual(len(index), 1)
+        self.assertIs(index.nearest(node.long_id, 1)[0], moved)
+        index.remove(node)
+        index.remove(node)
+        self.assertEqual(len(index), 0)
+        self.assertFalse(node in index)
+        self.assertEqual(index.nearest(node.long_id, 20), [])
+
+
+class TestIndexedRoutingTable(unittest.TestCase):
+
+    def test_in_sync_with_buckets(self):
+        table = IndexedRoutingTable(MockProtocol(), 20, random_node())
+        added = []
+        for i in range(2000):
+            node = random_node()
+            table.addContact(node)
+            added.append(node)
+            if i % 3 == 0:  # promotes replacement nodes
+                table.removeContact(random.choice(added))
+
+        contacts = [n for b in table.buckets for n in b.getNodes()]
+        self.assertEqual(sorted(ids(contacts)),
+                         sorted(ids(table.index.nodes.values())))
+
+        target = random_node()
+        self.assertEqual(ids(table.findNeighbors(target)),
+                         ids(brute_force(contacts, target, 20)))
+
+        table.flush()
+        self.assertEqual(len(table.index), 0)
+
+    def test_exclude_home(self):
+        me = random_node(port=1)
+        table = IndexedRoutingTable(MockProtocol(), 20, me)
+        for i in range(10):
+            table.addContact(random_node(port=i % 2))
+        result = table.findNeighbors(me, exclude=random_node(port=0))
+        self.assertEqual(len(result), 5)
+        self.assertTrue(all(n.port == 1 for n in result))
+
+
+if __name__ == "__main__":
+    unittest.main()
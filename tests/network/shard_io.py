@@ -0,0 +1,76 @@
+import os
+import hashlib
+import tempfile
+import unittest
+from storjnode.network.shard_io import DownloadSink, UploadSourceCache
+
+
+class TestDownloadSink(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_hash_while_writing(self):
+        sink = DownloadSink(self.path)
+        sink.write(b"foo")
+        sink.write(b"bar")
+        sink.close()
+        self.assertEqual(sink.size, 6)
+        self.assertEqual(sink.hexdigest(),
+                         hashlib.sha256(b"foobar").hexdigest())
+        with open(self.path, "rb") as fobj:
+            self.assertEqual(fobj.read(), b"foobar")
+
+    def test_existing_data(self):
+        with open(self.path, "wb") as fobj:
+            fobj.write(b"foo")
+        sink = DownloadSink(self.path)
+        sink.write(b"bar")
+        sink.close()
+        self.assertEqual(sink.hexdigest(),
+                         hashlib.sha256(b"foobar").hexdigest())
+
+
+class TestUploadSourceCache(unittest.TestCase):
+
+    def setUp(self):
+        self.paths = []
+        for data in [b"foobar", b"bazqux"]:
+            fd, path = tempfile.mkstemp()
+            os.write(fd, data)
+            os.close(fd)
+            self.paths.append(path)
+
+    def tearDown(self):
+        for path in self.paths:
+            os.remove(path)
+
+    def test_read(self):
+        cache = UploadSourceCache()
+        source = cache.add("a", self.paths[0])
+        self.assertEqual(source.size, 6)
+        self.assertEqual(cache.read("a", 3, 2), b"ba")
+        self.assertEqual(cache.read("a", 4, 1024), b"ar")
+        cache.remove("a")
+        self.assertNotIn("a", cache)
+        self.assertIsNone(source.fobj)
+
+    def test_lru_max_open(self):
+        cache = UploadSourceCache(max_open=1)
+        alpha = cache.add("a", self.paths[0])
+        beta = cache.add("b", self.paths[1])
+        self.assertEqual(cache.read("a", 0, 3), b"foo")
+        self.assertEqual(cache.read("b", 0, 3), b"baz")
+        self.assertIsNone(alpha.fobj)  # closed least recently used
+        self.assertIsNotNone(beta.fobj)
+        self.assertEqual(cache.read("a", 3, 3), b"bar")  # reopened
+        self.assertIsNone(beta.fobj)
+        self.assertEqual(len(cache), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
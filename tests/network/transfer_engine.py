@@ -0,0 +1,118 @@
+import unittest
+from twisted.internet.task import Clock
+from storjnode.network import transfer_engine
+from storjnode.network.transfer_engine import TransferEngine
+from storjnode.network.transfer_engine import get_interest
+
+
+CONTRACT_ID = u"a" * 64
+
+
+class MockReactor(Clock):
+
+    def __init__(self):
+        Clock.__init__(self)
+        self.readers = set()
+        self.writers = set()
+
+    def addReader(self, reader):
+        self.readers.add(reader)
+
+    def removeReader(self, reader):
+        self.readers.discard(reader)
+
+    def addWriter(self, writer):
+        self.writers.add(writer)
+
+    def removeWriter(self, writer):
+        self.writers.discard(writer)
+
+
+class MockCon(object):
+
+    def __init__(self):
+        self.connected = 1
+        self.s = None
+
+
+class MockClient(object):
+
+    def __init__(self, con, direction):
+        self.direction = direction
+        self.cons = [con]
+        self.contracts = {CONTRACT_ID: {}}
+        self.con_transfer = {con: CONTRACT_ID}
+        self.con_info = {con: {CONTRACT_ID: {"remaining": 10}}}
+        self.con_mux = {}
+
+    def is_queued(self, con):
+        return int(bool(self.con_info[con][CONTRACT_ID]["remaining"]))
+
+    def get_direction(self, contract_id):
+        return self.direction
+
+
+class TestTransferEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.con = MockCon()
+        self.reactor = MockReactor()
+        self._process_con = transfer_engine.process_con
+
+    def tearDown(self):
+        transfer_engine.process_con = self._process_con
+
+    def test_get_interest(self):
+        client = MockClient(self.con, u"send")
+        self.assertEqual(get_interest(client, self.con), (0, 1))
+        client.direction = u"receive"
+        self.assertEqual(get_interest(client, self.con), (1, 0))
+        client.con_transfer[self.con] = u""  # waiting for contract id
+        self.assertEqual(get_interest(client, self.con), (1, 0))
+        client.con_transfer[self.con] = u"0" * 64  # end of queue
+        self.assertEqual(get_interest(client, self.con), (0, 0))
+        self.con.connected = 0
+        self.assertEqual(get_interest(client, self.con), (0, 0))
+
+    def test_service(self):
+        client = MockClient(self.con, u"receive")
+        engine = TransferEngine(client, reactor=self.reactor)
+        engine.watchers[self.con] = transfer_engine.ConnectionWatcher(
+            engine, self.con
+        )
+        engine.update_interest(self.con)
+        watcher = engine.watchers[self.con]
+        self.assertIn(watcher, self.reactor.readers)
+
+        # progress keeps the con registered
+        def process_con(client, con):
+            client.con_info[con][CONTRACT_ID]["remaining"] -= 5
+        transfer_engine.process_con = process_con
+        watcher.doRead()
+        self.assertIn(watcher, self.reactor.readers)
+
+        # no progress pauses the con for a moment
+        transfer_engine.process_con = lambda client, con: None
+        watcher.doRead()
+        self.assertNotIn(watcher, self.reactor.readers)
+        self.reactor.advance(transfer_engine.THROTTLE_DELAY)
+        self.assertIn(watcher, self.reactor.readers)
+
+        # transfer complete
+        transfer_engine.process_con = process_con
+        watcher.doRead()
+        self.assertNotIn(watcher, self.reactor.readers)
+
+    def test_connection_lost(self):
+        client = MockClient(self.con, u"send")
+        engine = TransferEngine(client, reactor=self.reactor)
+        watcher = transfer_engine.ConnectionWatcher(engine, self.con)
+        engine.watchers[self.con] = watcher
+        engine.update_interest(self.con)
+        self.assertIn(watcher, self.reactor.writers)
+        watcher.connectionLost(None)
+        self.assertNotIn(self.con, engine.watchers)
+
+
+if __name__ == "__main__":
+    unittest.main()
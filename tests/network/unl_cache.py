@@ -0,0 +1,94 @@
+import unittest
+from twisted.internet import defer
+from storjnode.network.unl_cache import UnlCache
+
+
+class MockLookup(object):
+
+    def __init__(self):
+        self.pending = []
+
+    def __call__(self):
+        d = defer.Deferred()
+        self.pending.append(d)
+        return d
+
+
+class TestUnlCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = UnlCache(ttl=10, lookup_timeout=5)
+        self.lookup = MockLookup()
+        self.results = []
+
+    def get(self, node_id, now=None):
+        d = self.cache.get(node_id, self.lookup, now=now)
+        d.addCallback(self.results.append)
+        return d
+
+    def test_single_flight(self):
+        self.get(b"a")
+        self.get(b"a")
+        self.get(b"b")
+        self.assertEqual(len(self.lookup.pending), 2)
+        self.lookup.pending[0].callback(u"unl_a")
+        self.assertEqual(self.results, [u"unl_a", u"unl_a"])
+        self.assertEqual(self.cache.info()["coalesced"], 1)
+
+        # cached
+        self.get(b"a")
+        self.assertEqual(len(self.lookup.pending), 2)
+        self.assertEqual(self.results[-1], u"unl_a")
+        self.assertEqual(self.cache.info()["hits"], 1)
+
+    def test_ttl(self):
+        self.get(b"a")
+        self.lookup.pending[0].callback(u"unl_a")
+        self.get(b"a", now=self.cache.unls[b"a"][1])  # expired
+        self.assertEqual(len(self.lookup.pending), 2)
+
+    def test_invalidate(self):
+        self.get(b"a")
+        self.lookup.pending[0].callback(u"unl_a")
+        self.cache.invalidate(b"a")
+        self.get(b"a")
+        self.assertEqual(len(self.lookup.pending), 2)
+
+    def test_not_found(self):
+        self.get(b"a")
+        self.lookup.pending[0].callback(None)
+        self.assertEqual(self.results, [None])
+        self.get(b"a")  # not cached
+        self.assertEqual(len(self.lookup.pending), 2)
+
+    def test_failure(self):
+        errors = []
+        self.get(b"a").addErrback(errors.append)
+        self.get(b"a").addErrback(errors.append)
+        self.lookup.pending[0].errback(Exception("foo"))
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(self.cache.lookups, {})
+
+    def test_lookup_timeout(self):
+        self.get(b"a", now=100)
+        self.get(b"a", now=104)
+        self.get(b"a", now=105)  # outstanding lookup too old
+        self.assertEqual(len(self.lookup.pending), 2)
+
+        # late response of the old lookup still reaches its callers
+        self.lookup.pending[0].callback(u"unl_a")
+        self.assertEqual(self.results, [u"unl_a", u"unl_a"])
+        self.assertIn(b"a", self.cache.lookups)  # new lookup still pending
+        self.lookup.pending[1].callback(u"unl_a")
+        self.assertEqual(len(self.results), 3)
+
+    def test_max_size(self):
+        self.cache.max_size = 2
+        for i, node_id in enumerate([b"a", b"b", b"c"]):
+            self.get(node_id)
+            self.lookup.pending[i].callback(u"unl")
+        self.assertEqual(list(self.cache.unls.keys()), [b"b", b"c"])
+
+
+if __name__ == "__main__":
+    unittest.main()
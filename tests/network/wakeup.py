@@ -0,0 +1,76 @@
+import unittest
+from storjnode.network.wakeup import Wakeup
+
+
+class MockReactor(object):
+    """Runs calls from other threads only when told to."""
+
+    def __init__(self):
+        self.calls = []
+
+    def callFromThread(self, f, *args, **kwargs):
+        self.calls.append((f, args, kwargs))
+
+    def run_calls(self):
+        calls, self.calls = self.calls, []
+        for f, args, kwargs in calls:
+            f(*args, **kwargs)
+
+
+class TestWakeup(unittest.TestCase):
+
+    def setUp(self):
+        self.reactor = MockReactor()
+        self.consumed = []
+        self.wakeup = Wakeup(self.consumer, reactor=self.reactor)
+
+    def consumer(self):
+        self.consumed.append(len(self.consumed))
+
+    def test_coalesce(self):
+        for i in range(10):
+            self.wakeup.notify()
+        self.assertEqual(len(self.reactor.calls), 1)
+        self.reactor.run_calls()
+        self.assertEqual(self.consumed, [0])
+
+        # can be woken again once run
+        self.wakeup.notify()
+        self.reactor.run_calls()
+        self.assertEqual(self.consumed, [0, 1])
+
+    def test_notify_while_running(self):
+        def consumer():
+            self.consumed.append(len(self.consumed))
+            if len(self.consumed) == 1:
+                self.wakeup.notify()
+                self.wakeup._run()  # reactor runs it while still busy
+        self.wakeup.consumer = consumer
+        self.wakeup.notify()
+        self.reactor.run_calls()
+        self.assertEqual(self.consumed, [0, 1])
+        self.assertFalse(self.wakeup.scheduled)
+        self.assertFalse(self.wakeup.running)
+
+    def test_stop(self):
+        self.wakeup.notify()
+        self.wakeup.stop()
+        self.reactor.run_calls()
+        self.wakeup.notify()
+        self.assertEqual(self.reactor.calls, [])
+        self.assertEqual(self.consumed, [])
+
+    def test_consumer_error(self):
+        def consumer():
+            self.consumed.append(None)
+            raise Exception("Boom!")
+        self.wakeup.consumer = consumer
+        self.wakeup.notify()
+        self.reactor.run_calls()
+        self.wakeup.notify()
+        self.reactor.run_calls()
+        self.assertEqual(len(self.consumed), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
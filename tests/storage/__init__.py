@@ -1,4 +1,5 @@
 from . shard import *  # NOQA
+from . index import *  # NOQA
 from . manager import *  # NOQA
 
 
@@ -0,0 +1,108 @@
+import os
+import shutil
+import unittest
+import tempfile
+import storjnode
+
+
+SHARD_PATH = storjnode.util.full_path(
+    os.path.join(os.path.dirname(__file__), "test.shard")
+)
+SHARD_ID = "61f21f335c9ef06cac682c0b4de8a8786883e15adea8546bf8ff1dff000189d3"
+
+
+class TestShardIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.store_path = tempfile.mkdtemp()
+        self.shard_path = os.path.join(self.store_path, SHARD_ID)
+        shutil.copy(SHARD_PATH, self.shard_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.store_path)
+
+    def test_rebuild_on_first_load(self):
+        index = storjnode.storage.index.ShardIndex(self.store_path)
+        self.assertEqual(index.find(SHARD_ID), self.shard_path)
+        self.assertEqual(len(index), 1)
+        index.close()
+
+    def test_persists_add_remove(self):
+        index = storjnode.storage.index.ShardIndex(self.store_path)
+        index.remove(SHARD_ID)
+        self.assertIsNone(index.find(SHARD_ID))
+        index.close()
+
+        # loaded from journal, not rebuilt from disc
+        index = storjnode.storage.index.ShardIndex(self.store_path)
+        self.assertNotIn(SHARD_ID, index)
+        index.add(SHARD_ID, self.shard_path)
+        index.close()
+
+        index = storjnode.storage.index.ShardIndex(self.store_path)
+        self.assertEqual(index.find(SHARD_ID), self.shard_path)
+        index.close()
+
+    def test_used(self):
+        index = storjnode.storage.index.ShardIndex(self.store_path)
+        self.assertEqual(index.used, 1024)
+        index.add(SHARD_ID, self.shard_path)  # re-adding does not count twice
+        self.assertEqual(index.used, 1024)
+        index.remove(SHARD_ID)
+        self.assertEqual(index.used, 0)
+        index.close()
+
+    def test_compact(self):
+        index = storjnode.storage.index.ShardIndex(
+            self.store_path, compact_min=4, compact_factor=2
+        )
+        for i in range(10):
+            index.add(SHARD_ID, self.shard_path)
+        index.close()
+        with open(index.index_path, "r") as fobj:
+            self.assertTrue(len(fobj.readlines()) <= 4)
+        index = storjnode.storage.index.ShardIndex(self.store_path)
+        self.assertEqual(index.find(SHARD_ID), self.shard_path)
+        index.close()
+
+    def test_reconcile(self):
+        index = storjnode.storage.index.ShardIndex(self.store_path)
+        os.remove(self.shard_path)
+        self.assertEqual(index.reconcile(), 1)
+        self.assertIsNone(index.find(SHARD_ID))
+        self.assertEqual(index.reconcile(), 0)
+        index.close()
+
+    def test_reconcile_concurrent_changes(self):
+        index = storjnode.storage.index.ShardIndex(self.store_path)
+        os.remove(self.shard_path)
+        index.remove(SHARD_ID)
+        scan = index._scan()  # before the shard is added again
+
+        shutil.copy(SHARD_PATH, self.shard_path)
+        index.add(SHARD_ID, self.shard_path)
+        index._scan = lambda: scan
+        self.assertEqual(index.reconcile(), 0)
+        self.assertEqual(index.find(SHARD_ID), self.shard_path)
+        self.assertEqual(index.used, 1024)
+
+        # removed after the scan found it
+        index._scan = lambda: {SHARD_ID: [SHARD_ID, 1024, 0]}
+        os.remove(self.shard_path)
+        index.remove(SHARD_ID)
+        self.assertEqual(index.reconcile(), 0)
+        self.assertNotIn(SHARD_ID, index)
+        index.close()
+
+    def test_rebuild_corrupt(self):
+        index_path = os.path.join(self.store_path,
+                                  storjnode.storage.index.INDEX_FILENAME)
+        with open(index_path, "w") as fobj:
+            fobj.write("not json\n")
+        index = storjnode.storage.index.ShardIndex(self.store_path)
+        self.assertEqual(index.find(SHARD_ID), self.shard_path)
+        index.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -111,6 +111,76 @@ class TestManager(unittest.TestCase):
             storjnode.storage.manager.remove({store_path: None}, shard_id)
             self.assertFalse(os.path.isfile(save_path))  # shard removed
 
+    def test_capacity(self):
+        store_path = os.path.join(self.base_dir, "lambda")
+        store_config = {store_path: {"limit": 2**20}}  # 1M
+        capacity = storjnode.storage.manager.capacity(store_config)
+        self.assertEqual(capacity, {"total": 2**20, "used": 0, "free": 2**20})
+        with open(SHARD_PATH, "rb") as shard:
+            storjnode.storage.manager.add(store_config, shard)
+            shard_id = storjnode.storage.shard.get_id(shard)
+        capacity = storjnode.storage.manager.capacity(store_config)
+        self.assertEqual(capacity["used"], 1024)
+        self.assertEqual(capacity["free"], 2**20 - 1024)
+        storjnode.storage.manager.remove(store_config, shard_id)
+        capacity = storjnode.storage.manager.capacity(store_config)
+        self.assertEqual(capacity["used"], 0)
+
+    def test_capacity_unlimited(self):
+        store_path = os.path.join(self.base_dir, "omicron")
+        store_config = {store_path: None}
+        with open(SHARD_PATH, "rb") as shard:
+            storjnode.storage.manager.add(store_config, shard)
+        with open(os.path.join(store_path, "foreign"), "wb") as fobj:
+            fobj.write(b"x" * 100)  # not a shard, not counted as used
+
+        get_free_space = storjnode.util.get_free_space
+        storjnode.util.get_free_space = lambda path: 2**20
+        try:
+            capacity = storjnode.storage.manager.capacity(store_config)
+        finally:
+            storjnode.util.get_free_space = get_free_space
+
+        # total is the free disc space plus the space used by shards
+        self.assertEqual(capacity, {"total": 2**20 + 1024, "used": 1024,
+                                    "free": 2**20})
+
+    def test_reconcile(self):
+        store_path = os.path.join(self.base_dir, "kappa")
+        store_config = {store_path: None}
+        with open(SHARD_PATH, "rb") as shard:
+            save_path = storjnode.storage.manager.add(store_config, shard)
+            shard_id = storjnode.storage.shard.get_id(shard)
+
+        # used space counts shards removed behind the managers back
+        os.remove(save_path)
+        capacity = storjnode.storage.manager.capacity(store_config)
+        self.assertEqual(capacity["used"], 1024)
+
+        # until the index is reconciled
+        self.assertEqual(storjnode.storage.manager.reconcile(store_config), 1)
+        capacity = storjnode.storage.manager.capacity(store_config)
+        self.assertEqual(capacity["used"], 0)
+        found = storjnode.storage.manager.find(store_config, shard_id)
+        self.assertIsNone(found)
+
+    def test_find_unindexed(self):
+        store_path = os.path.join(self.base_dir, "mu")
+        store_config = {store_path: None}
+        with open(SHARD_PATH, "rb") as shard:
+            shard_id = storjnode.storage.shard.get_id(shard)
+        self.assertIsNone(storjnode.storage.manager.find(store_config,
+                                                         shard_id))
+
+        # shards copied into the store are found and indexed
+        save_path = os.path.join(storjnode.util.full_path(store_path),
+                                 shard_id)
+        shutil.copy(SHARD_PATH, save_path)
+        found = storjnode.storage.manager.find(store_config, shard_id)
+        self.assertEqual(found, save_path)
+        capacity = storjnode.storage.manager.capacity(store_config)
+        self.assertEqual(capacity["used"], 1024)
+
     def test_get(self):
 
         # test success
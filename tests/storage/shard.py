@@ -1,3 +1,4 @@
+import io
 import os
 import filecmp
 import tempfile
@@ -62,9 +63,30 @@ class TestShard(unittest.TestCase):
     def test_save(self):
         save_path = tempfile.mktemp()
         storjnode.storage.shard.save(self.shard, save_path)
-        filecmp.cmp(SHARD_PATH, save_path)
+        self.assertTrue(filecmp.cmp(SHARD_PATH, save_path))
         os.remove(save_path)
 
+    def test_save_move(self):
+        src_path = tempfile.mktemp()
+        storjnode.storage.shard.save(self.shard, src_path)
+        save_path = tempfile.mktemp()
+        with open(src_path, "rb") as shard:
+            storjnode.storage.shard.save(shard, save_path, move=True)
+        self.assertFalse(os.path.exists(src_path))
+        self.assertTrue(filecmp.cmp(SHARD_PATH, save_path))
+        os.remove(save_path)
+
+    def test_copy(self):
+        fobj = io.BytesIO()
+        storjnode.storage.shard.copy(self.shard, fobj)
+        with open(SHARD_PATH, "rb") as shard:
+            self.assertEqual(fobj.getvalue(), shard.read())
+
+    def test_get_path(self):
+        self.assertEqual(storjnode.storage.shard.get_path(self.shard),
+                         SHARD_PATH)
+        self.assertIsNone(storjnode.storage.shard.get_path(io.BytesIO()))
+
 
 if __name__ == "__main__":
     unittest.main()